@@ -1325,6 +1325,48 @@ def update_chunk(tenant_id, dataset_id, document_id, chunk_id):
     return get_result()
 
 
+def check_retrieval_datasets(req, tenant_id):
+    """
+    Checks the `dataset_ids` of a retrieval request. Returns an error response, or None with
+    the dataset ids and the datasets.
+    """
+    if not req.get("dataset_ids"):
+        return get_error_data_result("`dataset_ids` is required."), None, None
+    kb_ids = req["dataset_ids"]
+    if not isinstance(kb_ids, list):
+        return get_error_data_result("`dataset_ids` should be a list"), None, None
+    for id in kb_ids:
+        if not KnowledgebaseService.accessible(kb_id=id, user_id=tenant_id):
+            return get_error_data_result(f"You don't own the dataset {id}."), None, None
+    kbs = KnowledgebaseService.get_by_ids(kb_ids)
+    embd_nms = list(set([TenantLLMService.split_model_name_and_factory(kb.embd_id)[0] for kb in kbs]))  # remove vendor suffix for comparison
+    if len(embd_nms) != 1:
+        return get_result(
+            message='Datasets use different embedding models."',
+            code=RetCode.DATA_ERROR,
+        ), None, None
+    return None, kb_ids, kbs
+
+
+def retrieval_doc_ids(req, kb_ids):
+    """
+    Checks the `document_ids` of a retrieval request, or applies its `metadata_condition` if
+    there are none. Returns an error response, or None with the ids of the documents to search.
+    """
+    doc_ids = req.get("document_ids", [])
+    if not isinstance(doc_ids, list):
+        return get_error_data_result("`documents` should be a list"), None
+    doc_ids_list = KnowledgebaseService.list_documents_by_ids(kb_ids)
+    for doc_id in doc_ids:
+        if doc_id not in doc_ids_list:
+            return get_error_data_result(f"The datasets don't own the document {doc_id}"), None
+    if not doc_ids:
+        metadata_condition = req.get("metadata_condition", {})
+        metas = DocumentService.get_meta_by_kbs(kb_ids)
+        doc_ids = meta_filter(metas, convert_conditions(metadata_condition))
+    return None, doc_ids
+
+
 @manager.route("/retrieval", methods=["POST"])  # noqa: F821
 @token_required
 def retrieval_test(tenant_id):
@@ -1409,39 +1451,19 @@ def retrieval_test(tenant_id):
                     description: Similarity score.
     """
     req = request.json
-    if not req.get("dataset_ids"):
-        return get_error_data_result("`dataset_ids` is required.")
-    kb_ids = req["dataset_ids"]
-    if not isinstance(kb_ids, list):
-        return get_error_data_result("`dataset_ids` should be a list")
-    for id in kb_ids:
-        if not KnowledgebaseService.accessible(kb_id=id, user_id=tenant_id):
-            return get_error_data_result(f"You don't own the dataset {id}.")
-    kbs = KnowledgebaseService.get_by_ids(kb_ids)
-    embd_nms = list(set([TenantLLMService.split_model_name_and_factory(kb.embd_id)[0] for kb in kbs]))  # remove vendor suffix for comparison
-    if len(embd_nms) != 1:
-        return get_result(
-            message='Datasets use different embedding models."',
-            code=RetCode.DATA_ERROR,
-        )
+    err, kb_ids, kbs = check_retrieval_datasets(req, tenant_id)
+    if err:
+        return err
     if "question" not in req:
         return get_error_data_result("`question` is required.")
     page = int(req.get("page", 1))
     size = int(req.get("page_size", 30))
     question = req["question"]
-    doc_ids = req.get("document_ids", [])
     use_kg = req.get("use_kg", False)
     langs = req.get("cross_languages", [])
-    if not isinstance(doc_ids, list):
-        return get_error_data_result("`documents` should be a list")
-    doc_ids_list = KnowledgebaseService.list_documents_by_ids(kb_ids)
-    for doc_id in doc_ids:
-        if doc_id not in doc_ids_list:
-            return get_error_data_result(f"The datasets don't own the document {doc_id}")
-    if not doc_ids:
-        metadata_condition = req.get("metadata_condition", {})
-        metas = DocumentService.get_meta_by_kbs(kb_ids)
-        doc_ids = meta_filter(metas, convert_conditions(metadata_condition))
+    err, doc_ids = retrieval_doc_ids(req, kb_ids)
+    if err:
+        return err
     similarity_threshold = float(req.get("similarity_threshold", 0.2))
     vector_similarity_weight = float(req.get("vector_similarity_weight", 0.3))
     top = int(req.get("top_k", 1024))
@@ -1487,27 +1509,7 @@ def retrieval_test(tenant_id):
             if ck["content_with_weight"]:
                 ranks["chunks"].insert(0, ck)
 
-        for c in ranks["chunks"]:
-            c.pop("vector", None)
-
-        ##rename keys
-        renamed_chunks = []
-        for chunk in ranks["chunks"]:
-            key_mapping = {
-                "chunk_id": "id",
-                "content_with_weight": "content",
-                "doc_id": "document_id",
-                "important_kwd": "important_keywords",
-                "question_kwd": "questions",
-                "docnm_kwd": "document_keyword",
-                "kb_id": "dataset_id",
-            }
-            rename_chunk = {}
-            for key, value in chunk.items():
-                new_key = key_mapping.get(key, key)
-                rename_chunk[new_key] = value
-            renamed_chunks.append(rename_chunk)
-        ranks["chunks"] = renamed_chunks
+        ranks["chunks"] = rename_retrieved_chunks(ranks["chunks"])
         return get_result(data=ranks)
     except Exception as e:
         if str(e).find("not_found") > 0:
@@ -1516,3 +1518,142 @@ def retrieval_test(tenant_id):
                 code=RetCode.DATA_ERROR,
             )
         return server_error_response(e)
+
+
+def rename_retrieved_chunks(chunks):
+    key_mapping = {
+        "chunk_id": "id",
+        "content_with_weight": "content",
+        "doc_id": "document_id",
+        "important_kwd": "important_keywords",
+        "question_kwd": "questions",
+        "docnm_kwd": "document_keyword",
+        "kb_id": "dataset_id",
+    }
+    renamed_chunks = []
+    for chunk in chunks:
+        chunk.pop("vector", None)
+        renamed_chunks.append({key_mapping.get(key, key): value for key, value in chunk.items()})
+    return renamed_chunks
+
+
+MAX_BATCH_QUESTIONS = 256
+
+
+@manager.route("/retrieval/batch", methods=["POST"])  # noqa: F821
+@token_required
+def retrieval_batch(tenant_id):
+    """
+    Retrieve chunks for many queries at once.
+    ---
+    tags:
+      - Retrieval
+    security:
+      - ApiKeyAuth: []
+    parameters:
+      - in: body
+        name: body
+        description: Retrieval parameters, shared by all questions.
+        required: true
+        schema:
+          type: object
+          properties:
+            dataset_ids:
+              type: array
+              items:
+                type: string
+              required: true
+              description: List of dataset IDs to search in.
+            questions:
+              type: array
+              items:
+                type: string
+              required: true
+              description: Query strings, at most 256.
+            document_ids:
+              type: array
+              items:
+                type: string
+              description: List of document IDs to filter.
+            similarity_threshold:
+              type: number
+              format: float
+              description: Similarity threshold.
+            vector_similarity_weight:
+              type: number
+              format: float
+              description: Vector similarity weight.
+            top_k:
+              type: integer
+              description: Maximum number of chunks to return.
+            highlight:
+              type: boolean
+              description: Whether to highlight matched content.
+            metadata_condition:
+              type: object
+              description: metadata filter condition.
+      - in: header
+        name: Authorization
+        type: string
+        required: true
+        description: Bearer token for authentication.
+    responses:
+      200:
+        description: Retrieval results of each question, in order.
+        schema:
+          type: object
+          properties:
+            results:
+              type: array
+              items:
+                type: object
+                description: Same as the result of /retrieval.
+    """
+    req = request.json
+    err, kb_ids, kbs = check_retrieval_datasets(req, tenant_id)
+    if err:
+        return err
+    questions = req.get("questions")
+    if not isinstance(questions, list) or not questions or not all(isinstance(q, str) for q in questions):
+        return get_error_data_result("`questions` should be a non-empty list of strings.")
+    if len(questions) > MAX_BATCH_QUESTIONS:
+        return get_error_data_result(f"At most {MAX_BATCH_QUESTIONS} questions are allowed in a batch.")
+    err, doc_ids = retrieval_doc_ids(req, kb_ids)
+    if err:
+        return err
+    highlight = req.get("highlight") not in ["False", "false"]
+    try:
+        tenant_ids = list(set([kb.tenant_id for kb in kbs]))
+        e, kb = KnowledgebaseService.get_by_id(kb_ids[0])
+        if not e:
+            return get_error_data_result(message="Dataset not found!")
+        embd_mdl = LLMBundle(kb.tenant_id, LLMType.EMBEDDING, llm_name=kb.embd_id)
+        rerank_mdl = None
+        if req.get("rerank_id"):
+            rerank_mdl = LLMBundle(kb.tenant_id, LLMType.RERANK, llm_name=req["rerank_id"])
+
+        results = settings.retriever.retrieval_batch(
+            questions,
+            embd_mdl,
+            tenant_ids,
+            kb_ids,
+            int(req.get("page", 1)),
+            int(req.get("page_size", 30)),
+            float(req.get("similarity_threshold", 0.2)),
+            float(req.get("vector_similarity_weight", 0.3)),
+            int(req.get("top_k", 1024)),
+            doc_ids,
+            rerank_mdl=rerank_mdl,
+            highlight=highlight,
+            rank_feature=[label_question(q, kbs) for q in questions],
+        )
+        for ranks in results:
+            ranks["chunks"] = rename_retrieved_chunks(ranks["chunks"])
+        return get_result(data={"results": results})
+    except Exception as e:
+        if str(e).find("not_found") > 0:
+            return get_result(
+                message="No chunk found! Check the chunk status please!",
+                code=RetCode.DATA_ERROR,
+            )
+        return server_error_response(e)
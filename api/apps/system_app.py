@@ -13,7 +13,9 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License
 #
+import hmac
 import logging
+import os
 from datetime import datetime
 import json
 
@@ -34,9 +36,14 @@ from common.time_utils import current_timestamp, datetime_format
 from timeit import default_timer as timer
 
 from rag.utils.redis_conn import REDIS_CONN
-from flask import jsonify
+from flask import Response, jsonify, request
 from api.utils.health_utils import run_health_checks
 from common import settings
+from common.metrics import REGISTRY
+
+# /metrics is off unless enabled, and needs `Authorization: Bearer <METRICS_TOKEN>` when a token is set.
+METRICS_ENABLED = int(os.environ.get("METRICS_ENABLED", "0"))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
 
 
 @manager.route("/version", methods=["GET"])  # noqa: F821
@@ -177,6 +184,15 @@ def healthz():
     return jsonify(result), (200 if all_ok else 500)
 
 
+@manager.route("/metrics", methods=["GET"])  # noqa: F821
+def metrics():
+    if not METRICS_ENABLED:
+        return "Not Found", 404
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        return "Unauthorized", 401
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
 @manager.route("/ping", methods=["GET"]) # noqa: F821
 def ping():
     return "pong", 200
@@ -14,9 +14,12 @@
 #  limitations under the License.
 #
 import binascii
+import json
 import logging
+import os
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
 from copy import deepcopy
 from datetime import datetime
 from functools import partial
@@ -37,6 +40,7 @@ from common.time_utils import current_timestamp, datetime_format
 from graphrag.general.mind_map_extractor import MindMapExtractor
 from rag.app.resume import forbidden_select_fields4resume
 from rag.app.tag import label_question
+from rag.nlp import rag_tokenizer
 from rag.nlp.search import index_name
 from rag.prompts.generator import chunks_format, citation_prompt, cross_languages, full_question, kb_prompt, keyword_extraction, message_fit_in, \
     gen_meta_filter, PROMPT_JINJA_ENV, ASK_SUMMARY
@@ -44,6 +48,25 @@ from common.token_utils import num_tokens_from_string
 from rag.utils.tavily_conn import Tavily
 from common.string_utils import remove_redundant_spaces
 from common import settings
+from common.metrics import Counter, Histogram, RequestRecord, current_record, run_with_record
+
+# Seconds to wait for each retrieval source of a chat turn before answering without it.
+CHAT_RETRIEVAL_TIMEOUT = float(os.environ.get("CHAT_RETRIEVAL_TIMEOUT", "60"))
+CHAT_WEB_SEARCH_TIMEOUT = float(os.environ.get("CHAT_WEB_SEARCH_TIMEOUT", "20"))
+retrieval_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("CHAT_RETRIEVAL_WORKERS", "16")),
+                                        thread_name_prefix="chat_retrieval")
+# LLM calls refining the question get their own threads: when they time out they keep running,
+# and must not hold up retrievals meanwhile.
+refine_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("CHAT_REFINE_WORKERS", "16")),
+                                     thread_name_prefix="chat_refine")
+# Start knowledge base retrieval for the last user message while it is rewritten by the LLM,
+# and keep the results if the rewritten question shares this much of its term weight with it.
+CHAT_SPECULATIVE_RETRIEVAL = int(os.environ.get("CHAT_SPECULATIVE_RETRIEVAL", "0"))
+CHAT_SPECULATIVE_SIMILARITY = float(os.environ.get("CHAT_SPECULATIVE_SIMILARITY", "0.8"))
+
+# Tenant and dialog are in the logged record only, as labels they would grow without bound.
+CHAT_STAGE_SECONDS = Histogram("ragflow_chat_stage_seconds", "Duration of the stages of a chat turn.", ["stage", "model"])
+SPECULATIVE_RETRIEVALS = Counter("ragflow_chat_speculative_retrievals", "Speculative retrievals by outcome.", ["result"])
 
 
 class DialogService(CommonService):
@@ -337,6 +360,54 @@ def meta_filter(metas: dict, filters: list[dict]):
     return list(doc_ids)
 
 
+def run_concurrently(tasks: dict, record: RequestRecord | None = None, executor: ThreadPoolExecutor | None = None) -> dict:
+    """
+    Run independent `name: (callable, timeout)` tasks in parallel on `executor`, the retrieval
+    one by default, and return `name: result` in the order of `tasks`. A task not done within
+    its timeout maps to None and is logged; it is cancelled if it hasn't started yet, and left
+    running otherwise. An exception is raised for the first failing task in that order, as it
+    would be if the tasks ran one after another. The tasks' stages are timed in `record`,
+    the current one by default.
+    """
+    if record is None:
+        record = current_record()
+    if len(tasks) <= 1:
+        return {name: run_with_record(record, fn) for name, (fn, _) in tasks.items()}
+
+    st = timer()
+    executor = executor or retrieval_executor
+    futures = {name: (executor.submit(run_with_record, record, fn), timeout) for name, (fn, timeout) in tasks.items()}
+    res = {}
+    for name, (future, timeout) in futures.items():
+        # A TimeoutError raised by the task itself is its failure, not a missed deadline.
+        if not wait_futures([future], timeout=max(0., st + timeout - timer())).done:
+            future.cancel()
+            logging.warning(f"{name} didn't finish within {timeout}s, continue without it")
+            res[name] = None
+            continue
+        res[name] = future.result()
+    return res
+
+
+def merge_retrievals(primary: dict, secondary: dict, top_n: int) -> dict:
+    """
+    Merge two retrievals from the same knowledge bases into the `top_n` most similar chunks.
+    A chunk found by both keeps its higher similarity.
+    """
+    chunks = {}
+    for ck in primary["chunks"] + secondary["chunks"]:
+        if ck["chunk_id"] not in chunks or ck["similarity"] > chunks[ck["chunk_id"]]["similarity"]:
+            chunks[ck["chunk_id"]] = ck
+    chunks = sorted(chunks.values(), key=lambda ck: ck["similarity"] * -1)[:top_n]
+    doc_aggs = {}
+    for ck in chunks:
+        if ck["docnm_kwd"] not in doc_aggs:
+            doc_aggs[ck["docnm_kwd"]] = {"doc_name": ck["docnm_kwd"], "doc_id": ck["doc_id"], "count": 0}
+        doc_aggs[ck["docnm_kwd"]]["count"] += 1
+    return {"total": max(primary["total"], secondary["total"]), "chunks": chunks,
+            "doc_aggs": sorted(doc_aggs.values(), key=lambda x: x["count"] * -1)}
+
+
 def chat(dialog, messages, stream=True, **kwargs):
     assert messages[-1]["role"] == "user", "The last content of this conversation is not from user."
     if not dialog.kb_ids and not dialog.prompt_config.get("tavily_api_key"):
@@ -345,6 +416,7 @@ def chat(dialog, messages, stream=True, **kwargs):
         return None
 
     chat_start_ts = timer()
+    record = RequestRecord("chat", tenant=dialog.tenant_id, dialog=dialog.id, model=dialog.llm_id)
 
     if TenantLLMService.llm_id2llm_type(dialog.llm_id) == "image2text":
         llm_model_config = TenantLLMService.get_model_config(dialog.tenant_id, LLMType.IMAGE2TEXT, dialog.llm_id)
@@ -373,6 +445,7 @@ def chat(dialog, messages, stream=True, **kwargs):
     bind_models_ts = timer()
 
     retriever = settings.retriever
+    tenant_ids = list(set([kb.tenant_id for kb in kbs]))
     questions = [m["content"] for m in messages if m["role"] == "user"][-3:]
     attachments = kwargs["doc_ids"].split(",") if "doc_ids" in kwargs else []
     if "doc_ids" in messages[-1]:
@@ -396,6 +469,49 @@ def chat(dialog, messages, stream=True, **kwargs):
         if p["key"] not in kwargs:
             prompt_config["system"] = prompt_config["system"].replace("{%s}" % p["key"], " ")
 
+    def search_kb(question):
+        return retriever.retrieval(
+            question,
+            embd_mdl,
+            tenant_ids,
+            dialog.kb_ids,
+            1,
+            dialog.top_n,
+            dialog.similarity_threshold,
+            dialog.vector_similarity_weight,
+            doc_ids=attachments,
+            top=dialog.top_k,
+            aggs=False,
+            rerank_mdl=rerank_mdl,
+            rank_feature=label_question(question, kbs),
+        )
+
+    # Rewriting the question takes LLM round trips. The knowledge base is searched for the
+    # last user message meanwhile, as the rewrite usually keeps its terms. With a metadata
+    # filter the documents to search are only known afterwards, so nothing is speculated.
+    speculative, raw_question = None, questions[-1]
+    rewrites = (len(questions) > 1 and prompt_config.get("refine_multiturn")) or prompt_config.get("cross_languages") or prompt_config.get("keyword", False)
+    if (CHAT_SPECULATIVE_RETRIEVAL and rewrites and embd_mdl and not dialog.meta_data_filter and not prompt_config.get("reasoning", False)
+            and "knowledge" in [p["key"] for p in prompt_config["parameters"]]):
+        speculative = retrieval_executor.submit(run_with_record, record, search_kb, raw_question)
+        speculative_ts = timer()
+
+    def search_kb_speculatively(question):
+        close = question == raw_question or retriever.qryr.token_similarity(
+            rag_tokenizer.tokenize(question), [rag_tokenizer.tokenize(raw_question)])[0] >= CHAT_SPECULATIVE_SIMILARITY
+        res = None if close else search_kb(question)
+        try:
+            spec = speculative.result(timeout=max(0., speculative_ts + CHAT_RETRIEVAL_TIMEOUT - timer()))
+        except Exception as e:
+            logging.warning(f"Speculative retrieval of {raw_question!r} failed: {e}")
+            SPECULATIVE_RETRIEVALS.inc(result="failed")
+            return res if res is not None else search_kb(question)
+        if close:
+            SPECULATIVE_RETRIEVALS.inc(result="kept")
+            return spec
+        SPECULATIVE_RETRIEVALS.inc(result="merged")
+        return merge_retrievals(res, spec, dialog.top_n)
+
     if len(questions) > 1 and prompt_config.get("refine_multiturn"):
         questions = [full_question(dialog.tenant_id, dialog.llm_id, messages)]
     else:
@@ -404,20 +520,29 @@ def chat(dialog, messages, stream=True, **kwargs):
     if prompt_config.get("cross_languages"):
         questions = [cross_languages(dialog.tenant_id, dialog.llm_id, questions[0], prompt_config["cross_languages"])]
 
+    # The metadata filter and the keywords are both derived from the refined question,
+    # so their LLM calls run side by side.
+    refine_tasks = {}
     if dialog.meta_data_filter:
         metas = DocumentService.get_meta_by_kbs(dialog.kb_ids)
         if dialog.meta_data_filter.get("method") == "auto":
-            filters = gen_meta_filter(chat_mdl, metas, questions[-1])
-            attachments.extend(meta_filter(metas, filters))
-            if not attachments:
-                attachments = None
+            refine_tasks["meta_filter"] = (partial(gen_meta_filter, chat_mdl, metas, questions[-1]), CHAT_RETRIEVAL_TIMEOUT)
         elif dialog.meta_data_filter.get("method") == "manual":
             attachments.extend(meta_filter(metas, dialog.meta_data_filter["manual"]))
             if not attachments:
                 attachments = None
-
     if prompt_config.get("keyword", False):
-        questions[-1] += keyword_extraction(chat_mdl, questions[-1])
+        refine_tasks["keyword_extraction"] = (partial(keyword_extraction, chat_mdl, questions[-1]), CHAT_RETRIEVAL_TIMEOUT)
+
+    refined = run_concurrently(refine_tasks, record, refine_executor)
+    if "meta_filter" in refined:
+        # Without the filter nothing is known to match, so no document is searched, rather than all.
+        if refined["meta_filter"] is not None:
+            attachments.extend(meta_filter(metas, refined["meta_filter"]))
+        if not attachments:
+            attachments = None
+    if refined.get("keyword_extraction"):
+        questions[-1] += refined["keyword_extraction"]
 
     refine_question_ts = timer()
 
@@ -426,7 +551,6 @@ def chat(dialog, messages, stream=True, **kwargs):
     knowledges = []
 
     if attachments is not None and "knowledge" in [p["key"] for p in prompt_config["parameters"]]:
-        tenant_ids = list(set([kb.tenant_id for kb in kbs]))
         knowledges = []
         if prompt_config.get("reasoning", False):
             reasoner = DeepResearcher(
@@ -452,43 +576,57 @@ def chat(dialog, messages, stream=True, **kwargs):
                 elif stream:
                     yield think
         else:
-            if embd_mdl:
-                kbinfos = retriever.retrieval(
-                    " ".join(questions),
-                    embd_mdl,
-                    tenant_ids,
-                    dialog.kb_ids,
-                    1,
-                    dialog.top_n,
-                    dialog.similarity_threshold,
-                    dialog.vector_similarity_weight,
-                    doc_ids=attachments,
-                    top=dialog.top_k,
-                    aggs=False,
-                    rerank_mdl=rerank_mdl,
-                    rank_feature=label_question(" ".join(questions), kbs),
-                )
+            question = " ".join(questions)
+
+            def retrieve_kb():
+                res = search_kb(question) if speculative is None else search_kb_speculatively(question)
                 if prompt_config.get("toc_enhance"):
-                    cks = retriever.retrieval_by_toc(" ".join(questions), kbinfos["chunks"], tenant_ids, chat_mdl, dialog.top_n)
+                    cks = retriever.retrieval_by_toc(question, res["chunks"], tenant_ids, chat_mdl, dialog.top_n)
                     if cks:
-                        kbinfos["chunks"] = cks
+                        res["chunks"] = cks
+                return res
+
+            def retrieve_kg():
+                return settings.kg_retriever.retrieval(question, tenant_ids, dialog.kb_ids, embd_mdl,
+                                                       LLMBundle(dialog.tenant_id, LLMType.CHAT))
+
+            # The sources are independent: fetch them in parallel and merge in a fixed order.
+            sources = {}
+            if embd_mdl:
+                sources["kb"] = (retrieve_kb, CHAT_RETRIEVAL_TIMEOUT)
             if prompt_config.get("tavily_api_key"):
-                tav = Tavily(prompt_config["tavily_api_key"])
-                tav_res = tav.retrieve_chunks(" ".join(questions))
-                kbinfos["chunks"].extend(tav_res["chunks"])
-                kbinfos["doc_aggs"].extend(tav_res["doc_aggs"])
+                sources["web"] = (partial(Tavily(prompt_config["tavily_api_key"]).retrieve_chunks, question), CHAT_WEB_SEARCH_TIMEOUT)
             if prompt_config.get("use_kg"):
-                ck = settings.kg_retriever.retrieval(" ".join(questions), tenant_ids, dialog.kb_ids, embd_mdl,
-                                                       LLMBundle(dialog.tenant_id, LLMType.CHAT))
-                if ck["content_with_weight"]:
-                    kbinfos["chunks"].insert(0, ck)
+                sources["kg"] = (retrieve_kg, CHAT_RETRIEVAL_TIMEOUT)
+            retrieved = run_concurrently(sources, record)
+
+            if retrieved.get("kb"):
+                kbinfos = retrieved["kb"]
+            if retrieved.get("web"):
+                kbinfos["chunks"].extend(retrieved["web"]["chunks"])
+                kbinfos["doc_aggs"].extend(retrieved["web"]["doc_aggs"])
+            if retrieved.get("kg") and retrieved["kg"]["content_with_weight"]:
+                kbinfos["chunks"].insert(0, retrieved["kg"])
 
             knowledges = kb_prompt(kbinfos, max_tokens)
 
     logging.debug("{}->{}".format(" ".join(questions), "\n->".join(knowledges)))
 
     retrieval_ts = timer()
+
+    def observe_stages(finish_ts):
+        record.add("check_llm", check_llm_ts - chat_start_ts)
+        record.add("check_langfuse_tracer", check_langfuse_tracer_ts - check_llm_ts)
+        record.add("bind_models", bind_models_ts - check_langfuse_tracer_ts)
+        record.add("refine_question", refine_question_ts - bind_models_ts)
+        record.add("retrieval", retrieval_ts - refine_question_ts)
+        record.add("generate", finish_ts - retrieval_ts)
+        record.add("total", finish_ts - chat_start_ts)
+        record.observe(CHAT_STAGE_SECONDS)
+        logging.info(f"chat stages: {json.dumps(record.to_dict(), ensure_ascii=False)}")
+
     if not knowledges and prompt_config.get("empty_response"):
+        observe_stages(timer())
         empty_res = prompt_config["empty_response"]
         yield {"answer": empty_res, "reference": kbinfos, "prompt": "\n\n### Query:\n%s" % " ".join(questions),
                "audio_binary": tts(tts_mdl, empty_res)}
@@ -560,6 +698,7 @@ def chat(dialog, messages, stream=True, **kwargs):
         refine_question_time_cost = (refine_question_ts - bind_models_ts) * 1000
         retrieval_time_cost = (retrieval_ts - refine_question_ts) * 1000
         generate_result_time_cost = (finish_chat_ts - retrieval_ts) * 1000
+        observe_stages(finish_chat_ts)
 
         tk_num = num_tokens_from_string(think + answer)
         prompt += "\n\n### Query:\n%s" % " ".join(questions)
@@ -593,10 +732,15 @@ def chat(dialog, messages, stream=True, **kwargs):
             input={"prompt": prompt, "prompt4citation": prompt4citation, "messages": msg}
         )
 
+    generate_start_ts = timer()
     if stream:
         last_ans = ""
         answer = ""
+        first_token = True
         for ans in chat_mdl.chat_streamly(prompt + prompt4citation, msg[1:], gen_conf):
+            if first_token:
+                record.add("llm_ttft", timer() - generate_start_ts)
+                first_token = False
             if thought:
                 ans = re.sub(r"^.*</think>", "", ans, flags=re.DOTALL)
             answer = ans
@@ -611,6 +755,7 @@ def chat(dialog, messages, stream=True, **kwargs):
         yield decorate_answer(thought + answer)
     else:
         answer = chat_mdl.chat(prompt + prompt4citation, msg[1:], gen_conf)
+        record.add("llm", timer() - generate_start_ts)
         user_content = msg[-1].get("content", "[content not available]")
         logging.debug("User: {}|Assistant: {}".format(user_content, answer))
         res = decorate_answer(answer)
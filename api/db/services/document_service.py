@@ -299,9 +299,18 @@ class DocumentService(CommonService):
     @DB.connection_context()
     def remove_document(cls, doc, tenant_id):
         from api.db.services.task_service import TaskService
+        from api.db.services.file2document_service import File2DocumentService
+        from deepdoc.parser.page_cache import PDF_PAGE_CACHE, remove_cached_pages
         cls.clear_chunk_num(doc.id)
         try:
             TaskService.filter_delete([Task.doc_id == doc.id])
+            if PDF_PAGE_CACHE and doc.type == FileType.PDF.value:
+                try:
+                    binary = settings.STORAGE_IMPL.get(*File2DocumentService.get_storage_address(doc_id=doc.id))
+                    if binary:
+                        remove_cached_pages(binary)
+                except Exception:
+                    logging.exception(f"Fail to remove the page cache of {doc.id}")
             page = 0
             page_size = 1000
             all_chunk_ids = []
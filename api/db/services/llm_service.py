@@ -22,6 +22,7 @@ from typing import Generator
 from api.db.db_models import LLM
 from api.db.services.common_service import CommonService
 from api.db.services.tenant_llm_service import LLM4Tenant, TenantLLMService
+from rag.utils.embedding_cache import encode_with_cache, encode_query_with_cache
 
 
 class LLMService(CommonService):
@@ -91,7 +92,7 @@ class LLMBundle(LLM4Tenant):
             else:
                 safe_texts.append(text)
                 
-        embeddings, used_tokens = self.mdl.encode(safe_texts)
+        embeddings, used_tokens = encode_with_cache(self.cache_model, safe_texts, self.mdl.encode)
 
         llm_name = getattr(self, "llm_name", None)
         if not TenantLLMService.increase_usage(self.tenant_id, self.llm_type, used_tokens, llm_name):
@@ -107,7 +108,7 @@ class LLMBundle(LLM4Tenant):
         if self.langfuse:
             generation = self.langfuse.start_generation(trace_context=self.trace_context, name="encode_queries", model=self.llm_name, input={"query": query})
 
-        emd, used_tokens = self.mdl.encode_queries(query)
+        emd, used_tokens = encode_query_with_cache(self.cache_model, query, self.mdl.encode_queries)
         llm_name = getattr(self, "llm_name", None)
         if not TenantLLMService.increase_usage(self.tenant_id, self.llm_type, used_tokens, llm_name):
             logging.error("LLMBundle.encode_queries can't update token usage for {}/EMBEDDING used_tokens: {}".format(self.tenant_id, used_tokens))
@@ -118,6 +119,21 @@ class LLMBundle(LLM4Tenant):
 
         return emd, used_tokens
 
+    def encode_queries_batch(self, queries: list):
+        if self.langfuse:
+            generation = self.langfuse.start_generation(trace_context=self.trace_context, name="encode_queries_batch", model=self.llm_name, input={"queries": queries})
+
+        embeddings, used_tokens = encode_with_cache(self.cache_model, queries, self.mdl.encode_queries_batch, kind="query")
+        llm_name = getattr(self, "llm_name", None)
+        if not TenantLLMService.increase_usage(self.tenant_id, self.llm_type, used_tokens, llm_name):
+            logging.error("LLMBundle.encode_queries_batch can't update token usage for {}/EMBEDDING used_tokens: {}".format(self.tenant_id, used_tokens))
+
+        if self.langfuse:
+            generation.update(usage_details={"total_tokens": used_tokens})
+            generation.end()
+
+        return embeddings, used_tokens
+
     def similarity(self, query: str, texts: list):
         if self.langfuse:
             generation = self.langfuse.start_generation(trace_context=self.trace_context, name="similarity", model=self.llm_name, input={"query": query, "texts": texts})
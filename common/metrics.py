@@ -0,0 +1,220 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+In-process metrics rendered in the Prometheus text exposition format, and per-request
+stage timing.
+
+A request opens a `RequestRecord` with `request_record(...)`, or binds one around single
+calls with `run_with_record(...)` where a context manager can't span it, like a generator
+that yields in between. Code running below times its stages with `with stage("search"):`.
+Each stage is observed in `ragflow_stage_seconds` and added to the current record, which
+the request observes in its own labelled histogram once done.
+"""
+
+import contextvars
+import math
+import threading
+from contextlib import contextmanager
+from timeit import default_timer as timer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(v) -> str:
+    if v == math.inf:
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for m in metrics:
+            lines.append(f"# HELP {m.name} {m.documentation}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines.extend(m.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self.lock:
+            return self.values.get(key, 0)
+
+    def samples(self) -> list[str]:
+        with self.lock:
+            values = dict(self.values)
+        return [f"{self.name}_total{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in values.items()]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # labels -> [per-bucket counts, sum, count]
+        self.values = {}
+        self.lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self.lock:
+            v = self.values.get(key)
+            if v is None:
+                v = self.values[key] = [[0] * len(self.buckets), 0., 0]
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    v[0][i] += 1
+                    break
+            v[1] += value
+            v[2] += 1
+
+    def get(self, **labels) -> tuple[float, int]:
+        """Sum and count of the observations with these labels."""
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self.lock:
+            v = self.values.get(key)
+            return (v[1], v[2]) if v else (0., 0)
+
+    def samples(self) -> list[str]:
+        with self.lock:
+            values = {k: ([*v[0]], v[1], v[2]) for k, v in self.values.items()}
+        lines = []
+        for key, (counts, total, count) in values.items():
+            cumulative = 0
+            for b, c in zip(self.buckets, counts):
+                cumulative += c
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', _format_value(b)))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("ragflow_stage_seconds", "Duration of request stages such as embedding, search and rerank.", ["stage"])
+
+
+class RequestRecord:
+    """Stage durations, in seconds, of one request. Stages hit more than once add up."""
+
+    def __init__(self, name: str, **labels):
+        self.name = name
+        self.labels = labels
+        self.stages = {}
+        self.start = timer()
+        self.lock = threading.Lock()
+
+    def add(self, stage_name: str, seconds: float):
+        with self.lock:
+            self.stages[stage_name] = self.stages.get(stage_name, 0.) + seconds
+
+    def observe(self, histogram: Histogram):
+        """Observe every stage in `histogram`, labelled with the stage and the record's labels."""
+        with self.lock:
+            stages = dict(self.stages)
+        for k, v in stages.items():
+            histogram.observe(v, stage=k, **self.labels)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            stages = {k: round(v * 1000, 1) for k, v in self.stages.items()}
+        return {"request": self.name, **self.labels, "stages_ms": stages}
+
+
+_current_record = contextvars.ContextVar("request_record", default=None)
+
+
+def current_record() -> RequestRecord | None:
+    return _current_record.get()
+
+
+@contextmanager
+def request_record(name: str, **labels):
+    record = RequestRecord(name, **labels)
+    token = _current_record.set(record)
+    try:
+        yield record
+    finally:
+        _current_record.reset(token)
+
+
+def run_with_record(record: RequestRecord | None, fn, *args, **kwargs):
+    token = _current_record.set(record)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _current_record.reset(token)
+
+
+@contextmanager
+def stage(name: str):
+    st = timer()
+    try:
+        yield
+    finally:
+        elapsed = timer() - st
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        record = _current_record.get()
+        if record is not None:
+            record.add(name, elapsed)
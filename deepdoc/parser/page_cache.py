@@ -0,0 +1,223 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from functools import lru_cache
+from io import BytesIO
+
+import numpy as np
+import xxhash
+from pypdf import PdfReader
+
+from common import settings
+from common.file_utils import get_project_base_directory
+
+# Where per-page model results are cached: "storage" for the object storage, "disk" for
+# PDF_PAGE_CACHE_DIR, empty to disable the cache.
+PDF_PAGE_CACHE = os.environ.get("PDF_PAGE_CACHE", "").lower()
+PDF_PAGE_CACHE_DIR = os.environ.get("PDF_PAGE_CACHE_DIR", get_project_base_directory("page_cache"))
+PDF_PAGE_CACHE_BUCKET = os.environ.get("PDF_PAGE_CACHE_BUCKET", "deepdoc-page-cache")
+# Results older than this many days are misses. The disk cache also drops the least recently
+# used documents once it is larger than PDF_PAGE_CACHE_DISK_MB.
+PDF_PAGE_CACHE_TTL = float(os.environ.get("PDF_PAGE_CACHE_TTL_DAYS", "30")) * 24 * 3600
+PDF_PAGE_CACHE_DISK = int(os.environ.get("PDF_PAGE_CACHE_DISK_MB", "10240")) * 1024 * 1024
+PDF_PAGE_CACHE_PRUNE_INTERVAL = 3600
+
+STAGES = ("ocr", "layout", "tsr")
+
+_last_prune = 0
+_prune_lock = threading.Lock()
+
+
+@lru_cache(maxsize=64)
+def model_version(*paths) -> str:
+    """Digest of the contents of model files, computed once per process."""
+    hasher = xxhash.xxh64()
+    for path in paths:
+        hasher.update(path.encode("utf-8"))
+        if not os.path.exists(path):
+            continue
+        with open(path, "rb") as f:
+            while chunk := f.read(1 << 20):
+                hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _to_json(o):
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, np.generic):
+        return o.item()
+    raise TypeError(f"{type(o)} is not JSON serializable")
+
+
+def prune_disk(root: str = None, now: float = None):
+    """
+    Remove the documents of the disk cache not used for PDF_PAGE_CACHE_TTL, then the least
+    recently used ones until the cache fits in PDF_PAGE_CACHE_DISK.
+    """
+    root = root or PDF_PAGE_CACHE_DIR
+    now = time.time() if now is None else now
+    if not os.path.isdir(root):
+        return
+    docs = []
+    for entry in os.scandir(root):
+        if not entry.is_dir():
+            continue
+        size, used = 0, 0
+        for f in os.scandir(entry.path):
+            st = f.stat()
+            size += st.st_size
+            used = max(used, st.st_mtime)
+        docs.append((used, size, entry.path))
+    total = sum(size for _, size, _ in docs)
+    for used, size, path in sorted(docs):
+        if used > now - PDF_PAGE_CACHE_TTL and total <= PDF_PAGE_CACHE_DISK:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def _maybe_prune_disk():
+    global _last_prune
+    with _prune_lock:
+        if time.time() - _last_prune < PDF_PAGE_CACHE_PRUNE_INTERVAL:
+            return
+        _last_prune = time.time()
+    try:
+        prune_disk()
+    except Exception:
+        logging.exception("Fail to prune the page cache")
+
+
+def remove_cached_pages(binary: bytes):
+    """Remove the cached results of every page of a PDF, e.g. when its document is deleted."""
+    cache = PageCache(binary, 0)
+    if not cache.enabled:
+        return
+    pages = len(PdfReader(BytesIO(binary)).pages) if cache.backend == "storage" else 0
+    cache.remove(pages)
+
+
+class PageCache:
+    """
+    Results of the deepdoc models for single PDF pages, keyed by the content hash of the PDF, the
+    page number and the stage. The zoom and the version of what produced a result are stored with
+    it, so a newer model overwrites the older results. Re-parsing the same file, with another
+    chunk method or page range, reads them back instead of running OCR, layout and table
+    structure recognition again.
+
+    Lookup and storage errors are logged and count as misses.
+    """
+
+    def __init__(self, fnm, zoomin: int, backend: str = None):
+        self.backend = PDF_PAGE_CACHE if backend is None else backend
+        if self.backend == "storage" and settings.STORAGE_IMPL is None:
+            self.backend = ""
+        self.zoomin = zoomin
+        self.doc = ""
+        if not self.backend:
+            return
+        hasher = xxhash.xxh64()
+        if isinstance(fnm, str):
+            with open(fnm, "rb") as f:
+                while chunk := f.read(1 << 20):
+                    hasher.update(chunk)
+        else:
+            hasher.update(fnm)
+        self.doc = hasher.hexdigest()
+        if self.backend == "disk":
+            _maybe_prune_disk()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.backend)
+
+    def key(self, stage: str, page: int) -> str:
+        return f"{self.doc}/{page}.{stage}.json"
+
+    def version(self, stage: str, version: str) -> str:
+        return xxhash.xxh64(f"{stage}\x00{version}\x00{self.zoomin}".encode("utf-8")).hexdigest()
+
+    def get(self, stage: str, version: str, page: int):
+        if not self.enabled:
+            return None
+        key = self.key(stage, page)
+        try:
+            if self.backend == "storage":
+                if not settings.STORAGE_IMPL.obj_exist(PDF_PAGE_CACHE_BUCKET, key):
+                    return None
+                binary = settings.STORAGE_IMPL.get(PDF_PAGE_CACHE_BUCKET, key)
+            else:
+                path = os.path.join(PDF_PAGE_CACHE_DIR, key)
+                if not os.path.exists(path):
+                    return None
+                with open(path, "rb") as f:
+                    binary = f.read()
+                # the modification time of the disk cache tells which documents are in use
+                os.utime(path)
+            if not binary:
+                return None
+            entry = json.loads(binary)
+            if entry.get("version") != self.version(stage, version) or entry.get("time", 0) < time.time() - PDF_PAGE_CACHE_TTL:
+                return None
+            return entry["value"]
+        except Exception:
+            logging.exception(f"Fail to read page cache {key}")
+            return None
+
+    def get_many(self, stage: str, version: str, pages) -> list:
+        return [self.get(stage, version, page) for page in pages]
+
+    def put(self, stage: str, version: str, page: int, value):
+        if not self.enabled:
+            return
+        key = self.key(stage, page)
+        try:
+            entry = {"version": self.version(stage, version), "time": time.time(), "value": value}
+            binary = json.dumps(entry, ensure_ascii=False, default=_to_json).encode("utf-8")
+            if self.backend == "storage":
+                settings.STORAGE_IMPL.put(PDF_PAGE_CACHE_BUCKET, key, binary)
+            else:
+                path = os.path.join(PDF_PAGE_CACHE_DIR, key)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp, "wb") as f:
+                    f.write(binary)
+                os.replace(tmp, path)
+        except Exception:
+            logging.exception(f"Fail to write page cache {key}")
+
+    def remove(self, pages: int):
+        """Remove the results of the first `pages` pages from the storage, or of every page on disk."""
+        if not self.enabled:
+            return
+        try:
+            if self.backend == "disk":
+                shutil.rmtree(os.path.join(PDF_PAGE_CACHE_DIR, self.doc), ignore_errors=True)
+                return
+            for page in range(pages):
+                for stage in STAGES:
+                    key = self.key(stage, page)
+                    if settings.STORAGE_IMPL.obj_exist(PDF_PAGE_CACHE_BUCKET, key):
+                        settings.STORAGE_IMPL.rm(PDF_PAGE_CACHE_BUCKET, key)
+        except Exception:
+            logging.exception(f"Fail to remove page cache {self.doc}")
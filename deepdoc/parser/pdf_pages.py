@@ -0,0 +1,110 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Sequence
+from io import BytesIO
+
+import pdfplumber
+
+# Rendered pages kept in memory per parsed PDF, 0 to keep all of them. Layout recognition, table
+# structure recognition and cropping run after the OCR of the whole document and render again
+# the pages that left the window, so a window trades parsing time for memory.
+PDF_PAGE_WINDOW = int(os.environ.get("PDF_PAGE_WINDOW", "0"))
+
+
+class LazyPageImages(Sequence):
+    """
+    The pages [page_from, page_to) of a PDF as PIL images, rendered at 72 * zoomin DPI on first
+    access. Only the `window` most recently used pages are kept, a page accessed again after it
+    was dropped is rendered again. Page sizes are remembered, see `page_size`.
+
+    pdfplumber and pdfium are not thread-safe: `lock` is held around every call into them, and
+    only there, so threads parsing other PDFs can run in between.
+    """
+
+    def __init__(self, fnm, page_from: int, page_to: int, zoomin: int, lock, window: int = None, antialias: bool = True):
+        self.zoomin = zoomin
+        self.antialias = antialias
+        self.window = PDF_PAGE_WINDOW if window is None else window
+        self.lock = lock
+        with self.lock:
+            self.pdf = pdfplumber.open(fnm) if isinstance(fnm, str) else pdfplumber.open(BytesIO(fnm))
+            self.total_page = len(self.pdf.pages)
+            self.pages = self.pdf.pages[page_from:page_to]
+        self.cache = OrderedDict()
+        self.sizes = {}
+        self.cache_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"page {i} out of range")
+
+        with self.cache_lock:
+            img = self.cache.get(i)
+            if img is not None:
+                self.cache.move_to_end(i)
+                return img
+
+        with self.lock:
+            img = self.pages[i].to_image(resolution=72 * self.zoomin, antialias=self.antialias).annotated
+
+        with self.cache_lock:
+            self.sizes[i] = img.size
+            self.cache[i] = img
+            self.cache.move_to_end(i)
+            while self.window and len(self.cache) > self.window:
+                self.cache.popitem(last=False)
+        return img
+
+    def size_of(self, i: int) -> tuple[int, int]:
+        if i < 0:
+            i += len(self)
+        with self.cache_lock:
+            size = self.sizes.get(i)
+        return size if size is not None else self[i].size
+
+    def chars(self, i: int) -> list[dict]:
+        with self.lock:
+            return self.pages[i].dedupe_chars().chars
+
+    def close(self):
+        with self.cache_lock:
+            self.cache.clear()
+        with self.lock:
+            self.pdf.close()
+
+    def __del__(self):
+        # Not under `lock`: the garbage collector may run while this thread holds it.
+        try:
+            self.pdf.close()
+        except Exception:
+            pass
+
+
+def page_size(page_images, i: int) -> tuple[int, int]:
+    """Pixel size of a page image, without rendering the page again if `page_images` is lazy."""
+    size_of = getattr(page_images, "size_of", None)
+    return size_of(i) if size_of else page_images[i].size
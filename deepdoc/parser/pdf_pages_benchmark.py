@@ -0,0 +1,120 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Peak memory of rendering every page of a PDF up front, as RAGFlowPdfParser.__images__ used to,
+against LazyPageImages.
+
+    python deepdoc/parser/pdf_pages_benchmark.py [--pages 300] [--zoomin 3] [--window 8] [--pdf scan.pdf]
+
+Without --pdf, a scanned-like PDF is generated: one full-page grayscale bitmap per page and no
+text layer. Each mode runs in its own process and walks the pages the way the parser does:
+one pass for OCR, one in batches of 16 for layout recognition, then the page size lookups of
+chunking. Reported memory is the peak RSS of that process.
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from deepdoc.parser.pdf_pages import LazyPageImages
+
+LAYOUT_BATCH = 16
+
+
+def build_scan(path, pages, dpi=150, seed=0):
+    rng = np.random.default_rng(seed)
+    w, h = int(8.5 * dpi), int(11 * dpi)
+    imgs = []
+    for _ in range(pages):
+        px = np.full((h, w), 255, dtype=np.uint8)
+        for top in range(100, h - 100, 40):  # text lines
+            length = int(rng.integers(w // 3, w - 200))
+            px[top:top + 18, 100:100 + length] = rng.integers(0, 160, (18, length), dtype=np.uint8)
+        imgs.append(Image.fromarray(px, "L"))
+    imgs[0].save(path, "PDF", resolution=dpi, save_all=True, append_images=imgs[1:])
+
+
+def walk(page_images):
+    checksum = 0
+    for img in page_images:  # OCR
+        checksum += int(np.asarray(img)[::64, ::64].sum())
+    for st in range(0, len(page_images), LAYOUT_BATCH):  # layout recognition
+        batch = [np.array(img) for img in page_images[st:st + LAYOUT_BATCH]]
+        checksum += sum(int(b[::64, ::64].sum()) for b in batch)
+        del batch
+    size_of = getattr(page_images, "size_of", None)
+    for i in range(len(page_images)):  # positions of chunks
+        checksum += (size_of(i) if size_of else page_images[i].size)[1]
+    return checksum
+
+
+def run(mode, pdf, zoomin, window, queue):
+    import pdfplumber
+
+    st = time.perf_counter()
+    lock = threading.Lock()
+    if mode == "eager":
+        with pdfplumber.open(pdf) as doc:
+            page_images = [p.to_image(resolution=72 * zoomin, antialias=True).annotated for p in doc.pages]
+            checksum = walk(page_images)
+    else:
+        page_images = LazyPageImages(pdf, 0, 100000, zoomin, lock, window=window)
+        checksum = walk(page_images)
+        page_images.close()
+    elapsed = time.perf_counter() - st
+    queue.put((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, elapsed, checksum))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PDF page rendering memory benchmark")
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--zoomin", type=int, default=3)
+    parser.add_argument("--window", type=int, default=8)
+    parser.add_argument("--pdf", help="PDF to render instead of a generated scan")
+    parser.add_argument("--modes", default="eager,lazy", help="comma separated modes to run")
+    args = parser.parse_args()
+
+    pdf = args.pdf
+    if not pdf:
+        pdf = os.path.join(tempfile.mkdtemp(), "scan.pdf")
+        build_scan(pdf, args.pages)
+
+    ctx = multiprocessing.get_context("spawn")
+    print(f"{'mode':>6} {'peak RSS MB':>12} {'seconds':>8}", flush=True)
+    checksums = set()
+    for mode in args.modes.split(","):
+        queue = ctx.Queue()
+        proc = ctx.Process(target=run, args=(mode, pdf, args.zoomin, args.window, queue))
+        proc.start()
+        proc.join()
+        if proc.exitcode:
+            # e.g. killed when out of memory
+            print(f"{mode:>6} {'exit ' + str(proc.exitcode):>12}", flush=True)
+            continue
+        rss, elapsed, checksum = queue.get()
+        checksums.add(checksum)
+        print(f"{mode:>6} {rss:>12.0f} {elapsed:>8.1f}", flush=True)
+    assert len(checksums) <= 1, "both modes must see the same pixels"
+
+
+if __name__ == "__main__":
+    main()
@@ -36,7 +36,10 @@ from pypdf import PdfReader as pdf2_read
 
 from common.file_utils import get_project_base_directory
 from common.misc_utils import pip_install_torch
+from deepdoc.parser.page_cache import PageCache, model_version
+from deepdoc.parser.pdf_pages import LazyPageImages, page_size
 from deepdoc.vision import OCR, AscendLayoutRecognizer, LayoutRecognizer, Recognizer, TableStructureRecognizer
+from deepdoc.vision.boxes import Boxes
 from rag.app.picture import vision_llm_chunk as picture_vision_llm_chunk
 from rag.nlp import rag_tokenizer
 from rag.prompts.generator import vision_llm_describe_prompt
@@ -46,6 +49,9 @@ LOCK_KEY_pdfplumber = "global_shared_lock_pdfplumber"
 if LOCK_KEY_pdfplumber not in sys.modules:
     sys.modules[LOCK_KEY_pdfplumber] = threading.Lock()
 
+# Pages OCRed together: their text detection is batched and their text crops are recognized in shared batches.
+OCR_PAGE_BATCH = int(os.environ.get("OCR_PAGE_BATCH", "4"))
+
 
 class RAGFlowPdfParser:
     def __init__(self, **kwargs):
@@ -98,9 +104,22 @@ class RAGFlowPdfParser:
             model_dir = snapshot_download(repo_id="InfiniFlow/text_concat_xgb_v1.0", local_dir=os.path.join(get_project_base_directory(), "rag/res/deepdoc"), local_dir_use_symlinks=False)
             self.updown_cnt_mdl.load_model(os.path.join(model_dir, "updown_concat_xgb.model"))
 
+        model_dir = os.path.join(get_project_base_directory(), "rag/res/deepdoc")
+        tsr_type = os.getenv("TABLE_STRUCTURE_RECOGNIZER_TYPE", "onnx").lower()
+        # What the per-page results of each model depend on, see PageCache.
+        self.page_cache_models = {
+            "ocr": (os.path.join(model_dir, "det.onnx"), os.path.join(model_dir, "rec.onnx"), f"drop_score={self.ocr.drop_score}"),
+            "layout": (os.path.join(model_dir, recognizer_domain + (".om" if layout_recognizer_type == "ascend" else ".onnx")), os.environ.get("TENSORRT_DLA_SVR", "")),
+            "tsr": (os.path.join(model_dir, "tsr." + ("om" if tsr_type == "ascend" else "onnx")),),
+        }
+        self.page_cache = PageCache(None, 0, backend="")
+
         self.page_from = 0
         self.column_num = 1
 
+    def _page_cache_version(self, stage):
+        return model_version(*self.page_cache_models[stage])
+
     def __char_width(self, c):
         return (c["x1"] - c["x0"]) // max(len(c["text"]), 1)
 
@@ -197,12 +216,15 @@ class RAGFlowPdfParser:
         tbcnt = [0]
         MARGIN = 10
         self.tb_cpns = []
+        version = self._page_cache_version("tsr") if self.page_cache.enabled else ""
+        page_tables, cached_recos = {}, {}
         assert len(self.page_layout) == len(self.page_images)
         for p, tbls in enumerate(self.page_layout):  # for page
             tbls = [f for f in tbls if f["type"] == "table"]
             tbcnt.append(len(tbls))
             if not tbls:
                 continue
+            crops = []
             for tb in tbls:  # for table
                 left, top, right, bott = tb["x0"] - MARGIN, tb["top"] - MARGIN, tb["x1"] + MARGIN, tb["bottom"] + MARGIN
                 left *= ZM
@@ -210,12 +232,29 @@ class RAGFlowPdfParser:
                 right *= ZM
                 bott *= ZM
                 pos.append((left, top))
-                imgs.append(self.page_images[p].crop((left, top, right, bott)))
+                crops.append((left, top, right, bott))
+
+            # Cached components are only valid for the same table regions.
+            page_tables[p] = [[round(float(v), 2) for v in crop] for crop in crops]
+            cached = self.page_cache.get("tsr", version, self.page_from + p)
+            if cached and cached["tables"] == page_tables[p]:
+                cached_recos[p] = cached["recos"]
+                continue
+            for crop in crops:
+                imgs.append(self.page_images[p].crop(crop))
 
         assert len(self.page_images) == len(tbcnt) - 1
-        if not imgs:
+        if not pos:
             return
-        recos = self.tbl_det(imgs)
+        new_recos = self.tbl_det(imgs) if imgs else []
+        recos = []
+        for p in page_tables:
+            if p in cached_recos:
+                recos.extend(cached_recos[p])
+                continue
+            page_recos, new_recos = new_recos[: len(page_tables[p])], new_recos[len(page_tables[p]) :]
+            self.page_cache.put("tsr", version, self.page_from + p, {"tables": page_tables[p], "recos": page_recos})
+            recos.extend(page_recos)
         tbcnt = np.cumsum(tbcnt)
         for i in range(len(tbcnt) - 1):  # for page
             pg = []
@@ -246,16 +285,19 @@ class RAGFlowPdfParser:
         spans = gather(r".*spanning")
         clmns = sorted([r for r in self.tb_cpns if re.match(r"table column$", r["label"])], key=lambda x: (x["pn"], x["layoutno"], x["x0"]))
         clmns = Recognizer.layouts_cleanup(self.boxes, clmns, 5, 0.5)
-        for b in self.boxes:
-            if b.get("layout_type", "") != "table":
-                continue
-            ii = Recognizer.find_overlapped_with_threshold(b, rows, thr=0.3)
+        tbl_boxes = [b for b in self.boxes if b.get("layout_type", "") == "table"]
+        row_ii = Recognizer.find_overlapped_with_threshold_batch(tbl_boxes, rows, thr=0.3)
+        header_ii = Recognizer.find_overlapped_with_threshold_batch(tbl_boxes, headers, thr=0.3)
+        clmn_ii = Recognizer.find_horizontally_tightest_fit_batch(tbl_boxes, clmns)
+        span_ii = Recognizer.find_overlapped_with_threshold_batch(tbl_boxes, spans, thr=0.3)
+        for b, r_ii, h_ii, c_ii, sp_ii in zip(tbl_boxes, row_ii, header_ii, clmn_ii, span_ii):
+            ii = r_ii
             if ii is not None:
                 b["R"] = ii
                 b["R_top"] = rows[ii]["top"]
                 b["R_bott"] = rows[ii]["bottom"]
 
-            ii = Recognizer.find_overlapped_with_threshold(b, headers, thr=0.3)
+            ii = h_ii
             if ii is not None:
                 b["H_top"] = headers[ii]["top"]
                 b["H_bott"] = headers[ii]["bottom"]
@@ -263,13 +305,13 @@ class RAGFlowPdfParser:
                 b["H_right"] = headers[ii]["x1"]
                 b["H"] = ii
 
-            ii = Recognizer.find_horizontally_tightest_fit(b, clmns)
+            ii = c_ii
             if ii is not None:
                 b["C"] = ii
                 b["C_left"] = clmns[ii]["x0"]
                 b["C_right"] = clmns[ii]["x1"]
 
-            ii = Recognizer.find_overlapped_with_threshold(b, spans, thr=0.3)
+            ii = sp_ii
             if ii is not None:
                 b["H_top"] = spans[ii]["top"]
                 b["H_bott"] = spans[ii]["bottom"]
@@ -277,74 +319,116 @@ class RAGFlowPdfParser:
                 b["H_right"] = spans[ii]["x1"]
                 b["SP"] = ii
 
-    def __ocr(self, pagenum, img, chars, ZM=3, device_id: int | None = None):
-        start = timer()
-        bxs = self.ocr.detect(np.array(img), device_id)
-        logging.info(f"__ocr detecting boxes of a image cost ({timer() - start}s)")
+    def __ocr(self, pagenums, imgs, chars_list, ZM=3, device_id: int | None = None):
+        """
+        OCR of a group of pages: text detection of the pages is batched, and the boxes without a
+        text layer of every page are recognized together. Pages found in the page cache are skipped.
+        """
+        version = self._page_cache_version("ocr") if self.page_cache.enabled else ""
+        # The boxes of a page also depend on whether its text layer was used.
+        versions = [f"{version}:{int(bool(chars))}" for chars in chars_list]
+        page_boxes = {}
+        for pagenum, ver in zip(pagenums, versions):
+            cached = self.page_cache.get("ocr", ver, self.page_from + pagenum - 1)
+            if cached is None:
+                continue
+            for b in cached["boxes"]:
+                b["page_number"] = pagenum
+            self.mean_height[pagenum - 1] = cached["mean_height"]
+            page_boxes[pagenum] = cached["boxes"]
+        todo = [i for i, pagenum in enumerate(pagenums) if pagenum not in page_boxes]
 
         start = timer()
-        if not bxs:
-            self.boxes.append([])
-            return
-        bxs = [(line[0], line[1][0]) for line in bxs]
-        bxs = Recognizer.sort_Y_firstly(
-            [
-                {"x0": b[0][0] / ZM, "x1": b[1][0] / ZM, "top": b[0][1] / ZM, "text": "", "txt": t, "bottom": b[-1][1] / ZM, "chars": [], "page_number": pagenum}
-                for b, t in bxs
-                if b[0][0] <= b[1][0] and b[0][1] <= b[-1][1]
-            ],
-            self.mean_height[pagenum - 1] / 3,
-        )
-
-        # merge chars in the same rect
-        for c in chars:
-            ii = Recognizer.find_overlapped(c, bxs)
-            if ii is None:
-                self.lefted_chars.append(c)
-                continue
-            ch = c["bottom"] - c["top"]
-            bh = bxs[ii]["bottom"] - bxs[ii]["top"]
-            if abs(ch - bh) / max(ch, bh) >= 0.7 and c["text"] != " ":
-                self.lefted_chars.append(c)
+        imgs_np = [np.array(imgs[i]) for i in todo]
+        bxs_list = self.ocr.detect_batch(imgs_np, device_id) if todo else []
+        logging.info(f"__ocr detecting boxes of {len(todo)} images cost ({timer() - start}s)")
+
+        pages = []
+        for i, img_np, bxs in zip(todo, imgs_np, bxs_list):
+            pagenum, chars = pagenums[i], chars_list[i]
+            start = timer()
+            if not bxs:
+                pages.append((pagenum, None, []))
                 continue
-            bxs[ii]["chars"].append(c)
+            bxs = [(line[0], line[1][0]) for line in bxs]
+            bxs = Recognizer.sort_Y_firstly(
+                [
+                    {"x0": b[0][0] / ZM, "x1": b[1][0] / ZM, "top": b[0][1] / ZM, "text": "", "txt": t, "bottom": b[-1][1] / ZM, "chars": [], "page_number": pagenum}
+                    for b, t in bxs
+                    if b[0][0] <= b[1][0] and b[0][1] <= b[-1][1]
+                ],
+                self.mean_height[pagenum - 1] / 3,
+            )
 
-        for b in bxs:
-            if not b["chars"]:
+            # merge chars in the same rect
+            for c, ii in zip(chars, Recognizer.find_overlapped_batch(chars, bxs)):
+                if ii is None:
+                    self.lefted_chars.append(c)
+                    continue
+                ch = c["bottom"] - c["top"]
+                bh = bxs[ii]["bottom"] - bxs[ii]["top"]
+                if abs(ch - bh) / max(ch, bh) >= 0.7 and c["text"] != " ":
+                    self.lefted_chars.append(c)
+                    continue
+                bxs[ii]["chars"].append(c)
+
+            for b in bxs:
+                if not b["chars"]:
+                    del b["chars"]
+                    continue
+                m_ht = np.mean([c["height"] for c in b["chars"]])
+                for c in Recognizer.sort_Y_firstly(b["chars"], m_ht):
+                    if c["text"] == " " and b["text"]:
+                        if re.match(r"[0-9a-zA-Zа-яА-Я,.?;:!%%]", b["text"][-1]):
+                            b["text"] += " "
+                    else:
+                        b["text"] += c["text"]
                 del b["chars"]
-                continue
-            m_ht = np.mean([c["height"] for c in b["chars"]])
-            for c in Recognizer.sort_Y_firstly(b["chars"], m_ht):
-                if c["text"] == " " and b["text"]:
-                    if re.match(r"[0-9a-zA-Zа-яА-Я,.?;:!%%]", b["text"][-1]):
-                        b["text"] += " "
-                else:
-                    b["text"] += c["text"]
-            del b["chars"]
 
-        logging.info(f"__ocr sorting {len(chars)} chars cost {timer() - start}s")
+            logging.info(f"__ocr sorting {len(chars)} chars cost {timer() - start}s")
+            boxes_to_reg = []
+            for b in bxs:
+                if not b["text"]:
+                    left, right, top, bott = b["x0"] * ZM, b["x1"] * ZM, b["top"] * ZM, b["bottom"] * ZM
+                    b["box_image"] = self.ocr.get_rotate_crop_image(img_np, np.array([[left, top], [right, top], [right, bott], [left, bott]], dtype=np.float32))
+                    boxes_to_reg.append(b)
+                del b["txt"]
+            pages.append((pagenum, bxs, boxes_to_reg))
+
         start = timer()
-        boxes_to_reg = []
-        img_np = np.array(img)
-        for b in bxs:
-            if not b["text"]:
-                left, right, top, bott = b["x0"] * ZM, b["x1"] * ZM, b["top"] * ZM, b["bottom"] * ZM
-                b["box_image"] = self.ocr.get_rotate_crop_image(img_np, np.array([[left, top], [right, top], [right, bott], [left, bott]], dtype=np.float32))
-                boxes_to_reg.append(b)
-            del b["txt"]
-        texts = self.ocr.recognize_batch([b["box_image"] for b in boxes_to_reg], device_id)
-        for i in range(len(boxes_to_reg)):
-            boxes_to_reg[i]["text"] = texts[i]
-            del boxes_to_reg[i]["box_image"]
-        logging.info(f"__ocr recognize {len(bxs)} boxes cost {timer() - start}s")
-        bxs = [b for b in bxs if b["text"]]
-        if self.mean_height[pagenum - 1] == 0:
-            self.mean_height[pagenum - 1] = np.median([b["bottom"] - b["top"] for b in bxs])
-        self.boxes.append(bxs)
+        texts_per_page = self.ocr.recognize_pages([[b["box_image"] for b in boxes_to_reg] for _, _, boxes_to_reg in pages], device_id)
+        logging.info(f"__ocr recognize {sum(len(texts) for texts in texts_per_page)} boxes of {len(pages)} pages cost {timer() - start}s")
+        for (pagenum, bxs, boxes_to_reg), texts in zip(pages, texts_per_page):
+            if bxs is None:  # nothing detected
+                bxs = []
+                self.page_cache.put("ocr", versions[pagenums.index(pagenum)], self.page_from + pagenum - 1, {"boxes": bxs, "mean_height": self.mean_height[pagenum - 1]})
+                page_boxes[pagenum] = bxs
+                continue
+            for i in range(len(boxes_to_reg)):
+                boxes_to_reg[i]["text"] = texts[i]
+                del boxes_to_reg[i]["box_image"]
+            bxs = [b for b in bxs if b["text"]]
+            if self.mean_height[pagenum - 1] == 0:
+                self.mean_height[pagenum - 1] = np.median([b["bottom"] - b["top"] for b in bxs])
+            self.page_cache.put("ocr", versions[pagenums.index(pagenum)], self.page_from + pagenum - 1, {"boxes": bxs, "mean_height": self.mean_height[pagenum - 1]})
+            page_boxes[pagenum] = bxs
+
+        for pagenum in pagenums:
+            self.boxes.append(page_boxes[pagenum])
 
     def _layouts_rec(self, ZM, drop=True):
         assert len(self.page_images) == len(self.boxes)
-        self.boxes, self.page_layout = self.layouter(self.page_images, self.boxes, ZM, drop=drop)
+        layouts = None
+        if self.page_cache.enabled:
+            version = self._page_cache_version("layout")
+            layouts = self.page_cache.get_many("layout", version, range(self.page_from, self.page_from + len(self.page_images)))
+            missed = [i for i, lts in enumerate(layouts) if lts is None]
+            for st in range(0, len(missed), 16):
+                pns = missed[st : st + 16]
+                for i, lts in zip(pns, self.layouter.predict([self.page_images[i] for i in pns])):
+                    self.page_cache.put("layout", version, self.page_from + i, lts)
+                    layouts[i] = lts
+        self.boxes, self.page_layout = self.layouter(self.page_images, self.boxes, ZM, drop=drop, layouts=layouts)
         # cumlative Y
         for i in range(len(self.boxes)):
             self.boxes[i]["top"] += self.page_cum_height[self.boxes[i]["page_number"] - 1]
@@ -371,7 +455,7 @@ class RAGFlowPdfParser:
                 continue
 
             if hasattr(self, "page_images") and self.page_images and len(self.page_images) >= pg:
-                page_w = self.page_images[pg - 1].size[0] / max(1, zoomin)
+                page_w = page_size(self.page_images, pg - 1)[0] / max(1, zoomin)
                 left_edge = 0.0
             else:
                 xs0 = [box["x0"] for box in bxs]
@@ -407,15 +491,12 @@ class RAGFlowPdfParser:
                     box["col_id"] = 0
                 continue
 
-            for box in bxs:
-                w = box["x1"] - box["x0"]
-                if w >= 0.8 * page_w:
-                    box["col_id"] = 0
-                    continue
-                cx = 0.5 * (box["x0"] + box["x1"])
-                norm_cx = (cx - left_edge) / page_w
-                norm_cx = max(0.0, min(norm_cx, 0.999999))
-                box["col_id"] = int(min(global_cols - 1, norm_cx * global_cols))
+            arr = Boxes(bxs)
+            norm_cx = np.clip((0.5 * (arr.x0 + arr.x1) - left_edge) / page_w, 0.0, 0.999999)
+            col_ids = np.minimum(global_cols - 1, norm_cx * global_cols).astype(int)
+            col_ids[arr.x1 - arr.x0 >= 0.8 * page_w] = 0
+            for box, col_id in zip(bxs, col_ids.tolist()):
+                box["col_id"] = col_id
 
         return boxes
 
@@ -940,8 +1021,8 @@ class RAGFlowPdfParser:
         page_images_cnt = len(self.page_images)
         if pn[-1] - 1 >= page_images_cnt:
             return ""
-        while bott * ZM > self.page_images[pn[-1] - 1].size[1]:
-            bott -= self.page_images[pn[-1] - 1].size[1] / ZM
+        while bott * ZM > page_size(self.page_images, pn[-1] - 1)[1]:
+            bott -= page_size(self.page_images, pn[-1] - 1)[1] / ZM
             pn.append(pn[-1] + 1)
             if pn[-1] - 1 >= page_images_cnt:
                 return ""
@@ -958,7 +1039,7 @@ class RAGFlowPdfParser:
         def usefull(b):
             if b.get("layout_type"):
                 return True
-            if width(b) > self.page_images[b["page_number"] - 1].size[0] / ZM / 3:
+            if width(b) > page_size(self.page_images, b["page_number"] - 1)[0] / ZM / 3:
                 return True
             if b["bottom"] - b["top"] > self.mean_height[b["page_number"] - 1]:
                 return True
@@ -968,7 +1049,7 @@ class RAGFlowPdfParser:
         while boxes:
             lines = []
             widths = []
-            pw = self.page_images[boxes[0]["page_number"] - 1].size[0] / ZM
+            pw = page_size(self.page_images, boxes[0]["page_number"] - 1)[0] / ZM
             mh = self.mean_height[boxes[0]["page_number"] - 1]
             mj = self.proj_match(boxes[0]["text"]) or boxes[0].get("layout_type", "") == "title"
 
@@ -1030,18 +1111,18 @@ class RAGFlowPdfParser:
         self.page_from = page_from
         start = timer()
         try:
-            with sys.modules[LOCK_KEY_pdfplumber]:
-                with pdfplumber.open(fnm) if isinstance(fnm, str) else pdfplumber.open(BytesIO(fnm)) as pdf:
-                    self.pdf = pdf
-                    self.page_images = [p.to_image(resolution=72 * zoomin, antialias=True).annotated for i, p in enumerate(self.pdf.pages[page_from:page_to])]
+            # Pages are rendered when first used, see LazyPageImages.
+            self.page_images = LazyPageImages(fnm, page_from, page_to, zoomin, sys.modules[LOCK_KEY_pdfplumber])
+            self.pdf = self.page_images.pdf
+            self.page_cache = PageCache(fnm, zoomin)
 
-                    try:
-                        self.page_chars = [[c for c in page.dedupe_chars().chars if self._has_color(c)] for page in self.pdf.pages[page_from:page_to]]
-                    except Exception as e:
-                        logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
-                        self.page_chars = [[] for _ in range(page_to - page_from)]  # If failed to extract, using empty list instead.
+            try:
+                self.page_chars = [[c for c in self.page_images.chars(i) if self._has_color(c)] for i in range(len(self.page_images))]
+            except Exception as e:
+                logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
+                self.page_chars = [[] for _ in range(page_to - page_from)]  # If failed to extract, using empty list instead.
 
-                    self.total_page = len(self.pdf.pages)
+            self.total_page = self.page_images.total_page
 
         except Exception:
             logging.exception("RAGFlowPdfParser __images__")
@@ -1079,46 +1160,65 @@ class RAGFlowPdfParser:
         else:
             self.is_english = False
 
-        async def __img_ocr(i, id, img, chars, limiter):
-            j = 0
-            while j + 1 < len(chars):
-                if (
-                    chars[j]["text"]
-                    and chars[j + 1]["text"]
-                    and re.match(r"[0-9a-zA-Z,.:;!%]+", chars[j]["text"] + chars[j + 1]["text"])
-                    and chars[j + 1]["x0"] - chars[j]["x1"] >= min(chars[j + 1]["width"], chars[j]["width"]) / 2
-                ):
-                    chars[j]["text"] += " "
-                j += 1
+        async def __img_ocr(pns, id, imgs, chars_list, limiter):
+            for chars in chars_list:
+                j = 0
+                while j + 1 < len(chars):
+                    if (
+                        chars[j]["text"]
+                        and chars[j + 1]["text"]
+                        and re.match(r"[0-9a-zA-Z,.:;!%]+", chars[j]["text"] + chars[j + 1]["text"])
+                        and chars[j + 1]["x0"] - chars[j]["x1"] >= min(chars[j + 1]["width"], chars[j]["width"]) / 2
+                    ):
+                        chars[j]["text"] += " "
+                    j += 1
 
             if limiter:
                 async with limiter:
-                    await trio.to_thread.run_sync(lambda: self.__ocr(i + 1, img, chars, zoomin, id))
+                    await trio.to_thread.run_sync(lambda: self.__ocr([i + 1 for i in pns], imgs, chars_list, zoomin, id))
             else:
-                self.__ocr(i + 1, img, chars, zoomin, id)
+                self.__ocr([i + 1 for i in pns], imgs, chars_list, zoomin, id)
 
-            if callback and i % 6 == 5:
-                callback((i + 1) * 0.6 / len(self.page_images))
+            if callback:
+                callback((pns[-1] + 1) * 0.6 / len(self.page_images))
 
         async def __img_ocr_launcher():
-            def __ocr_preprocess():
+            def __ocr_preprocess(i, img):
                 chars = self.page_chars[i] if not self.is_english else []
                 self.mean_height.append(np.median(sorted([c["height"] for c in chars])) if chars else 0)
                 self.mean_width.append(np.median(sorted([c["width"] for c in chars])) if chars else 8)
                 self.page_cum_height.append(img.size[1] / zoomin)
                 return chars
 
+            page_batch = max(1, min(OCR_PAGE_BATCH, self.page_images.window or OCR_PAGE_BATCH))
+            page_groups = [list(range(st, min(st + page_batch, len(self.page_images)))) for st in range(0, len(self.page_images), page_batch)]
+
             if self.parallel_limiter:
-                async with trio.open_nursery() as nursery:
-                    for i, img in enumerate(self.page_images):
-                        chars = __ocr_preprocess()
+                # Bounds the pages rendered and waiting for OCR.
+                window = trio.Semaphore(self.page_images.window or len(self.page_images) or 1)
+
+                async def __windowed_img_ocr(*args):
+                    try:
+                        await __img_ocr(*args)
+                    finally:
+                        for _ in args[0]:
+                            window.release()
 
-                        nursery.start_soon(__img_ocr, i, i % settings.PARALLEL_DEVICES, img, chars, self.parallel_limiter[i % settings.PARALLEL_DEVICES])
+                async with trio.open_nursery() as nursery:
+                    for gi, pns in enumerate(page_groups):
+                        imgs, chars_list = [], []
+                        for i in pns:
+                            await window.acquire()
+                            imgs.append(self.page_images[i])
+                            chars_list.append(__ocr_preprocess(i, imgs[-1]))
+
+                        nursery.start_soon(__windowed_img_ocr, pns, gi % settings.PARALLEL_DEVICES, imgs, chars_list, self.parallel_limiter[gi % settings.PARALLEL_DEVICES])
                         await trio.sleep(0.1)
             else:
-                for i, img in enumerate(self.page_images):
-                    chars = __ocr_preprocess()
-                    await __img_ocr(i, 0, img, chars, None)
+                for pns in page_groups:
+                    imgs = [self.page_images[i] for i in pns]
+                    chars_list = [__ocr_preprocess(i, img) for i, img in zip(pns, imgs)]
+                    await __img_ocr(pns, 0, imgs, chars_list, None)
 
         start = timer()
 
@@ -1257,23 +1357,23 @@ class RAGFlowPdfParser:
         pos = poss[0]
         poss.insert(0, ([pos[0][0]], pos[1], pos[2], max(0, pos[3] - 120), max(pos[3] - GAP, 0)))
         pos = poss[-1]
-        poss.append(([pos[0][-1]], pos[1], pos[2], min(self.page_images[pos[0][-1]].size[1] / ZM, pos[4] + GAP), min(self.page_images[pos[0][-1]].size[1] / ZM, pos[4] + 120)))
+        poss.append(([pos[0][-1]], pos[1], pos[2], min(page_size(self.page_images, pos[0][-1])[1] / ZM, pos[4] + GAP), min(page_size(self.page_images, pos[0][-1])[1] / ZM, pos[4] + 120)))
 
         positions = []
         for ii, (pns, left, right, top, bottom) in enumerate(poss):
             right = left + max_width
             bottom *= ZM
             for pn in pns[1:]:
-                bottom += self.page_images[pn - 1].size[1]
-            imgs.append(self.page_images[pns[0]].crop((left * ZM, top * ZM, right * ZM, min(bottom, self.page_images[pns[0]].size[1]))))
+                bottom += page_size(self.page_images, pn - 1)[1]
+            imgs.append(self.page_images[pns[0]].crop((left * ZM, top * ZM, right * ZM, min(bottom, page_size(self.page_images, pns[0])[1]))))
             if 0 < ii < len(poss) - 1:
-                positions.append((pns[0] + self.page_from, left, right, top, min(bottom, self.page_images[pns[0]].size[1]) / ZM))
-            bottom -= self.page_images[pns[0]].size[1]
+                positions.append((pns[0] + self.page_from, left, right, top, min(bottom, page_size(self.page_images, pns[0])[1]) / ZM))
+            bottom -= page_size(self.page_images, pns[0])[1]
             for pn in pns[1:]:
-                imgs.append(self.page_images[pn].crop((left * ZM, 0, right * ZM, min(bottom, self.page_images[pn].size[1]))))
+                imgs.append(self.page_images[pn].crop((left * ZM, 0, right * ZM, min(bottom, page_size(self.page_images, pn)[1]))))
                 if 0 < ii < len(poss) - 1:
-                    positions.append((pn + self.page_from, left, right, 0, min(bottom, self.page_images[pn].size[1]) / ZM))
-                bottom -= self.page_images[pn].size[1]
+                    positions.append((pn + self.page_from, left, right, 0, min(bottom, page_size(self.page_images, pn)[1]) / ZM))
+                bottom -= page_size(self.page_images, pn)[1]
 
         if not imgs:
             if need_position:
@@ -1304,12 +1404,12 @@ class RAGFlowPdfParser:
         pn = bx["page_number"]
         top = bx["top"] - self.page_cum_height[pn - 1]
         bott = bx["bottom"] - self.page_cum_height[pn - 1]
-        poss.append((pn, bx["x0"], bx["x1"], top, min(bott, self.page_images[pn - 1].size[1] / ZM)))
-        while bott * ZM > self.page_images[pn - 1].size[1]:
-            bott -= self.page_images[pn - 1].size[1] / ZM
+        poss.append((pn, bx["x0"], bx["x1"], top, min(bott, page_size(self.page_images, pn - 1)[1] / ZM)))
+        while bott * ZM > page_size(self.page_images, pn - 1)[1]:
+            bott -= page_size(self.page_images, pn - 1)[1] / ZM
             top = 0
             pn += 1
-            poss.append((pn, bx["x0"], bx["x1"], top, min(bott, self.page_images[pn - 1].size[1] / ZM)))
+            poss.append((pn, bx["x0"], bx["x1"], top, min(bott, page_size(self.page_images, pn - 1)[1] / ZM)))
         return poss
 
 
@@ -1354,10 +1454,9 @@ class VisionParser(RAGFlowPdfParser):
 
     def __images__(self, fnm, zoomin=3, page_from=0, page_to=299, callback=None):
         try:
-            with sys.modules[LOCK_KEY_pdfplumber]:
-                self.pdf = pdfplumber.open(fnm) if isinstance(fnm, str) else pdfplumber.open(BytesIO(fnm))
-                self.page_images = [p.to_image(resolution=72 * zoomin).annotated for i, p in enumerate(self.pdf.pages[page_from:page_to])]
-                self.total_page = len(self.pdf.pages)
+            self.page_images = LazyPageImages(fnm, page_from, page_to, zoomin, sys.modules[LOCK_KEY_pdfplumber], antialias=False)
+            self.pdf = self.page_images.pdf
+            self.total_page = self.page_images.total_page
         except Exception:
             self.page_images = None
             self.total_page = 0
@@ -0,0 +1,165 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import numpy as np
+
+# Upper bound of the pairwise matrices built at once, in elements.
+BLOCK_SIZE = 1 << 20
+
+
+class Boxes:
+    """
+    Struct-of-arrays copy of a list of box dicts: their x0, x1, top and bottom as float64 arrays.
+    The functions below compute for many boxes at once what the per-pair methods of Recognizer
+    compute for one pair, with the same results.
+    """
+
+    __slots__ = ("x0", "x1", "top", "bottom")
+
+    def __init__(self, boxes):
+        arr = np.array([(b["x0"], b["x1"], b["top"], b["bottom"]) for b in boxes], dtype=np.float64).reshape(len(boxes), 4)
+        self.x0, self.x1, self.top, self.bottom = arr[:, 0], arr[:, 1], arr[:, 2], arr[:, 3]
+
+    def __len__(self):
+        return len(self.x0)
+
+    def __getitem__(self, sl):
+        boxes = Boxes.__new__(Boxes)
+        boxes.x0, boxes.x1, boxes.top, boxes.bottom = self.x0[sl], self.x1[sl], self.top[sl], self.bottom[sl]
+        return boxes
+
+
+def _overlapped_area(ax0, ax1, atop, abtm, b: Boxes, ratio):
+    hit = ~((b.x0 > ax1) | (b.x1 < ax0) | (b.bottom < atop) | (b.top > abtm))
+    w, h = ax1 - ax0, abtm - atop
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ov = (np.minimum(b.bottom, abtm) - np.maximum(b.top, atop)) * (np.minimum(b.x1, ax1) - np.maximum(b.x0, ax0))
+        ov = np.where(hit & (w != 0) & (h != 0), ov, 0.0)
+        if ratio:
+            ov = np.where(ov > 0, ov / (w * h), ov)
+    return ov
+
+
+def overlapped_area(a: Boxes, b: Boxes, ratio=True) -> np.ndarray:
+    """Recognizer.overlapped_area(a[i], b[j], ratio) for every i, j as a len(a) x len(b) matrix."""
+    return _overlapped_area(a.x0[:, None], a.x1[:, None], a.top[:, None], a.bottom[:, None], b, ratio)
+
+
+def overlapped_area_pairs(a: Boxes, b: Boxes, ratio=True) -> np.ndarray:
+    """Recognizer.overlapped_area(a[i], b[i], ratio) for every i."""
+    return _overlapped_area(a.x0, a.x1, a.top, a.bottom, b, ratio)
+
+
+def _blocks(m, n):
+    step = max(1, BLOCK_SIZE // max(1, n))
+    for beg in range(0, m, step):
+        yield slice(beg, min(m, beg + step))
+
+
+def find_overlapped(boxes, boxes_sorted_by_y, naive=False) -> list:
+    """Recognizer.find_overlapped for each of `boxes`, including its binary search of the candidate window."""
+    res = [None] * len(boxes)
+    if not boxes or not boxes_sorted_by_y:
+        return res
+    q, bxs = Boxes(boxes), Boxes(boxes_sorted_by_y)
+    m, n = len(q), len(bxs)
+    s, e, ii = np.zeros(m, dtype=np.int64), np.full(m, n, dtype=np.int64), np.zeros(m, dtype=np.int64)
+
+    active = np.full(m, not naive)
+    while active.any():
+        idx = np.nonzero(active)[0]
+        mid = (e[idx] + s[idx]) // 2
+        ii[idx] = mid
+        below = q.bottom[idx] < bxs.top[mid]
+        above = ~below & (q.top[idx] > bxs.bottom[mid])
+        e[idx[below]] = mid[below]
+        s[idx[above]] = mid[above] + 1
+        active[idx[~below & ~above]] = False
+        active[idx] &= s[idx] < e[idx]
+
+    step = (s < ii) & (q.top > bxs.bottom[np.minimum(s, n - 1)])
+    s[step] += 1
+    last = np.maximum(e - 1, 0)
+    step = (e - 1 > ii) & (q.bottom < bxs.top[last])
+    e[step] -= 1
+
+    # Only the pairs inside the windows, as flat arrays: query qi[k] against box ti[k].
+    lens = np.maximum(e - s, 0)
+    ends = np.cumsum(lens)
+    qi = np.repeat(np.arange(m), lens)
+    ti = np.repeat(s - (ends - lens), lens) + np.arange(ends[-1] if m else 0)
+    ov = overlapped_area_pairs(bxs[ti], q[qi])
+
+    # First of the largest overlaps of each window, if it is positive.
+    nonempty = lens > 0
+    best = np.zeros(m)
+    best[nonempty] = np.maximum.reduceat(ov, (ends - lens)[nonempty]) if len(ov) else []
+    first = (ov == best[qi]) & (ov > 0)
+    found_q, at = np.unique(qi[first], return_index=True)
+    for i, k in zip(found_q.tolist(), ti[first][at].tolist()):
+        res[i] = k
+    return res
+
+
+def find_overlapped_with_threshold(boxes, targets, thr=0.3) -> list:
+    """Recognizer.find_overlapped_with_threshold for each of `boxes` against the same `targets`."""
+    res = [None] * len(boxes)
+    if not boxes or not targets:
+        return res
+    q, t = Boxes(boxes), Boxes(targets)
+    n = len(t)
+    for blk in _blocks(len(q), n):
+        ov = overlapped_area(q[blk], t)
+        _ov = overlapped_area(t, q[blk]).T
+        ok = ov >= thr
+        best = np.where(ok, ov, -np.inf).max(axis=1, keepdims=True)
+        ok &= ov == best
+        best_ = np.where(ok, _ov, -np.inf).max(axis=1, keepdims=True)
+        ok &= _ov == best_
+        # The last of the equally overlapping targets wins.
+        last = n - 1 - ok[:, ::-1].argmax(axis=1)
+        for i in np.nonzero(ok.any(axis=1))[0]:
+            res[blk.start + i] = int(last[i])
+    return res
+
+
+def find_horizontally_tightest_fit(boxes, targets) -> list:
+    """Recognizer.find_horizontally_tightest_fit for each of `boxes` against the same `targets`."""
+    res = [None] * len(boxes)
+    if not boxes or not targets:
+        return res
+    q, t = Boxes(boxes), Boxes(targets)
+    layoutnos = {}
+    q_lno = np.array([layoutnos.setdefault(b.get("layoutno", "0"), len(layoutnos)) for b in boxes])
+    t_lno = np.array([layoutnos.setdefault(b.get("layoutno", "0"), len(layoutnos)) for b in targets])
+    for blk in _blocks(len(q), len(t)):
+        qb = q[blk]
+        dis = np.minimum(
+            np.minimum(np.abs(qb.x0[:, None] - t.x0), np.abs(qb.x1[:, None] - t.x1)),
+            np.abs(qb.x0[:, None] + qb.x1[:, None] - t.x1 - t.x0) / 2,
+        )
+        dis = np.where(q_lno[blk, None] == t_lno, dis, np.inf)
+        best = dis.argmin(axis=1)
+        found = dis[np.arange(len(best)), best] < 1000000
+        for i in np.nonzero(found)[0]:
+            res[blk.start + i] = int(best[i])
+    return res
+
+
+def overlapped_area_sum(boxes: Boxes, box) -> float:
+    """The total area of `boxes` that `box` overlaps, summed in order like a loop over overlapped_area(b, box, False)."""
+    ov = overlapped_area(boxes, Boxes([box]), ratio=False)[:, 0]
+    return sum(ov[ov != 0].tolist(), 0.)
@@ -0,0 +1,96 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+The per-pair box geometry of Recognizer against the batched one of deepdoc/vision/boxes.py, on
+dense generated pages, such as the financial statement tables that make __ocr and
+_table_transformer_job slow.
+
+    python deepdoc/vision/boxes_benchmark.py [--chars 2000 5000] [--repeat 3]
+
+Each page is a grid of table cells: one OCR box per cell, one char per few points of text, rows,
+headers and columns from table structure recognition. Both implementations must return the same
+indices.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from deepdoc.vision.recognizer import Recognizer
+
+
+def build_page(n_chars, seed=0):
+    rng = np.random.default_rng(seed)
+    n_cells = max(1, n_chars // 8)
+    cols = 8
+    rows = -(-n_cells // cols)
+    cell_w, cell_h = 600 / cols, 12.0
+    boxes, chars = [], []
+    for r in range(rows):
+        for c in range(cols):
+            x0, top = 20 + c * cell_w + rng.uniform(0, 4), 40 + r * cell_h * 1.5 + rng.uniform(0, 1)
+            b = {"x0": x0, "x1": x0 + cell_w * rng.uniform(0.5, 0.9), "top": top, "bottom": top + cell_h, "layout_type": "table", "layoutno": "table-0"}
+            boxes.append(b)
+            for k in range(8):
+                cx = b["x0"] + k * 5 + rng.uniform(-1, 1)
+                chars.append({"x0": cx, "x1": cx + 4.5, "top": top + rng.uniform(-1, 1), "bottom": top + cell_h + rng.uniform(-1, 1), "text": "8"})
+    boxes = Recognizer.sort_Y_firstly(boxes, cell_h / 3)
+    table_rows = [{"x0": 20, "x1": 620, "top": 40 + r * cell_h * 1.5 - 2, "bottom": 40 + r * cell_h * 1.5 + cell_h + 2} for r in range(rows)]
+    table_cols = [{"x0": 20 + c * cell_w, "x1": 20 + (c + 1) * cell_w, "top": 40, "bottom": 40 + rows * cell_h * 1.5, "layoutno": "table-0"} for c in range(cols)]
+    return boxes, chars[:n_chars], table_rows, table_cols
+
+
+def timed(fn, repeat):
+    best, res = None, None
+    for _ in range(repeat):
+        st = time.perf_counter()
+        res = fn()
+        elapsed = time.perf_counter() - st
+        best = elapsed if best is None else min(best, elapsed)
+    return best, res
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Box geometry benchmark")
+    parser.add_argument("--chars", type=int, nargs="+", default=[2000, 5000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'chars':>6} {'pass':>24} {'per-pair s':>11} {'batched s':>10} {'speedup':>8}")
+    for n_chars in args.chars:
+        boxes, chars, table_rows, table_cols = build_page(n_chars)
+        passes = [
+            ("char -> box", lambda: [Recognizer.find_overlapped(c, boxes) for c in chars], lambda: Recognizer.find_overlapped_batch(chars, boxes)),
+            (
+                "box -> row",
+                lambda: [Recognizer.find_overlapped_with_threshold(b, table_rows, thr=0.3) for b in boxes],
+                lambda: Recognizer.find_overlapped_with_threshold_batch(boxes, table_rows, thr=0.3),
+            ),
+            (
+                "box -> column",
+                lambda: [Recognizer.find_horizontally_tightest_fit(b, table_cols) for b in boxes],
+                lambda: Recognizer.find_horizontally_tightest_fit_batch(boxes, table_cols),
+            ),
+        ]
+        for name, before, after in passes:
+            t0, r0 = timed(before, args.repeat)
+            t1, r1 = timed(after, args.repeat)
+            assert r0 == r1, f"{name}: results differ"
+            print(f"{n_chars:>6} {name:>24} {t0:>11.3f} {t1:>10.3f} {t0 / t1:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
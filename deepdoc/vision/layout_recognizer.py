@@ -60,15 +60,19 @@ class LayoutRecognizer(Recognizer):
 
             self.client = DLAClient(os.environ["TENSORRT_DLA_SVR"])
 
-    def __call__(self, image_list, ocr_res, scale_factor=3, thr=0.2, batch_size=16, drop=True):
+    def predict(self, image_list, thr=0.2, batch_size=16):
+        """The layout regions the model finds on each image, before they are matched with text boxes."""
+        if self.client:
+            return self.client.predict(image_list)
+        return super().__call__(image_list, thr, batch_size)
+
+    def __call__(self, image_list, ocr_res, scale_factor=3, thr=0.2, batch_size=16, drop=True, layouts=None):
         def __is_garbage(b):
             patt = [r"^•+$", "^[0-9]{1,2} / ?[0-9]{1,2}$", r"^[0-9]{1,2} of [0-9]{1,2}$", "^http://[^ ]{12,}", "\\(cid *: *[0-9]+ *\\)"]
             return any([re.search(p, b["text"]) for p in patt])
 
-        if self.client:
-            layouts = self.client.predict(image_list)
-        else:
-            layouts = super().__call__(image_list, thr, batch_size)
+        if layouts is None:
+            layouts = self.predict(image_list, thr, batch_size)
         # save_results(image_list, layouts, self.labels, output_dir='output/', threshold=0.7)
         assert len(image_list) == len(ocr_res)
         # Tag layout type
@@ -76,6 +80,12 @@ class LayoutRecognizer(Recognizer):
         assert len(image_list) == len(layouts)
         garbages = {}
         page_layout = []
+
+        def page_height(pn):
+            # Lazy page sequences know the size of pages they no longer keep.
+            size_of = getattr(image_list, "size_of", None)
+            return size_of(pn)[1] if size_of else image_list[pn].size[1]
+
         for pn, lts in enumerate(layouts):
             bxs = ocr_res[pn]
             lts = [
@@ -98,6 +108,8 @@ class LayoutRecognizer(Recognizer):
             def findLayout(ty):
                 nonlocal bxs, lts, self
                 lts_ = [lt for lt in lts if lt["type"] == ty]
+                todo = [b for b in bxs if not b.get("layout_type")]
+                hits = dict(zip(map(id, todo), self.find_overlapped_with_threshold_batch(todo, lts_, thr=0.4)))
                 i = 0
                 while i < len(bxs):
                     if bxs[i].get("layout_type"):
@@ -107,15 +119,15 @@ class LayoutRecognizer(Recognizer):
                         bxs.pop(i)
                         continue
 
-                    ii = self.find_overlapped_with_threshold(bxs[i], lts_, thr=0.4)
+                    ii = hits[id(bxs[i])]
                     if ii is None:
                         bxs[i]["layout_type"] = ""
                         i += 1
                         continue
                     lts_[ii]["visited"] = True
                     keep_feats = [
-                        lts_[ii]["type"] == "footer" and bxs[i]["bottom"] < image_list[pn].size[1] * 0.9 / scale_factor,
-                        lts_[ii]["type"] == "header" and bxs[i]["top"] > image_list[pn].size[1] * 0.1 / scale_factor,
+                        lts_[ii]["type"] == "footer" and bxs[i]["bottom"] < page_height(pn) * 0.9 / scale_factor,
+                        lts_[ii]["type"] == "header" and bxs[i]["top"] > page_height(pn) * 0.1 / scale_factor,
                     ]
                     if drop and lts_[ii]["type"] in self.garbage_layouts and not any(keep_feats):
                         if lts_[ii]["type"] not in garbages:
@@ -335,22 +347,17 @@ class AscendLayoutRecognizer(Recognizer):
 
         raise ValueError(f"Unexpected output shape: {arr.shape}")
 
-    def __call__(self, image_list, ocr_res, scale_factor=3, thr=0.2, batch_size=16, drop=True):
-        import re
-        from collections import Counter
-
-        assert len(image_list) == len(ocr_res)
-
-        images = [np.array(im) if not isinstance(im, np.ndarray) else im for im in image_list]
-        layouts_all_pages = []  # list of list[{"type","score","bbox":[x1,y1,x2,y2]}]
+    def predict(self, image_list, thr=0.2, batch_size=16):
+        """The layout regions the model finds on each image, before they are matched with text boxes."""
+        layouts = []  # list of list[{"type","score","bbox":[x1,y1,x2,y2]}]
 
         conf_thr = max(thr, 0.08)
 
-        batch_loop_cnt = math.ceil(float(len(images)) / batch_size)
+        batch_loop_cnt = math.ceil(float(len(image_list)) / batch_size)
         for bi in range(batch_loop_cnt):
             s = bi * batch_size
-            e = min((bi + 1) * batch_size, len(images))
-            batch_images = images[s:e]
+            e = min((bi + 1) * batch_size, len(image_list))
+            batch_images = [np.array(im) if not isinstance(im, np.ndarray) else im for im in image_list[s:e]]
 
             inputs_list = self.preprocess(batch_images)
             logging.debug("preprocess done")
@@ -360,24 +367,36 @@ class AscendLayoutRecognizer(Recognizer):
                 out_list = self.session.infer(feeds=feeds, mode="static")
 
                 for out in out_list:
-                    lts = self.postprocess(out, ins, conf_thr)
-
-                    page_lts = []
-                    for b in lts:
-                        if float(b["score"]) >= 0.4 or b["type"] not in self.garbage_layouts:
-                            x0, y0, x1, y1 = b["bbox"]
-                            page_lts.append(
-                                {
-                                    "type": b["type"],
-                                    "score": float(b["score"]),
-                                    "x0": float(x0) / scale_factor,
-                                    "x1": float(x1) / scale_factor,
-                                    "top": float(y0) / scale_factor,
-                                    "bottom": float(y1) / scale_factor,
-                                    "page_number": len(layouts_all_pages),
-                                }
-                            )
-                    layouts_all_pages.append(page_lts)
+                    layouts.append(self.postprocess(out, ins, conf_thr))
+        return layouts
+
+    def __call__(self, image_list, ocr_res, scale_factor=3, thr=0.2, batch_size=16, drop=True, layouts=None):
+        import re
+        from collections import Counter
+
+        assert len(image_list) == len(ocr_res)
+
+        if layouts is None:
+            layouts = self.predict(image_list, thr, batch_size)
+
+        layouts_all_pages = []
+        for lts in layouts:
+            page_lts = []
+            for b in lts:
+                if float(b["score"]) >= 0.4 or b["type"] not in self.garbage_layouts:
+                    x0, y0, x1, y1 = b["bbox"]
+                    page_lts.append(
+                        {
+                            "type": b["type"],
+                            "score": float(b["score"]),
+                            "x0": float(x0) / scale_factor,
+                            "x1": float(x1) / scale_factor,
+                            "top": float(y0) / scale_factor,
+                            "bottom": float(y1) / scale_factor,
+                            "page_number": len(layouts_all_pages),
+                        }
+                    )
+            layouts_all_pages.append(page_lts)
 
         def _is_garbage_text(box):
             patt = [r"^•+$", r"^[0-9]{1,2} / ?[0-9]{1,2}$", r"^[0-9]{1,2} of [0-9]{1,2}$", r"^http://[^ ]{12,}", r"\(cid *: *[0-9]+ *\)"]
@@ -399,6 +418,8 @@ class AscendLayoutRecognizer(Recognizer):
             def _tag_layout(ty):
                 nonlocal bxs, lts
                 lts_of_ty = [lt for lt in lts if lt["type"] == ty]
+                todo = [b for b in bxs if not b.get("layout_type")]
+                hits = dict(zip(map(id, todo), self.find_overlapped_with_threshold_batch(todo, lts_of_ty, thr=0.4)))
                 i = 0
                 while i < len(bxs):
                     if bxs[i].get("layout_type"):
@@ -408,7 +429,7 @@ class AscendLayoutRecognizer(Recognizer):
                         bxs.pop(i)
                         continue
 
-                    ii = self.find_overlapped_with_threshold(bxs[i], lts_of_ty, thr=0.4)
+                    ii = hits[id(bxs[i])]
                     if ii is None:
                         bxs[i]["layout_type"] = ""
                         i += 1
@@ -18,6 +18,7 @@ import logging
 import copy
 import time
 import os
+from collections import defaultdict
 
 from huggingface_hub import snapshot_download
 
@@ -133,7 +134,7 @@ def load_model(model_dir, nm, device_id: int | None = None):
 class TextRecognizer:
     def __init__(self, model_dir, device_id: int | None = None):
         self.rec_image_shape = [int(v) for v in "3, 48, 320".split(",")]
-        self.rec_batch_num = 16
+        self.rec_batch_num = int(os.environ.get("OCR_REC_BATCH_NUM", "16"))
         postprocess_params = {
             'name': 'CTCLabelDecode',
             "character_dict_path": os.path.join(model_dir, "ocr.res"),
@@ -438,6 +439,12 @@ class TextDetector:
         self.postprocess_op = build_post_process(postprocess_params)
         self.predictor, self.run_options = load_model(model_dir, 'det', device_id)
         self.input_tensor = self.predictor.get_inputs()[0]
+        self.det_batch_num = int(os.environ.get("OCR_DET_BATCH_NUM", "4"))
+        batch_dim = self.input_tensor.shape[0]
+        # Exported with a fixed batch size: every batch must be padded to it.
+        self.det_fixed_batch = isinstance(batch_dim, int) and batch_dim > 0
+        if self.det_fixed_batch:
+            self.det_batch_num = batch_dim
 
         img_h, img_w = self.input_tensor.shape[2:]
         if isinstance(img_h, str) or isinstance(img_w, str):
@@ -529,6 +536,45 @@ class TextDetector:
 
         return dt_boxes, time.time() - st
 
+    def batch(self, img_list):
+        """
+        Detects the text boxes of several images, one result per image. Images whose preprocessed
+        tensors have the same shape, e.g. the pages of a document, run through the model together,
+        det_batch_num at a time.
+        """
+        st = time.time()
+        dt_boxes_list = [None] * len(img_list)
+        same_shape = defaultdict(list)
+        for i, img in enumerate(img_list):
+            data = transform({'image': img}, self.preprocess_op)
+            if data is None or data[0] is None:
+                continue
+            same_shape[data[0].shape].append((i, data[0], data[1]))
+
+        for items in same_shape.values():
+            for beg in range(0, len(items), self.det_batch_num):
+                batch = items[beg:beg + self.det_batch_num]
+                inputs = np.stack([img for _, img, _ in batch])
+                if self.det_fixed_batch and len(batch) < self.det_batch_num:
+                    # the padded rows' outputs are dropped below
+                    inputs = np.concatenate([inputs, np.repeat(inputs[-1:], self.det_batch_num - len(batch), axis=0)])
+                input_dict = {}
+                input_dict[self.input_tensor.name] = inputs
+                for i in range(100000):
+                    try:
+                        outputs = self.predictor.run(None, input_dict, self.run_options)
+                        break
+                    except Exception as e:
+                        if i >= 3:
+                            raise e
+                        time.sleep(5)
+
+                post_result = self.postprocess_op({"maps": outputs[0][:len(batch)]}, np.stack([shape for _, _, shape in batch]))
+                for (ino, _, _), res in zip(batch, post_result):
+                    dt_boxes_list[ino] = self.filter_tag_det_res(res['points'], img_list[ino].shape)
+
+        return dt_boxes_list, time.time() - st
+
     def __del__(self):
         self.close()
 
@@ -705,6 +751,33 @@ class OCR:
             texts.append(text)
         return texts
 
+    def detect_batch(self, img_list, device_id: int | None = None):
+        """
+        `detect` for the page images of a document, one list of (box, ("", 0)) per image, None
+        for an image that could not be preprocessed.
+        """
+        if device_id is None:
+            device_id = 0
+
+        dt_boxes_list, elapse = self.text_detector[device_id].batch(img_list)
+        return [
+            None if dt_boxes is None else list(zip(self.sorted_boxes(dt_boxes), [("", 0) for _ in range(len(dt_boxes))]))
+            for dt_boxes in dt_boxes_list
+        ]
+
+    def recognize_pages(self, crops_per_page, device_id: int | None = None):
+        """
+        `recognize_batch` for the text crops of several pages at once. The recognizer sorts all the
+        crops by width and batches them across page boundaries. Returns the texts page by page.
+        """
+        texts = self.recognize_batch([crop for crops in crops_per_page for crop in crops], device_id)
+        texts_per_page = []
+        beg = 0
+        for crops in crops_per_page:
+            texts_per_page.append(texts[beg:beg + len(crops)])
+            beg += len(crops)
+        return texts_per_page
+
     def __call__(self, img, device_id = 0, cls=True):
         time_dict = {'det': 0, 'rec': 0, 'cls': 0, 'all': 0}
         if device_id is None:
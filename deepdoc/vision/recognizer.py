@@ -26,6 +26,8 @@ from common.file_utils import get_project_base_directory
 from .operators import *  # noqa: F403
 from .operators import preprocess
 from . import operators
+from . import boxes as box_geometry
+from .boxes import Boxes
 from .ocr import load_model
 
 class Recognizer:
@@ -139,6 +141,7 @@ class Recognizer:
                         a["bottom"] < b["top"],
                         a["top"] > b["bottom"]])
 
+        boxes_arr = None
         i = 0
         while i + 1 < len(layouts):
             j = i + 1
@@ -161,12 +164,10 @@ class Recognizer:
                     layouts.pop(i)
                 continue
 
-            area_i, area_i_1 = 0, 0
-            for b in boxes:
-                if not not_overlapped(b, layouts[i]):
-                    area_i += Recognizer.overlapped_area(b, layouts[i], False)
-                if not not_overlapped(b, layouts[j]):
-                    area_i_1 += Recognizer.overlapped_area(b, layouts[j], False)
+            if boxes_arr is None:
+                boxes_arr = Boxes(boxes)
+            area_i = box_geometry.overlapped_area_sum(boxes_arr, layouts[i])
+            area_i_1 = box_geometry.overlapped_area_sum(boxes_arr, layouts[j])
 
             if area_i > area_i_1:
                 layouts.pop(j)
@@ -280,6 +281,19 @@ class Recognizer:
 
         return max_overlapped_i
 
+    @staticmethod
+    def find_overlapped_batch(boxes, boxes_sorted_by_y, naive=False):
+        """`find_overlapped` for many boxes at once, one index or None per box."""
+        return box_geometry.find_overlapped(boxes, boxes_sorted_by_y, naive)
+
+    @staticmethod
+    def find_horizontally_tightest_fit_batch(boxes, targets):
+        return box_geometry.find_horizontally_tightest_fit(boxes, targets)
+
+    @staticmethod
+    def find_overlapped_with_threshold_batch(boxes, targets, thr=0.3):
+        return box_geometry.find_overlapped_with_threshold(boxes, targets, thr)
+
     def preprocess(self, image_list):
         inputs = []
         if "scale_factor" in self.input_names:
@@ -414,18 +428,12 @@ class Recognizer:
 
     def __call__(self, image_list, thr=0.7, batch_size=16):
         res = []
-        images = []
-        for i in range(len(image_list)):
-            if not isinstance(image_list[i], np.ndarray):
-                images.append(np.array(image_list[i]))
-            else:
-                images.append(image_list[i])
-
-        batch_loop_cnt = math.ceil(float(len(images)) / batch_size)
+        # Converted one batch at a time, `image_list` may render pages on access.
+        batch_loop_cnt = math.ceil(float(len(image_list)) / batch_size)
         for i in range(batch_loop_cnt):
             start_index = i * batch_size
-            end_index = min((i + 1) * batch_size, len(images))
-            batch_image_list = images[start_index:end_index]
+            end_index = min((i + 1) * batch_size, len(image_list))
+            batch_image_list = [im if isinstance(im, np.ndarray) else np.array(im) for im in image_list[start_index:end_index]]
             inputs = self.preprocess(batch_image_list)
             logging.debug("preprocess")
             for ins in inputs:
@@ -57,7 +57,7 @@ async def run_graphrag(
     start = trio.current_time()
     tenant_id, kb_id, doc_id = row["tenant_id"], str(row["kb_id"]), row["doc_id"]
     chunks = []
-    for d in settings.retriever.chunk_list(doc_id, tenant_id, [kb_id], fields=["content_with_weight", "doc_id"], sort_by_position=True):
+    for d in settings.retriever.iter_chunks(doc_id, tenant_id, [kb_id], fields=["content_with_weight", "doc_id"], sort_by_position=True):
         chunks.append(d["content_with_weight"])
 
     with trio.fail_after(max(120, len(chunks) * 60 * 10) if enable_timeout_assertion else 10000000000):
@@ -174,7 +174,7 @@ async def run_graphrag_for_kb(
         chunks = []
         current_chunk = ""
 
-        for d in settings.retriever.chunk_list(
+        for d in settings.retriever.iter_chunks(
             doc_id,
             tenant_id,
             [kb_id],
@@ -194,12 +194,19 @@ async def run_graphrag_for_kb(
 
         return chunks
 
-    all_doc_chunks: dict[str, list[str]] = {}
-    total_chunks = 0
-    for doc_id in doc_ids:
-        chunks = load_doc_chunks(doc_id)
-        all_doc_chunks[doc_id] = chunks
-        total_chunks += len(chunks)
+    # Documents are read a few at a time, each merged into LLM sized chunks while it streams in.
+    loaded: dict[str, list[str]] = {}
+    chunk_list_limiter = trio.CapacityLimiter(search.CHUNK_LIST_WORKERS)
+
+    async def load(doc_id: str):
+        loaded[doc_id] = await trio.to_thread.run_sync(load_doc_chunks, doc_id, limiter=chunk_list_limiter)
+
+    async with trio.open_nursery() as nursery:
+        for doc_id in doc_ids:
+            nursery.start_soon(load, doc_id)
+
+    all_doc_chunks: dict[str, list[str]] = {doc_id: loaded[doc_id] for doc_id in doc_ids}
+    total_chunks = sum(len(chunks) for chunks in all_doc_chunks.values())
 
     if total_chunks == 0:
         callback(msg=f"[GraphRAG] kb:{kb_id} has no available chunks in all documents, skip.")
@@ -18,7 +18,6 @@ from hashlib import md5
 from typing import Any, Callable, Set, Tuple
 
 import networkx as nx
-import numpy as np
 import trio
 import xxhash
 from networkx.readwrite import json_graph
@@ -28,6 +27,7 @@ from common.connection_utils import timeout
 from rag.nlp import rag_tokenizer, search
 from rag.utils.doc_store_conn import OrderByExpr
 from rag.utils.redis_conn import REDIS_CONN
+from rag.utils.embedding_cache import EMBED_CACHE, cache_model_of
 from common import settings
 
 GRAPH_FIELD_SEP = "<SEP>"
@@ -90,11 +90,14 @@ def dict_has_keys_with_types(data: dict, expected_fields: list[tuple[str, type]]
     return True
 
 
-def get_llm_cache(llmnm, txt, history, genconf):
+def _llm_cache_key(llmnm, txt, history, genconf):
     hasher = xxhash.xxh64()
     hasher.update((str(llmnm)+str(txt)+str(history)+str(genconf)).encode("utf-8"))
+    return hasher.hexdigest()
 
-    k = hasher.hexdigest()
+
+def get_llm_cache(llmnm, txt, history, genconf):
+    k = _llm_cache_key(llmnm, txt, history, genconf)
     bin = REDIS_CONN.get(k)
     if not bin:
         return None
@@ -102,32 +105,27 @@ def get_llm_cache(llmnm, txt, history, genconf):
 
 
 def set_llm_cache(llmnm, txt, v, history, genconf):
-    hasher = xxhash.xxh64()
-    hasher.update((str(llmnm)+str(txt)+str(history)+str(genconf)).encode("utf-8"))
-    k = hasher.hexdigest()
+    k = _llm_cache_key(llmnm, txt, history, genconf)
     REDIS_CONN.set(k, v.encode("utf-8"), 24 * 3600)
 
 
-def get_embed_cache(llmnm, txt):
-    hasher = xxhash.xxh64()
-    hasher.update(str(llmnm).encode("utf-8"))
-    hasher.update(str(txt).encode("utf-8"))
+def get_llm_cache_batch(llmnm, txts, history, genconf):
+    """Look up cached results of many texts in one round trip, None for the misses."""
+    bins = REDIS_CONN.mget([_llm_cache_key(llmnm, txt, history, genconf) for txt in txts])
+    return [b if b else None for b in bins]
 
-    k = hasher.hexdigest()
-    bin = REDIS_CONN.get(k)
-    if not bin:
-        return
-    return np.array(json.loads(bin))
 
+def set_llm_cache_batch(llmnm, txt2v: dict, history, genconf):
+    """Write back many text -> result pairs in one pipelined round trip."""
+    REDIS_CONN.mset({_llm_cache_key(llmnm, txt, history, genconf): v.encode("utf-8") for txt, v in txt2v.items()}, 24 * 3600)
 
-def set_embed_cache(llmnm, txt, arr):
-    hasher = xxhash.xxh64()
-    hasher.update(str(llmnm).encode("utf-8"))
-    hasher.update(str(txt).encode("utf-8"))
 
-    k = hasher.hexdigest()
-    arr = json.dumps(arr.tolist() if isinstance(arr, np.ndarray) else arr)
-    REDIS_CONN.set(k, arr.encode("utf-8"), 24 * 3600)
+def get_embed_cache(llmnm, txt):
+    return EMBED_CACHE.get(llmnm, txt)
+
+
+def set_embed_cache(llmnm, txt, arr):
+    EMBED_CACHE.set(llmnm, txt, arr)
 
 
 def get_tags_from_cache(kb_ids):
@@ -311,13 +309,13 @@ async def graph_node_to_chunk(kb_id, embd_mdl, ent_name, meta, chunks):
         "available_int": 0,
     }
     chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
-    ebd = get_embed_cache(embd_mdl.llm_name, ent_name)
+    ebd = get_embed_cache(cache_model_of(embd_mdl), ent_name)
     if ebd is None:
         async with chat_limiter:
             with trio.fail_after(3 if enable_timeout_assertion else 30000000):
                 ebd, _ = await trio.to_thread.run_sync(lambda: embd_mdl.encode([ent_name]))
         ebd = ebd[0]
-        set_embed_cache(embd_mdl.llm_name, ent_name, ebd)
+        set_embed_cache(cache_model_of(embd_mdl), ent_name, ebd)
     assert ebd is not None
     chunk["q_%d_vec" % len(ebd)] = ebd
     chunks.append(chunk)
@@ -362,13 +360,13 @@ async def graph_edge_to_chunk(kb_id, embd_mdl, from_ent_name, to_ent_name, meta,
     }
     chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
     txt = f"{from_ent_name}->{to_ent_name}"
-    ebd = get_embed_cache(embd_mdl.llm_name, txt)
+    ebd = get_embed_cache(cache_model_of(embd_mdl), txt)
     if ebd is None:
         async with chat_limiter:
             with trio.fail_after(3 if enable_timeout_assertion else 300000000):
                 ebd, _ = await trio.to_thread.run_sync(lambda: embd_mdl.encode([txt + f": {meta['description']}"]))
         ebd = ebd[0]
-        set_embed_cache(embd_mdl.llm_name, txt, ebd)
+        set_embed_cache(cache_model_of(embd_mdl), txt, ebd)
     assert ebd is not None
     chunk["q_%d_vec" % len(ebd)] = ebd
     chunks.append(chunk)
@@ -51,16 +51,19 @@ class Benchmark:
         time.sleep(20)
         run = defaultdict(dict)
         query_list = list(qrels.keys())
-        for query in query_list:
-            ranks = settings.retriever.retrieval(query, self.embd_mdl, self.tenant_id, [self.kb.id], 1, 30,
-                                            0.0, self.vector_similarity_weight)
-            if len(ranks["chunks"]) == 0:
-                print(f"deleted query: {query}")
-                del qrels[query]
-                continue
-            for c in ranks["chunks"]:
-                c.pop("vector", None)
-                run[query][c["chunk_id"]] = c["similarity"]
+        batch_size = 64
+        for i in range(0, len(query_list), batch_size):
+            batch = query_list[i:i + batch_size]
+            ranks_list = settings.retriever.retrieval_batch(batch, self.embd_mdl, self.tenant_id, [self.kb.id], 1, 30,
+                                                            0.0, self.vector_similarity_weight)
+            for query, ranks in zip(batch, ranks_list):
+                if len(ranks["chunks"]) == 0:
+                    print(f"deleted query: {query}")
+                    del qrels[query]
+                    continue
+                for c in ranks["chunks"]:
+                    c.pop("vector", None)
+                    run[query][c["chunk_id"]] = c["similarity"]
         return run
 
     def embedding(self, docs):
@@ -29,6 +29,7 @@ from rag.flow.tokenizer.schema import TokenizerFromUpstream
 from rag.nlp import rag_tokenizer
 from common import settings
 from rag.svr.task_executor import embed_limiter
+from rag.utils.embedding_buffer import EmbeddingBuffer
 from common.token_utils import truncate
 
 
@@ -81,19 +82,16 @@ class Tokenizer(ProcessBase):
             nonlocal embedding_model
             return embedding_model.encode([truncate(c, embedding_model.max_length - 10) for c in txts])
 
-        cnts_ = np.array([])
+        cnts_ = EmbeddingBuffer(len(texts))
         for i in range(0, len(texts), settings.EMBEDDING_BATCH_SIZE):
             async with embed_limiter:
                 vts, c = await trio.to_thread.run_sync(lambda: batch_encode(texts[i : i + settings.EMBEDDING_BATCH_SIZE]))
-            if len(cnts_) == 0:
-                cnts_ = vts
-            else:
-                cnts_ = np.concatenate((cnts_, vts), axis=0)
+            cnts_.put(i, vts)
             token_count += c
             if i % 33 == 32:
                 self.callback(i * 1.0 / len(texts) / parts / settings.EMBEDDING_BATCH_SIZE + 0.5 * (parts - 1))
 
-        cnts = cnts_
+        cnts = cnts_.matrix()
         title_w = float(self._param.filename_embd_weight)
         vects = (title_w * tts + (1 - title_w) * cnts) if len(tts) == len(cnts) else cnts
 
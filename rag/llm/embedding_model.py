@@ -49,6 +49,18 @@ class Base(ABC):
     def encode_queries(self, text: str):
         raise NotImplementedError("Please implement encode method!")
 
+    def encode_queries_batch(self, texts: list):
+        """
+        Embed several queries. Models embedding queries and documents alike override this with
+        one batched request; the others embed queries one by one.
+        """
+        ress, total_tokens = [], 0
+        for text in texts:
+            v, c = self.encode_queries(text)
+            ress.append(v)
+            total_tokens += c
+        return np.array(ress), total_tokens
+
     def total_token_count(self, resp):
         try:
             return resp.usage.total_tokens
@@ -127,6 +139,9 @@ class OpenAIEmbed(Base):
         res = self.client.embeddings.create(input=[truncate(text, 8191)], model=self.model_name, encoding_format="float",extra_body={"drop_params": True})
         return np.array(res.data[0].embedding), self.total_token_count(res)
 
+    def encode_queries_batch(self, texts: list):
+        return self.encode(texts)
+
 
 class LocalAIEmbed(Base):
     _FACTORY_NAME = "LocalAI"
@@ -154,6 +169,9 @@ class LocalAIEmbed(Base):
         embds, cnt = self.encode([text])
         return np.array(embds[0]), cnt
 
+    def encode_queries_batch(self, texts: list):
+        return self.encode(texts)
+
 
 class AzureEmbed(OpenAIEmbed):
     _FACTORY_NAME = "Azure-OpenAI"
@@ -377,6 +395,9 @@ class JinaEmbed(Base):
         embds, cnt = self.encode([text])
         return np.array(embds[0]), cnt
 
+    def encode_queries_batch(self, texts: list):
+        return self.encode(texts)
+
 
 class JinaMultiVecEmbed(Base):
     _FACTORY_NAME = "Jina"
@@ -417,6 +438,9 @@ class JinaMultiVecEmbed(Base):
         embds, cnt = self.encode([text], task="retrieval.query")
         return np.array(embds[0]), cnt
 
+    def encode_queries_batch(self, texts: list):
+        return self.encode(texts, task="retrieval.query")
+
 
 class MistralEmbed(Base):
     _FACTORY_NAME = "Mistral"
@@ -600,6 +624,9 @@ class NvidiaEmbed(Base):
         embds, cnt = self.encode([text])
         return np.array(embds[0]), cnt
 
+    def encode_queries_batch(self, texts: list):
+        return self.encode(texts)
+
 
 class LmStudioEmbed(LocalAIEmbed):
     _FACTORY_NAME = "LM-Studio"
@@ -0,0 +1,197 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import functools
+import json
+import mmap
+import os
+import struct
+from array import array
+
+MAGIC = b"RFMMDICT"
+VERSION = 1
+# A value of 1, as stored for the reversed keys of the tokenizer dictionary.
+NO_TAG = -1
+
+
+class MmapDict:
+    """
+    Read-only dictionary of ASCII keys mapped to `(freq, tag)` or `1`, stored as sorted arrays
+    in one file and memory-mapped, so every process on the node shares the same pages through
+    the page cache instead of loading its own copy.
+
+    It supports the operations RagTokenizer performs on a datrie.Trie: `key in d`, `d[key]`
+    and `d.has_keys_with_prefix(prefix)`, with lookups done by binary search. Up to `cache_size`
+    recent lookups are memoized per process, as text keeps probing the same short prefixes.
+
+    File layout: MAGIC, uint32 version, uint32 header length, JSON header (count, tags),
+    then the uint32 key offsets (count + 1), int16 frequencies, int16 tag indexes and the
+    concatenated keys.
+    """
+
+    def __init__(self, fnm, cache_size=65536):
+        with open(fnm, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        mm = self._mm
+        if mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{fnm} is not a mmap dictionary")
+        version, header_len = struct.unpack_from("<II", mm, len(MAGIC))
+        if version != VERSION:
+            raise ValueError(f"{fnm} has unsupported version {version}")
+        pos = len(MAGIC) + 8
+        header = json.loads(mm[pos:pos + header_len].decode("utf-8"))
+        pos += header_len
+        self.n = header["count"]
+        self.tags = header["tags"]
+
+        mv = memoryview(mm)
+        self._offsets = mv[pos:pos + 4 * (self.n + 1)].cast("I")
+        pos += 4 * (self.n + 1)
+        self._freqs = mv[pos:pos + 2 * self.n].cast("h")
+        pos += 2 * self.n
+        self._tags = mv[pos:pos + 2 * self.n].cast("h")
+        pos += 2 * self.n
+        self._keys_start = pos
+
+        self._find = functools.lru_cache(maxsize=cache_size)(self._find_) if cache_size else self._find_
+        self.has_keys_with_prefix = functools.lru_cache(maxsize=cache_size)(self._has_keys_with_prefix) if cache_size else self._has_keys_with_prefix
+
+    def __len__(self):
+        return self.n
+
+    def _key(self, i):
+        st = self._keys_start
+        return self._mm[st + self._offsets[i]:st + self._offsets[i + 1]]
+
+    def _bisect(self, key: bytes):
+        mm, offsets, st = self._mm, self._offsets, self._keys_start
+        lo, hi = 0, self.n
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if mm[st + offsets[mid]:st + offsets[mid + 1]] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _find_(self, key):
+        key = key.encode("ascii")
+        i = self._bisect(key)
+        if i < self.n and self._key(i) == key:
+            return i
+        return -1
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    def __getitem__(self, key):
+        i = self._find(key)
+        if i < 0:
+            raise KeyError(key)
+        if self._tags[i] == NO_TAG:
+            return 1
+        return self._freqs[i], self.tags[self._tags[i]]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def _has_keys_with_prefix(self, prefix):
+        prefix = prefix.encode("ascii")
+        i = self._bisect(prefix)
+        return i < self.n and self._key(i).startswith(prefix)
+
+    def keys(self):
+        for i in range(self.n):
+            yield self._key(i).decode("ascii")
+
+    def items(self):
+        for k in self.keys():
+            yield k, self[k]
+
+    def close(self):
+        for f in [self._find, self.has_keys_with_prefix]:
+            if hasattr(f, "cache_clear"):
+                f.cache_clear()
+        self._offsets.release()
+        self._freqs.release()
+        self._tags.release()
+        self._mm.close()
+
+    @staticmethod
+    def save(d: dict, fnm):
+        """
+        Write `d`, mapping ASCII keys to `(freq, tag)` or `1`, to `fnm`. The file is written
+        next to the target and renamed, so readers never map a partially written file.
+        """
+        keys = sorted(k.encode("ascii") for k in d)
+        tags = sorted({v[1] for v in d.values() if isinstance(v, tuple)})
+        tag_idx = {t: i for i, t in enumerate(tags)}
+
+        offsets, freqs, tag_ids = array("I", [0]), array("h"), array("h")
+        for k in keys:
+            v = d[k.decode("ascii")]
+            offsets.append(offsets[-1] + len(k))
+            if isinstance(v, tuple):
+                freqs.append(int(v[0]))
+                tag_ids.append(tag_idx[v[1]])
+            else:
+                freqs.append(0)
+                tag_ids.append(NO_TAG)
+
+        header = json.dumps({"count": len(keys), "tags": tags}, ensure_ascii=False).encode("utf-8")
+        # pad so the arrays start 4-byte aligned, they are read with native byte order
+        header += b" " * (-len(header) % 4)
+        tmp = fnm + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<II", VERSION, len(header)))
+            f.write(header)
+            f.write(offsets.tobytes())
+            f.write(freqs.tobytes())
+            f.write(tag_ids.tobytes())
+            for k in keys:
+                f.write(k)
+        os.replace(tmp, fnm)
+
+
+def main():
+    import argparse
+    import datrie
+
+    parser = argparse.ArgumentParser(description="Convert the tokenizer dictionary to a memory-mapped dictionary")
+    parser.add_argument("source", help="datrie file (huqie.txt.trie) or plain dictionary (huqie.txt)")
+    parser.add_argument("--output", default="", help="defaults to the source with a .mmdict suffix instead of .trie")
+    args = parser.parse_args()
+
+    if args.source.endswith(".trie"):
+        trie = datrie.Trie.load(args.source)
+        output = args.output or args.source[:-len(".trie")] + ".mmdict"
+    else:
+        import string
+        from rag.nlp.rag_tokenizer import RagTokenizer
+
+        trie = datrie.Trie(string.printable)
+        RagTokenizer()._load_dict(args.source, trie)
+        output = args.output or args.source + ".mmdict"
+    MmapDict.save(dict(trie.items()), output)
+    print(f"{len(trie)} keys written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -19,8 +19,10 @@ import json
 import re
 from collections import defaultdict
 
+import numpy as np
+
 from rag.utils.doc_store_conn import MatchTextExpr
-from rag.nlp import rag_tokenizer, term_weight, synonym
+from rag.nlp import rag_tokenizer, term_weight, synonym, rerank_kernel
 
 
 class FulltextQueryer:
@@ -217,14 +219,11 @@ class FulltextQueryer:
         return None, keywords
 
     def hybrid_similarity(self, avec, bvecs, atks, btkss, tkweight=0.3, vtweight=0.7):
-        from sklearn.metrics.pairwise import cosine_similarity
-        import numpy as np
-
-        sims = cosine_similarity([avec], bvecs)
+        if not isinstance(bvecs, np.ndarray):
+            bvecs = rerank_kernel.decode_vectors(bvecs, len(avec))
+        sims = rerank_kernel.cosine_scores(avec, bvecs)
         tksim = self.token_similarity(atks, btkss)
-        if np.sum(sims[0]) == 0:
-            return np.array(tksim), tksim, sims[0]
-        return np.array(sims[0]) * vtweight + np.array(tksim) * tkweight, tksim, sims[0]
+        return rerank_kernel.hybrid_scores(sims, tksim, tkweight, vtweight), tksim, sims
 
     def token_similarity(self, atks, btkss):
         def to_dict(tks):
@@ -236,9 +235,15 @@ class FulltextQueryer:
                 d[t] += c
             return d
 
+        def to_set(tks):
+            if isinstance(tks, str):
+                tks = tks.split()
+            return tks if isinstance(tks, (set, frozenset)) else set(tks)
+
+        # similarity() only sums the weights of query terms found in the candidate,
+        # so candidates are plain token sets and never go through term weighting.
         atks = to_dict(atks)
-        btkss = [to_dict(tks) for tks in btkss]
-        return [self.similarity(atks, btks) for btks in btkss]
+        return rerank_kernel.token_scores(atks, [to_set(tks) for tks in btkss]).tolist()
 
     def similarity(self, qtwt, dtwt):
         if isinstance(dtwt, type("")):
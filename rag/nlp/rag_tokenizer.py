@@ -16,16 +16,25 @@
 
 import logging
 import copy
+import functools
 import datrie
 import math
 import os
 import re
 import string
 import sys
+import threading
 from hanziconv import HanziConv
 from nltk import word_tokenize
 from nltk.stem import PorterStemmer, WordNetLemmatizer
 from common.file_utils import get_project_base_directory
+from rag.nlp.mmap_dict import MmapDict
+
+TOKENIZER_CACHE_SIZE = int(os.environ.get("TOKENIZER_CACHE_SIZE", "65536"))
+# Longer texts are rarely repeated, caching them would only churn the cache.
+TOKENIZER_CACHE_MAX_LEN = int(os.environ.get("TOKENIZER_CACHE_MAX_LEN", "512"))
+# Use rag/res/huqie.txt.mmdict, built with `python -m rag.nlp.mmap_dict`, when it exists.
+TOKENIZER_MMAP_DICT = int(os.environ.get("TOKENIZER_MMAP_DICT", "1"))
 
 
 class RagTokenizer:
@@ -35,7 +44,8 @@ class RagTokenizer:
     def rkey_(self, line):
         return str(("DD" + (line[::-1].lower())).encode("utf-8"))[2:-1]
 
-    def _load_dict(self, fnm):
+    def _load_dict(self, fnm, trie=None):
+        trie = self.trie_ if trie is None else trie
         logging.info(f"[HUQIE]:Build trie from {fnm}")
         try:
             of = open(fnm, "r", encoding='utf-8')
@@ -47,18 +57,18 @@ class RagTokenizer:
                 line = re.split(r"[ \t]", line)
                 k = self.key_(line[0])
                 F = int(math.log(float(line[1]) / self.DENOMINATOR) + .5)
-                if k not in self.trie_ or self.trie_[k][0] < F:
-                    self.trie_[self.key_(line[0])] = (F, line[2])
-                self.trie_[self.rkey_(line[0])] = 1
+                if k not in trie or trie[k][0] < F:
+                    trie[self.key_(line[0])] = (F, line[2])
+                trie[self.rkey_(line[0])] = 1
 
             dict_file_cache = fnm + ".trie"
             logging.info(f"[HUQIE]:Build trie cache to {dict_file_cache}")
-            self.trie_.save(dict_file_cache)
+            trie.save(dict_file_cache)
             of.close()
         except Exception:
             logging.exception(f"[HUQIE]:Build trie {fnm} failed")
 
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, cache_size=TOKENIZER_CACHE_SIZE):
         self.DEBUG = debug
         self.DENOMINATOR = 1000000
         self.DIR_ = os.path.join(get_project_base_directory(), "rag/res", "huqie")
@@ -67,27 +77,61 @@ class RagTokenizer:
         self.lemmatizer = WordNetLemmatizer()
 
         self.SPLIT_CHAR = r"([ ,\.<>/?;:'\[\]\\`!@#$%^&*\(\)\{\}\|_+=《》，。？、；‘’：“”【】~！￥%……（）——-]+|[a-zA-Z0-9,\.-]+)"
+        self.SPLIT_CHAR_RE = re.compile(self.SPLIT_CHAR)
+
+        # Memoize whole segments (titles, headers, boilerplate, queries) and single English words.
+        # The caches depend on the dictionary, so they are dropped whenever it changes.
+        self.cache_size = cache_size
+        self.ascii_fast_path = True
+        self._tokenize_cached = functools.lru_cache(maxsize=cache_size)(self._tokenize) if cache_size else self._tokenize
+        self._fine_grained_tokenize_cached = functools.lru_cache(maxsize=cache_size)(self._fine_grained_tokenize) if cache_size else self._fine_grained_tokenize
+        self._normalize_word = functools.lru_cache(maxsize=cache_size)(self._normalize_word_) if cache_size else self._normalize_word_
+
+        # The dictionary is loaded on first use, so importing this module stays cheap.
+        self._trie = None
+        self._trie_lock = threading.Lock()
+
+    @property
+    def trie_(self):
+        if self._trie is None:
+            with self._trie_lock:
+                if self._trie is None:
+                    self._trie = self._load_trie()
+        return self._trie
+
+    @trie_.setter
+    def trie_(self, trie):
+        self._trie = trie
+
+    def _load_trie(self):
+        mmdict_file_name = self.DIR_ + ".txt.mmdict"
+        if TOKENIZER_MMAP_DICT and os.path.exists(mmdict_file_name):
+            try:
+                # shared with the other processes through the page cache
+                return MmapDict(mmdict_file_name, cache_size=self.cache_size)
+            except Exception:
+                logging.exception(f"[HUQIE]:Fail to map dictionary file {mmdict_file_name}, fall back to the trie file")
 
         trie_file_name = self.DIR_ + ".txt.trie"
         # check if trie file existence
         if os.path.exists(trie_file_name):
             try:
                 # load trie from file
-                self.trie_ = datrie.Trie.load(trie_file_name)
-                return
+                return datrie.Trie.load(trie_file_name)
             except Exception:
                 # fail to load trie from file, build default trie
                 logging.exception(f"[HUQIE]:Fail to load trie file {trie_file_name}, build the default trie file")
-                self.trie_ = datrie.Trie(string.printable)
         else:
             # file not exist, build default trie
             logging.info(f"[HUQIE]:Trie file {trie_file_name} not found, build the default trie file")
-            self.trie_ = datrie.Trie(string.printable)
 
         # load data from dict file and save to trie file
-        self._load_dict(self.DIR_ + ".txt")
+        trie = datrie.Trie(string.printable)
+        self._load_dict(self.DIR_ + ".txt", trie)
+        return trie
 
     def load_user_dict(self, fnm):
+        self.clear_cache()
         try:
             self.trie_ = datrie.Trie.load(fnm + ".trie")
             return
@@ -96,8 +140,20 @@ class RagTokenizer:
         self._load_dict(fnm)
 
     def add_user_dict(self, fnm):
+        self.clear_cache()
+        if isinstance(self.trie_, MmapDict):
+            # the mapped dictionary is read-only, copy it into a private trie first
+            trie = datrie.Trie(string.printable)
+            for k, v in self.trie_.items():
+                trie[k] = v
+            self.trie_ = trie
         self._load_dict(fnm)
 
+    def clear_cache(self):
+        for f in [self._tokenize_cached, self._fine_grained_tokenize_cached, self._normalize_word]:
+            if hasattr(f, "cache_clear"):
+                f.cache_clear()
+
     def _strQ2B(self, ustring):
         """Convert full-width characters to half-width characters"""
         rstring = ""
@@ -293,12 +349,15 @@ class RagTokenizer:
 
         return self.score_(res[::-1])
 
+    def _normalize_word_(self, t):
+        return self.stemmer.stem(self.lemmatizer.lemmatize(t))
+
     def english_normalize_(self, tks):
-        return [self.stemmer.stem(self.lemmatizer.lemmatize(t)) if re.match(r"[a-zA-Z_-]+$", t) else t for t in tks]
+        return [self._normalize_word(t) if re.match(r"[a-zA-Z_-]+$", t) else t for t in tks]
 
     def _split_by_lang(self, line):
         txt_lang_pairs = []
-        arr = re.split(self.SPLIT_CHAR, line)
+        arr = self.SPLIT_CHAR_RE.split(line)
         for a in arr:
             if not a:
                 continue
@@ -320,7 +379,31 @@ class RagTokenizer:
         return txt_lang_pairs
 
     def tokenize(self, line):
+        if len(line) <= TOKENIZER_CACHE_MAX_LEN:
+            return self._tokenize_cached(line)
+        return self._tokenize(line)
+
+    def tokenize_many(self, lines):
+        """Tokenize a batch of texts, each distinct text only once."""
+        res = {}
+        for line in lines:
+            if line not in res:
+                res[line] = self.tokenize(line)
+        return [res[line] for line in lines]
+
+    def _tokenize_ascii(self, line):
+        # Full/half width and traditional/simplified conversion are no-ops on ASCII and
+        # there is no Chinese to segment, so only English normalization is left.
+        res = []
+        for L in self.SPLIT_CHAR_RE.split(line.lower()):
+            if L:
+                res.extend([self._normalize_word(t) for t in word_tokenize(L)])
+        return self.merge_(" ".join(res))
+
+    def _tokenize(self, line):
         line = re.sub(r"\W+", " ", line)
+        if self.ascii_fast_path and line.isascii():
+            return self._tokenize_ascii(line)
         line = self._strQ2B(line).lower()
         line = self._tradi2simp(line)
 
@@ -328,7 +411,7 @@ class RagTokenizer:
         res = []
         for L,lang in arr:
             if not lang:
-                res.extend([self.stemmer.stem(self.lemmatizer.lemmatize(t)) for t in word_tokenize(L)])
+                res.extend([self._normalize_word(t) for t in word_tokenize(L)])
                 continue
             if len(L) < 2 or re.match(
                     r"[a-z\.-]+$", L) or re.match(r"[0-9\.-]+$", L):
@@ -392,6 +475,11 @@ class RagTokenizer:
         return self.merge_(res)
 
     def fine_grained_tokenize(self, tks):
+        if len(tks) <= TOKENIZER_CACHE_MAX_LEN:
+            return self._fine_grained_tokenize_cached(tks)
+        return self._fine_grained_tokenize(tks)
+
+    def _fine_grained_tokenize(self, tks):
         tks = tks.split()
         zh_num = len([1 for c in tks if c and is_chinese(c[0])])
         if zh_num < len(tks) * 0.2:
@@ -465,6 +553,7 @@ def naive_qie(txt):
 
 tokenizer = RagTokenizer()
 tokenize = tokenizer.tokenize
+tokenize_many = tokenizer.tokenize_many
 fine_grained_tokenize = tokenizer.fine_grained_tokenize
 tag = tokenizer.tag
 freq = tokenizer.freq
@@ -0,0 +1,122 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Compares the per-candidate hybrid rerank scoring with the batched kernels of rerank_kernel.
+
+    python rag/nlp/rerank_benchmark.py [--candidates 256 1024 4096] [--dims 768 1024 1536]
+
+Candidate vectors are given both as lists of floats (Elasticsearch, OpenSearch) and as
+tab-separated strings; tag features are given in their str() form. Parsing dominates the
+string case, so its speedup is lower.
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+
+from common.float_utils import get_float
+from rag.nlp import rerank_kernel
+
+TAGS = [f"tag{i}" for i in range(64)]
+VOCAB = [f"tk{i}" for i in range(5000)]
+
+
+def build_candidates(n, dim, fmt, rnd):
+    vects = np.random.default_rng(0).standard_normal((n, dim)).astype(np.float32)
+    if fmt == "str":
+        vects = ["\t".join(f"{v:.6f}" for v in row) for row in vects]
+    else:
+        vects = vects.tolist()
+    return {
+        "vectors": vects,
+        "tokens": [set(rnd.sample(VOCAB, 200)) for _ in range(n)],
+        "tag_feas": [str({t: rnd.randint(1, 10) for t in rnd.sample(TAGS, 5)}) if rnd.random() < 0.5 else "" for _ in range(n)],
+        "pageranks": [rnd.choice([0, 0, 0, 10]) for _ in range(n)],
+    }
+
+
+def legacy(qv, qtw, query_rfea, cands):
+    ins_embd = []
+    for vector in cands["vectors"]:
+        if isinstance(vector, str):
+            vector = [get_float(v) for v in vector.split("\t")]
+        ins_embd.append(vector)
+    vtsim = cosine_similarity([qv], ins_embd)[0]
+
+    tksim = []
+    for tks in cands["tokens"]:
+        s = 1e-9 + sum(v for k, v in qtw.items() if k in tks)
+        tksim.append(s / (1e-9 + sum(qtw.values())))
+
+    q_denor = np.sqrt(np.sum([s * s for s in query_rfea.values()]))
+    rank_fea = []
+    for tag_fea in cands["tag_feas"]:
+        if not tag_fea:
+            rank_fea.append(0)
+            continue
+        nor, denor = 0, 0
+        for t, sc in eval(tag_fea).items():
+            if t in query_rfea:
+                nor += query_rfea[t] * sc
+            denor += sc * sc
+        rank_fea.append(nor / np.sqrt(denor) / q_denor)
+    return vtsim * 0.7 + np.array(tksim) * 0.3 + np.array(rank_fea) * 10. + np.array(cands["pageranks"], dtype=float)
+
+
+def batched(qv, qtw, query_rfea, cands):
+    mat = rerank_kernel.decode_vectors(cands["vectors"], len(qv))
+    vtsim = rerank_kernel.cosine_scores(qv, mat)
+    tksim = rerank_kernel.token_scores(qtw, cands["tokens"])
+    rank_fea = rerank_kernel.rank_feature_scores(query_rfea, cands["tag_feas"], cands["pageranks"])
+    return rerank_kernel.hybrid_scores(vtsim, tksim, 0.3, 0.7) + rank_fea
+
+
+def timeit(fn, repeat, *args):
+    best, res = float("inf"), None
+    for _ in range(repeat):
+        st = time.perf_counter()
+        res = fn(*args)
+        best = min(best, time.perf_counter() - st)
+    return best, res
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hybrid rerank micro-benchmark")
+    parser.add_argument("--candidates", type=int, nargs="+", default=[256, 1024, 4096])
+    parser.add_argument("--dims", type=int, nargs="+", default=[768, 1024, 1536])
+    parser.add_argument("--repeat", type=int, default=5, help="best of this many runs is reported")
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    qtw = {t: rnd.random() for t in rnd.sample(VOCAB, 12)}
+    query_rfea = {t: rnd.randint(1, 10) for t in rnd.sample(TAGS, 3)}
+    print(f"{'vectors':>7} {'candidates':>10} {'dim':>5} {'legacy ms':>10} {'batched ms':>11} {'speedup':>8} {'max diff':>9}")
+    for fmt in ["list", "str"]:
+        for n in args.candidates:
+            for dim in args.dims:
+                cands = build_candidates(n, dim, fmt, rnd)
+                qv = np.random.default_rng(1).standard_normal(dim).tolist()
+                legacy_t, legacy_res = timeit(legacy, args.repeat, qv, qtw, query_rfea, cands)
+                batched_t, batched_res = timeit(batched, args.repeat, qv, qtw, query_rfea, cands)
+                diff = float(np.max(np.abs(legacy_res - batched_res)))
+                print(f"{fmt:>7} {n:>10} {dim:>5} {legacy_t * 1000:>10.2f} {batched_t * 1000:>11.2f} "
+                      f"{legacy_t / batched_t:>7.1f}x {diff:>9.2e}")
+
+
+if __name__ == "__main__":
+    main()
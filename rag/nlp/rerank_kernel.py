@@ -0,0 +1,135 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Batched scoring of rerank candidates: vector, token and rank-feature similarities
+computed over whole candidate sets with NumPy instead of per candidate.
+
+Scores are returned as float64 arrays, whose elements are Python floats and stay
+JSON serializable in retrieval results.
+"""
+
+import ast
+import json
+
+import numpy as np
+
+from common.constants import PAGERANK_FLD
+from common.float_utils import get_float
+
+
+def decode_vectors(vectors: list, dim: int) -> np.ndarray:
+    """
+    Decode candidate vectors into one preallocated (n, dim) float32 matrix.
+    Items may be lists, arrays, tab-separated strings or None (zero row).
+    """
+    mat = np.zeros((len(vectors), dim), dtype=np.float32)
+    for i, v in enumerate(vectors):
+        if v is None:
+            continue
+        if isinstance(v, str):
+            tks = v.split("\t")
+            try:
+                mat[i] = np.array(tks, dtype=np.float32)
+            except ValueError:
+                # malformed values become -inf, as get_float does
+                mat[i] = [get_float(t) for t in tks]
+        else:
+            mat[i] = v
+    return mat
+
+
+def cosine_scores(query_vector, mat: np.ndarray) -> np.ndarray:
+    """Cosine similarity of the query vector with each row, 0 for zero vectors."""
+    if not len(mat):
+        return np.zeros(0)
+    q = np.asarray(query_vector, dtype=np.float32)
+    q_norm = np.linalg.norm(q)
+    if q_norm == 0:
+        return np.zeros(len(mat))
+    norms = np.sqrt(np.einsum("ij,ij->i", mat, mat))
+    norms[norms == 0] = 1
+    return (mat @ (q / q_norm) / norms).astype(np.float64)
+
+
+def token_scores(query_weights: dict, token_sets: list) -> np.ndarray:
+    """
+    Share of the query term weight found in each candidate's token set,
+    as FulltextQueryer.similarity() computes it for one candidate.
+    """
+    res = np.full(len(token_sets), 1e-9)
+    total = 1e-9
+    for t, w in query_weights.items():
+        total += w
+        res += w * np.fromiter((t in tks for tks in token_sets), dtype=bool, count=len(token_sets))
+    return res / total
+
+
+def hybrid_scores(vtsim: np.ndarray, tksim, tkweight=0.3, vtweight=0.7) -> np.ndarray:
+    tksim = np.asarray(tksim, dtype=np.float64)
+    if np.sum(vtsim) == 0:
+        return tksim
+    return vtsim * vtweight + tksim * tkweight
+
+
+def parse_tag_features(v) -> dict:
+    """Tag features come back as dicts or as their str()/JSON form depending on the doc engine."""
+    if not v:
+        return {}
+    if isinstance(v, dict):
+        return v
+    try:
+        return json.loads(v)
+    except Exception:
+        pass
+    try:
+        return json.loads(v.replace("'", '"'))
+    except Exception:
+        pass
+    try:
+        return ast.literal_eval(v)
+    except Exception:
+        return {}
+
+
+def rank_feature_scores(query_rfea: dict | None, tag_feas: list, pageranks) -> np.ndarray:
+    """
+    Cosine similarity between the query's tag features and each candidate's, scaled by 10,
+    plus the candidate's pagerank.
+    """
+    pageranks = np.asarray(pageranks, dtype=np.float64)
+    n = len(tag_feas)
+    if not query_rfea or not n:
+        return np.zeros(n) + pageranks
+
+    q_denor = np.sqrt(np.sum([s * s for t, s in query_rfea.items() if t != PAGERANK_FLD]))
+    if q_denor == 0:
+        return np.zeros(n) + pageranks
+    rows, qws, scs = [], [], []
+    for i, v in enumerate(tag_feas):
+        for t, sc in parse_tag_features(v).items():
+            rows.append(i)
+            qws.append(query_rfea.get(t, 0))
+            scs.append(sc)
+    if not rows:
+        return np.zeros(n) + pageranks
+
+    rows = np.asarray(rows)
+    scs = np.asarray(scs, dtype=np.float64)
+    nor = np.bincount(rows, weights=np.asarray(qws, dtype=np.float64) * scs, minlength=n)
+    denor = np.sqrt(np.bincount(rows, weights=scs * scs, minlength=n))
+    rank_fea = np.where(denor > 0, nor / np.where(denor > 0, denor, 1), 0) / q_denor
+    return rank_fea * 10. + pageranks
+
@@ -13,26 +13,42 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import contextvars
 import json
 import logging
 import re
 import math
 import os
-from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from dataclasses import dataclass
 
 from rag.prompts.generator import relevant_chunks_with_toc
-from rag.nlp import rag_tokenizer, query
+from rag.nlp import rag_tokenizer, query, rerank_kernel
 import numpy as np
+from rag.utils.retrieval_cache import RETRIEVAL_CACHE
 from rag.utils.doc_store_conn import DocStoreConnection, MatchDenseExpr, FusionExpr, OrderByExpr
 from common.string_utils import remove_redundant_spaces
 from common.float_utils import get_float
 from common.constants import PAGERANK_FLD, TAG_FLD
+from common.metrics import stage
 
 
 def index_name(uid): return f"ragflow_{uid}"
 
 
+def index_names(tenant_ids) -> list[str]:
+    return [index_name(tid) for tid in (tenant_ids.split(",") if isinstance(tenant_ids, str) else tenant_ids)]
+
+
+# Questions of one retrieval_batch() call searched and reranked at once, shared by all calls.
+RETRIEVAL_BATCH_WORKERS = int(os.environ.get("RETRIEVAL_BATCH_WORKERS", "8"))
+batch_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_BATCH_WORKERS, thread_name_prefix="retrieval_batch")
+# Chunks fetched per doc store request, and documents fetched at once, when listing document chunks.
+CHUNK_LIST_PAGE_SIZE = int(os.environ.get("CHUNK_LIST_PAGE_SIZE", "1024"))
+CHUNK_LIST_WORKERS = int(os.environ.get("CHUNK_LIST_WORKERS", "4"))
+
+
 class Dealer:
     def __init__(self, dataStore: DocStoreConnection):
         self.qryr = query.FulltextQueryer()
@@ -49,8 +65,12 @@ class Dealer:
         keywords: list[str] | None = None
         group_docs: list[list] | None = None
 
-    def get_vector(self, txt, emb_mdl, topk=10, similarity=0.1):
-        qv, _ = emb_mdl.encode_queries(txt)
+    def get_vector(self, txt, emb_mdl, topk=10, similarity=0.1, query_vector=None):
+        if query_vector is not None:
+            qv = query_vector
+        else:
+            with stage("embedding"):
+                qv, _ = emb_mdl.encode_queries(txt)
         shape = np.array(qv).shape
         if len(shape) > 1:
             raise Exception(
@@ -70,11 +90,16 @@ class Dealer:
                 condition[key] = req[key]
         return condition
 
+    def _store_search(self, *args, **kwargs):
+        with stage("search"):
+            return self.dataStore.search(*args, **kwargs)
+
     def search(self, req, idx_names: str | list[str],
                kb_ids: list[str],
                emb_mdl=None,
                highlight: bool | list | None = None,
-               rank_feature: dict | None = None
+               rank_feature: dict | None = None,
+               query_vector=None
                ):
         if highlight is None:
             highlight = False
@@ -101,7 +126,7 @@ class Dealer:
                 orderBy.asc("page_num_int")
                 orderBy.asc("top_int")
                 orderBy.desc("create_timestamp_flt")
-            res = self.dataStore.search(src, [], filters, [], orderBy, offset, limit, idx_names, kb_ids)
+            res = self._store_search(src, [], filters, [], orderBy, offset, limit, idx_names, kb_ids)
             total = self.dataStore.get_total(res)
             logging.debug("Dealer.search TOTAL: {}".format(total))
         else:
@@ -113,19 +138,19 @@ class Dealer:
             matchText, keywords = self.qryr.question(qst, min_match=0.3)
             if emb_mdl is None:
                 matchExprs = [matchText]
-                res = self.dataStore.search(src, highlightFields, filters, matchExprs, orderBy, offset, limit,
+                res = self._store_search(src, highlightFields, filters, matchExprs, orderBy, offset, limit,
                                             idx_names, kb_ids, rank_feature=rank_feature)
                 total = self.dataStore.get_total(res)
                 logging.debug("Dealer.search TOTAL: {}".format(total))
             else:
-                matchDense = self.get_vector(qst, emb_mdl, topk, req.get("similarity", 0.1))
+                matchDense = self.get_vector(qst, emb_mdl, topk, req.get("similarity", 0.1), query_vector)
                 q_vec = matchDense.embedding_data
                 src.append(f"q_{len(q_vec)}_vec")
 
                 fusionExpr = FusionExpr("weighted_sum", topk, {"weights": "0.05,0.95"})
                 matchExprs = [matchText, matchDense, fusionExpr]
 
-                res = self.dataStore.search(src, highlightFields, filters, matchExprs, orderBy, offset, limit,
+                res = self._store_search(src, highlightFields, filters, matchExprs, orderBy, offset, limit,
                                             idx_names, kb_ids, rank_feature=rank_feature)
                 total = self.dataStore.get_total(res)
                 logging.debug("Dealer.search TOTAL: {}".format(total))
@@ -133,12 +158,12 @@ class Dealer:
                 # If result is empty, try again with lower min_match
                 if total == 0:
                     if filters.get("doc_id"):
-                        res = self.dataStore.search(src, [], filters, [], orderBy, offset, limit, idx_names, kb_ids)
+                        res = self._store_search(src, [], filters, [], orderBy, offset, limit, idx_names, kb_ids)
                         total = self.dataStore.get_total(res)
                     else:
                         matchText, _ = self.qryr.question(qst, min_match=0.1)
                         matchDense.extra_options["similarity"] = 0.17
-                        res = self.dataStore.search(src, highlightFields, filters, [matchText, matchDense, fusionExpr],
+                        res = self._store_search(src, highlightFields, filters, [matchText, matchDense, fusionExpr],
                                                     orderBy, offset, limit, idx_names, kb_ids, rank_feature=rank_feature)
                         total = self.dataStore.get_total(res)
                     logging.debug("Dealer.search 2 TOTAL: {}".format(total))
@@ -221,8 +246,9 @@ class Dealer:
 
         assert len(ans_v[0]) == len(chunk_v[0]), "The dimension of query and chunk do not match: {} vs. {}".format(
             len(ans_v[0]), len(chunk_v[0]))
+        chunk_v = rerank_kernel.decode_vectors(chunk_v, len(ans_v[0]))
 
-        chunks_tks = [rag_tokenizer.tokenize(self.qryr.rmWWW(ck)).split()
+        chunks_tks = [set(rag_tokenizer.tokenize(self.qryr.rmWWW(ck)).split())
                       for ck in chunks]
         cites = {}
         thr = 0.63
@@ -262,58 +288,33 @@ class Dealer:
 
     def _rank_feature_scores(self, query_rfea, search_res):
         ## For rank feature(tag_fea) scores.
-        rank_fea = []
-        pageranks = []
-        for chunk_id in search_res.ids:
-            pageranks.append(search_res.field[chunk_id].get(PAGERANK_FLD, 0))
-        pageranks = np.array(pageranks, dtype=float)
-
-        if not query_rfea:
-            return np.array([0 for _ in range(len(search_res.ids))]) + pageranks
-
-        q_denor = np.sqrt(np.sum([s*s for t,s in query_rfea.items() if t != PAGERANK_FLD]))
-        for i in search_res.ids:
-            nor, denor = 0, 0
-            if not search_res.field[i].get(TAG_FLD):
-                rank_fea.append(0)
-                continue
-            for t, sc in eval(search_res.field[i].get(TAG_FLD, "{}")).items():
-                if t in query_rfea:
-                    nor += query_rfea[t] * sc
-                denor += sc * sc
-            if denor == 0:
-                rank_fea.append(0)
-            else:
-                rank_fea.append(nor/np.sqrt(denor)/q_denor)
-        return np.array(rank_fea)*10. + pageranks
+        fields = [search_res.field[i] for i in search_res.ids]
+        return rerank_kernel.rank_feature_scores(query_rfea,
+                                                 [f.get(TAG_FLD) for f in fields],
+                                                 [f.get(PAGERANK_FLD, 0) for f in fields])
 
     def rerank(self, sres, query, tkweight=0.3,
                vtweight=0.7, cfield="content_ltks",
                rank_feature: dict | None = None
                ):
         _, keywords = self.qryr.question(query)
+        if not sres.ids:
+            return [], [], []
         vector_size = len(sres.query_vector)
         vector_column = f"q_{vector_size}_vec"
-        zero_vector = [0.0] * vector_size
-        ins_embd = []
-        for chunk_id in sres.ids:
-            vector = sres.field[chunk_id].get(vector_column, zero_vector)
-            if isinstance(vector, str):
-                vector = [get_float(v) for v in vector.split("\t")]
-            ins_embd.append(vector)
-        if not ins_embd:
-            return [], [], []
+        ins_embd = rerank_kernel.decode_vectors([sres.field[i].get(vector_column) for i in sres.ids], vector_size)
 
         for i in sres.ids:
             if isinstance(sres.field[i].get("important_kwd", []), str):
                 sres.field[i]["important_kwd"] = [sres.field[i]["important_kwd"]]
+        # Token similarity only checks which query terms a candidate contains, so each
+        # candidate is reduced to the set of its indexed tokens.
         ins_tw = []
         for i in sres.ids:
-            content_ltks = list(OrderedDict.fromkeys(sres.field[i][cfield].split()))
-            title_tks = [t for t in sres.field[i].get("title_tks", "").split() if t]
-            question_tks = [t for t in sres.field[i].get("question_tks", "").split() if t]
-            important_kwd = sres.field[i].get("important_kwd", [])
-            tks = content_ltks + title_tks * 2 + important_kwd * 5 + question_tks * 6
+            tks = set(sres.field[i][cfield].split())
+            tks.update(sres.field[i].get("title_tks", "").split())
+            tks.update(sres.field[i].get("question_tks", "").split())
+            tks.update(sres.field[i].get("important_kwd", []))
             ins_tw.append(tks)
 
         ## For rank feature(tag_fea) scores.
@@ -359,9 +360,68 @@ class Dealer:
                   vector_similarity_weight=0.3, top=1024, doc_ids=None, aggs=True,
                   rerank_mdl=None, highlight=False,
                   rank_feature: dict | None = {PAGERANK_FLD: 10}):
-        ranks = {"total": 0, "chunks": [], "doc_aggs": {}}
         if not question:
+            return {"total": 0, "chunks": [], "doc_aggs": {}}
+
+        params = RETRIEVAL_CACHE.params(question, embd_mdl, tenant_ids, kb_ids, page, page_size, similarity_threshold,
+                                        vector_similarity_weight, top, doc_ids, aggs, rerank_mdl, highlight, rank_feature)
+        ranks, cache_key = RETRIEVAL_CACHE.lookup(kb_ids, params, index_names(tenant_ids))
+        if ranks is not None:
             return ranks
+        ranks = self._retrieval(question, embd_mdl, tenant_ids, kb_ids, page, page_size, similarity_threshold,
+                                vector_similarity_weight, top, doc_ids, aggs, rerank_mdl, highlight, rank_feature)
+        RETRIEVAL_CACHE.store(cache_key, ranks)
+        return ranks
+
+    def retrieval_batch(self, questions: list[str], embd_mdl, tenant_ids, kb_ids, page, page_size, similarity_threshold=0.2,
+                        vector_similarity_weight=0.3, top=1024, doc_ids=None, aggs=True,
+                        rerank_mdl=None, highlight=False,
+                        rank_feature: dict | list[dict | None] | None = {PAGERANK_FLD: 10}):
+        """
+        retrieval() of each question, returned in order. The questions missing from the retrieval
+        cache are embedded in one batch, then searched and reranked in parallel. `rank_feature` is
+        either shared or given per question.
+        """
+        if isinstance(rank_feature, list):
+            assert len(rank_feature) == len(questions), "One rank_feature per question is expected."
+            rank_features = rank_feature
+        else:
+            rank_features = [rank_feature] * len(questions)
+
+        results, todo = [None] * len(questions), []
+        for i, (question, rfea) in enumerate(zip(questions, rank_features)):
+            if not question:
+                results[i] = {"total": 0, "chunks": [], "doc_aggs": {}}
+                continue
+            params = RETRIEVAL_CACHE.params(question, embd_mdl, tenant_ids, kb_ids, page, page_size, similarity_threshold,
+                                            vector_similarity_weight, top, doc_ids, aggs, rerank_mdl, highlight, rfea)
+            results[i], cache_key = RETRIEVAL_CACHE.lookup(kb_ids, params, index_names(tenant_ids))
+            if results[i] is None:
+                todo.append((i, cache_key))
+        if not todo:
+            return results
+
+        query_vectors = [None] * len(todo)
+        if embd_mdl:
+            with stage("embedding"):
+                query_vectors, _ = embd_mdl.encode_queries_batch([questions[i] for i, _ in todo])
+
+        def retrieve(i, cache_key, query_vector):
+            ranks = self._retrieval(questions[i], embd_mdl, tenant_ids, kb_ids, page, page_size, similarity_threshold,
+                                    vector_similarity_weight, top, doc_ids, aggs, rerank_mdl, highlight, rank_features[i],
+                                    query_vector=query_vector)
+            RETRIEVAL_CACHE.store(cache_key, ranks)
+            return ranks
+
+        futures = [(i, batch_executor.submit(contextvars.copy_context().run, retrieve, i, cache_key, query_vector))
+                   for (i, cache_key), query_vector in zip(todo, query_vectors)]
+        for i, future in futures:
+            results[i] = future.result()
+        return results
+
+    def _retrieval(self, question, embd_mdl, tenant_ids, kb_ids, page, page_size, similarity_threshold,
+                   vector_similarity_weight, top, doc_ids, aggs, rerank_mdl, highlight, rank_feature, query_vector=None):
+        ranks = {"total": 0, "chunks": [], "doc_aggs": {}}
 
         # Ensure RERANK_LIMIT is multiple of page_size
         RERANK_LIMIT = math.ceil(64/page_size) * page_size if page_size>1 else 1
@@ -375,20 +435,22 @@ class Dealer:
             tenant_ids = tenant_ids.split(",")
 
         sres = self.search(req, [index_name(tid) for tid in tenant_ids],
-                           kb_ids, embd_mdl, highlight, rank_feature=rank_feature)
+                           kb_ids, embd_mdl, highlight, rank_feature=rank_feature, query_vector=query_vector)
 
         if rerank_mdl and sres.total > 0:
-            sim, tsim, vsim = self.rerank_by_model(rerank_mdl,
-                                                   sres, question, 1 - vector_similarity_weight,
-                                                   vector_similarity_weight,
-                                                   rank_feature=rank_feature)
+            with stage("rerank"):
+                sim, tsim, vsim = self.rerank_by_model(rerank_mdl,
+                                                       sres, question, 1 - vector_similarity_weight,
+                                                       vector_similarity_weight,
+                                                       rank_feature=rank_feature)
         else:
             lower_case_doc_engine = os.getenv('DOC_ENGINE', 'elasticsearch')
             if lower_case_doc_engine in ["elasticsearch","opensearch"]:
                 # ElasticSearch doesn't normalize each way score before fusion.
-                sim, tsim, vsim = self.rerank(
-                    sres, question, 1 - vector_similarity_weight, vector_similarity_weight,
-                    rank_feature=rank_feature)
+                with stage("rerank"):
+                    sim, tsim, vsim = self.rerank(
+                        sres, question, 1 - vector_similarity_weight, vector_similarity_weight,
+                        rank_feature=rank_feature)
             else:
                 # Don't need rerank here since Infinity normalizes each way score before fusion.
                 sim = [sres.field[id].get("_score", 0.0) for id in sres.ids]
@@ -463,13 +525,12 @@ class Dealer:
         tbl = self.dataStore.sql(sql, fetch_size, format)
         return tbl
 
-    def chunk_list(self, doc_id: str, tenant_id: str,
-                   kb_ids: list[str], max_count=1024,
-                   offset=0,
-                   fields=["docnm_kwd", "content_with_weight", "img_id"],
-                   sort_by_position: bool = False):
-        condition = {"doc_id": doc_id}
-
+    def iter_chunks(self, doc_id: str, tenant_id: str,
+                    kb_ids: list[str],
+                    fields=["docnm_kwd", "content_with_weight", "img_id"],
+                    sort_by_position: bool = False,
+                    page_size: int = CHUNK_LIST_PAGE_SIZE):
+        """Stream all the chunks of a document, fetched `page_size` at a time through a doc store cursor."""
         fields_set = set(fields or [])
         if sort_by_position:
             for need in ("page_num_int", "position_int", "top_int"):
@@ -483,20 +544,43 @@ class Dealer:
             orderBy.asc("position_int")
             orderBy.asc("top_int")
 
+        # closed as soon as the caller stops, which releases the doc store cursor
+        with closing(self.dataStore.iter_chunks(fields, {"doc_id": doc_id}, orderBy, index_name(tenant_id), kb_ids, page_size)) as pages:
+            for page in pages:
+                for id, doc in page.items():
+                    doc["id"] = id
+                    yield doc
+
+    def chunk_list(self, doc_id: str, tenant_id: str,
+                   kb_ids: list[str], max_count=1024,
+                   offset=0,
+                   fields=["docnm_kwd", "content_with_weight", "img_id"],
+                   sort_by_position: bool = False):
+        """Chunks `offset` to `max_count` of a document, up to the last one if `max_count` is None."""
+        page_size = CHUNK_LIST_PAGE_SIZE if max_count is None else max(1, min(CHUNK_LIST_PAGE_SIZE, max_count))
         res = []
-        bs = 128
-        for p in range(offset, max_count, bs):
-            es_res = self.dataStore.search(fields, [], condition, [], orderBy, p, bs, index_name(tenant_id),
-                                           kb_ids)
-            dict_chunks = self.dataStore.get_fields(es_res, fields)
-            for id, doc in dict_chunks.items():
-                doc["id"] = id
-            if dict_chunks:
-                res.extend(dict_chunks.values())
-            if len(dict_chunks.values()) < bs:
-                break
+        with closing(self.iter_chunks(doc_id, tenant_id, kb_ids, fields, sort_by_position, page_size)) as docs:
+            for i, doc in enumerate(docs):
+                if max_count is not None and i >= max_count:
+                    break
+                if i >= offset:
+                    res.append(doc)
         return res
 
+    def chunk_lists(self, doc_ids: list[str], tenant_id: str,
+                    kb_ids: list[str],
+                    fields=["docnm_kwd", "content_with_weight", "img_id"],
+                    sort_by_position: bool = False,
+                    max_workers: int = CHUNK_LIST_WORKERS) -> dict[str, list[dict]]:
+        """All the chunks of several documents fetched in parallel, by document id in the order of `doc_ids`."""
+        if len(doc_ids) <= 1 or max_workers <= 1:
+            return {doc_id: self.chunk_list(doc_id, tenant_id, kb_ids, max_count=None, fields=fields, sort_by_position=sort_by_position)
+                    for doc_id in doc_ids}
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(doc_ids)), thread_name_prefix="chunk_list") as pool:
+            futures = {doc_id: pool.submit(self.chunk_list, doc_id, tenant_id, kb_ids, max_count=None, fields=fields, sort_by_position=sort_by_position)
+                       for doc_id in doc_ids}
+            return {doc_id: future.result() for doc_id, future in futures.items()}
+
     def all_tags(self, tenant_id: str, kb_ids: list[str], S=1000):
         if not self.dataStore.indexExist(index_name(tenant_id), kb_ids[0]):
             return []
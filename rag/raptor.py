@@ -13,18 +13,24 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import json
 import logging
+import os
 import re
 
 import numpy as np
 import trio
 import umap
+import xxhash
 from sklearn.mixture import GaussianMixture
 
 from api.db.services.task_service import has_canceled
+from common import settings
 from common.connection_utils import timeout
 from common.exceptions import TaskCanceledException
 from common.token_utils import truncate
+from rag.utils.cluster_count import optimal_clusters as optimal_clusters_by_bic
+from rag.utils.embedding_cache import cache_model_of
 from graphrag.utils import (
     chat_limiter,
     get_embed_cache,
@@ -33,6 +39,13 @@ from graphrag.utils import (
     set_llm_cache,
 )
 
+# Incremental RAPTOR: a new chunk joins an existing cluster when the cosine similarity
+# to its centroid reaches RAPTOR_ASSIGN_THRESHOLD.
+RAPTOR_INCREMENTAL = int(os.environ.get("RAPTOR_INCREMENTAL", "0"))
+RAPTOR_ASSIGN_THRESHOLD = float(os.environ.get("RAPTOR_ASSIGN_THRESHOLD", "0.8"))
+# Bump when the persisted tree layout changes.
+RAPTOR_TREE_VERSION = 1
+
 
 class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
     def __init__(
@@ -79,32 +92,100 @@ class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
 
     @timeout(20)
     async def _embedding_encode(self, txt):
-        response = await trio.to_thread.run_sync(lambda: get_embed_cache(self._embd_model.llm_name, txt))
+        response = await trio.to_thread.run_sync(lambda: get_embed_cache(cache_model_of(self._embd_model), txt))
         if response is not None:
             return response
         embds, _ = await trio.to_thread.run_sync(lambda: self._embd_model.encode([txt]))
         if len(embds) < 1 or len(embds[0]) < 1:
             raise Exception("Embedding error: ")
         embds = embds[0]
-        await trio.to_thread.run_sync(lambda: set_embed_cache(self._embd_model.llm_name, txt, embds))
+        await trio.to_thread.run_sync(lambda: set_embed_cache(cache_model_of(self._embd_model), txt, embds))
         return embds
 
     def _get_optimal_clusters(self, embeddings: np.ndarray, random_state: int, task_id: str = ""):
-        max_clusters = min(self._max_cluster, len(embeddings))
-        n_clusters = np.arange(1, max_clusters)
-        bics = []
-        for n in n_clusters:
+        def check_canceled():
             if task_id:
                 if has_canceled(task_id):
                     logging.info(f"Task {task_id} cancelled during get optimal clusters.")
                     raise TaskCanceledException(f"Task {task_id} was cancelled")
 
-            gm = GaussianMixture(n_components=n, random_state=random_state)
-            gm.fit(embeddings)
-            bics.append(gm.bic(embeddings))
-        optimal_clusters = n_clusters[np.argmin(bics)]
+        max_clusters = min(self._max_cluster, len(embeddings))
+        optimal_clusters, _ = optimal_clusters_by_bic(embeddings, max_clusters, random_state, check_canceled=check_canceled)
         return optimal_clusters
 
+    def _cluster(self, embeddings, random_state: int, task_id: str = "") -> tuple[int, list[int]]:
+        """Number of clusters and the cluster of every embedding."""
+        if len(embeddings) == 2:
+            return 1, [0, 0]
+
+        n_neighbors = int((len(embeddings) - 1) ** 0.8)
+        reduced_embeddings = umap.UMAP(
+            n_neighbors=max(2, n_neighbors),
+            n_components=min(12, len(embeddings) - 2),
+            metric="cosine",
+        ).fit_transform(embeddings)
+        n_clusters = self._get_optimal_clusters(reduced_embeddings, random_state, task_id=task_id)
+        if n_clusters == 1:
+            lbls = [0 for _ in range(len(reduced_embeddings))]
+        else:
+            gm = GaussianMixture(n_components=n_clusters, random_state=random_state)
+            gm.fit(reduced_embeddings)
+            probs = gm.predict_proba(reduced_embeddings)
+            lbls = [np.where(prob > self._threshold)[0] for prob in probs]
+            lbls = [lbl[0] if isinstance(lbl, np.ndarray) else lbl for lbl in lbls]
+        return n_clusters, lbls
+
+    @timeout(60 * 20)
+    async def _summarize(self, texts: list[str], callback=None, task_id: str = ""):
+        """Summary of the texts and its embedding, or None if the cluster is skipped on error."""
+        if task_id:
+            if has_canceled(task_id):
+                logging.info(f"Task {task_id} cancelled during RAPTOR summarization.")
+                raise TaskCanceledException(f"Task {task_id} was cancelled")
+
+        len_per_chunk = int((self._llm_model.max_length - self._max_token) / len(texts))
+        cluster_content = "\n".join([truncate(t, max(1, len_per_chunk)) for t in texts])
+        try:
+            async with chat_limiter:
+                if task_id and has_canceled(task_id):
+                    logging.info(f"Task {task_id} cancelled before RAPTOR LLM call.")
+                    raise TaskCanceledException(f"Task {task_id} was cancelled")
+
+                cnt = await self._chat(
+                    "You're a helpful assistant.",
+                    [
+                        {
+                            "role": "user",
+                            "content": self._prompt.format(cluster_content=cluster_content),
+                        }
+                    ],
+                    {"max_tokens": max(self._max_token, 512)},  # fix issue:  #10235
+                )
+                cnt = re.sub(
+                    "(······\n由于长度的原因，回答被截断了，要继续吗？|For the content length reason, it stopped, continue?)",
+                    "",
+                    cnt,
+                )
+                logging.debug(f"SUM: {cnt}")
+
+                if task_id and has_canceled(task_id):
+                    logging.info(f"Task {task_id} cancelled before RAPTOR embedding.")
+                    raise TaskCanceledException(f"Task {task_id} was cancelled")
+
+                embds = await self._embedding_encode(cnt)
+                return cnt, embds
+        except TaskCanceledException:
+            raise
+        except Exception as exc:
+            self._error_count += 1
+            warn_msg = f"[RAPTOR] Skip cluster ({len(texts)} chunks) due to error: {exc}"
+            logging.warning(warn_msg)
+            if callback:
+                callback(msg=warn_msg)
+            if self._error_count >= self._max_errors:
+                raise RuntimeError(f"RAPTOR aborted after {self._error_count} errors. Last error: {exc}") from exc
+        return None
+
     async def __call__(self, chunks, random_state, callback=None, task_id: str = ""):
         if len(chunks) <= 1:
             return []
@@ -112,57 +193,10 @@ class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
         layers = [(0, len(chunks))]
         start, end = 0, len(chunks)
 
-        @timeout(60 * 20)
         async def summarize(ck_idx: list[int]):
-            nonlocal chunks
-
-            if task_id:
-                if has_canceled(task_id):
-                    logging.info(f"Task {task_id} cancelled during RAPTOR summarization.")
-                    raise TaskCanceledException(f"Task {task_id} was cancelled")
-
-            texts = [chunks[i][0] for i in ck_idx]
-            len_per_chunk = int((self._llm_model.max_length - self._max_token) / len(texts))
-            cluster_content = "\n".join([truncate(t, max(1, len_per_chunk)) for t in texts])
-            try:
-                async with chat_limiter:
-                    if task_id and has_canceled(task_id):
-                        logging.info(f"Task {task_id} cancelled before RAPTOR LLM call.")
-                        raise TaskCanceledException(f"Task {task_id} was cancelled")
-
-                    cnt = await self._chat(
-                        "You're a helpful assistant.",
-                        [
-                            {
-                                "role": "user",
-                                "content": self._prompt.format(cluster_content=cluster_content),
-                            }
-                        ],
-                        {"max_tokens": max(self._max_token, 512)},  # fix issue:  #10235
-                    )
-                    cnt = re.sub(
-                        "(······\n由于长度的原因，回答被截断了，要继续吗？|For the content length reason, it stopped, continue?)",
-                        "",
-                        cnt,
-                    )
-                    logging.debug(f"SUM: {cnt}")
-
-                    if task_id and has_canceled(task_id):
-                        logging.info(f"Task {task_id} cancelled before RAPTOR embedding.")
-                        raise TaskCanceledException(f"Task {task_id} was cancelled")
-
-                    embds = await self._embedding_encode(cnt)
-                    chunks.append((cnt, embds))
-            except TaskCanceledException:
-                raise
-            except Exception as exc:
-                self._error_count += 1
-                warn_msg = f"[RAPTOR] Skip cluster ({len(ck_idx)} chunks) due to error: {exc}"
-                logging.warning(warn_msg)
-                if callback:
-                    callback(msg=warn_msg)
-                if self._error_count >= self._max_errors:
-                    raise RuntimeError(f"RAPTOR aborted after {self._error_count} errors. Last error: {exc}") from exc
+            res = await self._summarize([chunks[i][0] for i in ck_idx], callback, task_id)
+            if res:
+                chunks.append(res)
 
         labels = []
         while end - start > 1:
@@ -172,31 +206,7 @@ class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
                     raise TaskCanceledException(f"Task {task_id} was cancelled")
 
             embeddings = [embd for _, embd in chunks[start:end]]
-            if len(embeddings) == 2:
-                await summarize([start, start + 1])
-                if callback:
-                    callback(msg="Cluster one layer: {} -> {}".format(end - start, len(chunks) - end))
-                labels.extend([0, 0])
-                layers.append((end, len(chunks)))
-                start = end
-                end = len(chunks)
-                continue
-
-            n_neighbors = int((len(embeddings) - 1) ** 0.8)
-            reduced_embeddings = umap.UMAP(
-                n_neighbors=max(2, n_neighbors),
-                n_components=min(12, len(embeddings) - 2),
-                metric="cosine",
-            ).fit_transform(embeddings)
-            n_clusters = self._get_optimal_clusters(reduced_embeddings, random_state, task_id=task_id)
-            if n_clusters == 1:
-                lbls = [0 for _ in range(len(reduced_embeddings))]
-            else:
-                gm = GaussianMixture(n_components=n_clusters, random_state=random_state)
-                gm.fit(reduced_embeddings)
-                probs = gm.predict_proba(reduced_embeddings)
-                lbls = [np.where(prob > self._threshold)[0] for prob in probs]
-                lbls = [lbl[0] if isinstance(lbl, np.ndarray) else lbl for lbl in lbls]
+            n_clusters, lbls = await trio.to_thread.run_sync(lambda: self._cluster(embeddings, random_state, task_id))
 
             async with trio.open_nursery() as nursery:
                 for c in range(n_clusters):
@@ -209,7 +219,8 @@ class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
 
                     nursery.start_soon(summarize, ck_idx)
 
-            assert len(chunks) - end == n_clusters, "{} vs. {}".format(len(chunks) - end, n_clusters)
+            if len(embeddings) > 2:
+                assert len(chunks) - end == n_clusters, "{} vs. {}".format(len(chunks) - end, n_clusters)
             labels.extend(lbls)
             layers.append((end, len(chunks)))
             if callback:
@@ -218,3 +229,158 @@ class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
             end = len(chunks)
 
         return chunks
+
+    def tree_config(self, random_state) -> str:
+        """Fingerprint of everything a persisted tree depends on besides the chunks."""
+        return xxhash.xxh64(json.dumps([
+            RAPTOR_TREE_VERSION,
+            getattr(self._llm_model, "llm_name", ""),
+            getattr(self._embd_model, "llm_name", ""),
+            self._prompt,
+            self._max_token,
+            self._threshold,
+            self._max_cluster,
+            random_state,
+        ]).encode("utf-8")).hexdigest()
+
+    def _regroup(self, nodes: dict, prev_clusters: list[dict], random_state: int, task_id: str = "") -> list[list[str]]:
+        """
+        Groups the nodes of one layer, keyed by their text hash, starting from the clusters of the
+        previous tree. Nodes stay in their cluster, new nodes join the cluster with the nearest
+        centroid if close enough, and the rest are clustered among themselves.
+        """
+        groups, placed = [], set()
+        for c in prev_clusters:
+            members = [k for k in c["members"] if k in nodes and k not in placed]
+            if members:
+                groups.append(members)
+                placed.update(members)
+        fresh = [k for k in nodes if k not in placed]
+
+        if fresh and groups:
+            centroids = np.array([np.mean([nodes[k][1] for k in g], axis=0) for g in groups])
+            centroids /= np.linalg.norm(centroids, axis=1, keepdims=True) + 1e-12
+            vecs = np.array([nodes[k][1] for k in fresh])
+            vecs /= np.linalg.norm(vecs, axis=1, keepdims=True) + 1e-12
+            sims = vecs @ centroids.T
+            nearest = sims.argmax(axis=1)
+            if len(fresh) == 1:
+                groups[nearest[0]].append(fresh[0])
+                fresh = []
+            else:
+                left = []
+                for i, k in enumerate(fresh):
+                    if sims[i, nearest[i]] >= RAPTOR_ASSIGN_THRESHOLD:
+                        groups[nearest[i]].append(k)
+                    else:
+                        left.append(k)
+                if len(left) == 1:
+                    groups[nearest[fresh.index(left[0])]].append(left[0])
+                    left = []
+                fresh = left
+
+        if len(fresh) > 1:
+            n_clusters, lbls = self._cluster([nodes[k][1] for k in fresh], random_state, task_id)
+            groups.extend([k for k, lbl in zip(fresh, lbls) if lbl == c] for c in range(n_clusters))
+        elif fresh:
+            groups.append(fresh)
+        groups = [g for g in groups if g]
+
+        # The layer must shrink, recluster it from scratch otherwise.
+        if len(groups) >= len(nodes):
+            keys = list(nodes)
+            n_clusters, lbls = self._cluster([nodes[k][1] for k in keys], random_state, task_id)
+            groups = [[k for k, lbl in zip(keys, lbls) if lbl == c] for c in range(n_clusters)]
+            groups = [g for g in groups if g]
+        return groups
+
+    async def incremental(self, chunks, tree: dict | None, random_state, callback=None, task_id: str = ""):
+        """
+        Same as __call__, but starts from the tree a previous run left over an earlier version of
+        the chunks. Only the clusters whose members changed are summarized again, so the number
+        of LLM calls follows the size of the change. Returns the summaries of all layers, reused
+        or not, and the new tree to persist.
+        """
+        config = self.tree_config(random_state)
+        prev_layers = tree["layers"] if tree and tree.get("config") == config else []
+        if tree and not prev_layers:
+            logging.info("RAPTOR settings changed since the tree was built, rebuilding it.")
+
+        nodes = {}
+        for s, a in chunks:
+            if s and a is not None and len(a) > 0:
+                nodes.setdefault(_node_key(s), (s, np.asarray(a)))
+
+        layers, summaries = [], []
+        while len(nodes) > 1:
+            if task_id and has_canceled(task_id):
+                logging.info(f"Task {task_id} cancelled during RAPTOR layer processing.")
+                raise TaskCanceledException(f"Task {task_id} was cancelled")
+
+            prev_clusters = prev_layers[len(layers)] if len(layers) < len(prev_layers) else []
+            reusable = {frozenset(c["members"]): c for c in prev_clusters}
+            groups = await trio.to_thread.run_sync(lambda: self._regroup(nodes, prev_clusters, random_state, task_id))
+            clusters = [None] * len(groups)
+
+            async def summarize(i, members):
+                res = await self._summarize([nodes[k][0] for k in members], callback, task_id)
+                if res:
+                    clusters[i] = {"members": members, "summary": res[0], "embd": np.asarray(res[1])}
+
+            dirty = 0
+            async with trio.open_nursery() as nursery:
+                for i, members in enumerate(groups):
+                    c = reusable.get(frozenset(members))
+                    if c:
+                        clusters[i] = {"members": members, "summary": c["summary"], "embd": np.asarray(c["embd"])}
+                        continue
+                    if task_id and has_canceled(task_id):
+                        logging.info(f"Task {task_id} cancelled before RAPTOR cluster processing.")
+                        raise TaskCanceledException(f"Task {task_id} was cancelled")
+                    dirty += 1
+                    nursery.start_soon(summarize, i, members)
+
+            clusters = [c for c in clusters if c]
+            if callback:
+                callback(msg="Cluster one layer: {} -> {}, {} summarized".format(len(nodes), len(clusters), dirty))
+            layers.append(clusters)
+            summaries.extend((c["summary"], c["embd"]) for c in clusters)
+            nodes = {}
+            for c in clusters:
+                nodes.setdefault(_node_key(c["summary"]), (c["summary"], c["embd"]))
+
+        tree = {
+            "config": config,
+            "layers": [[{"members": c["members"], "summary": c["summary"], "embd": c["embd"].tolist()} for c in clusters] for clusters in layers],
+        }
+        return summaries, tree
+
+
+def _node_key(text: str) -> str:
+    return xxhash.xxh64(text.encode("utf-8")).hexdigest()
+
+
+def _tree_name(doc_id: str) -> str:
+    return f"raptor_tree_{doc_id}.json"
+
+
+def load_raptor_tree(kb_id: str, doc_id: str) -> dict | None:
+    """The RAPTOR tree last built over the chunks of the document, or of the KB for the KB scope."""
+    try:
+        if not settings.STORAGE_IMPL.obj_exist(kb_id, _tree_name(doc_id)):
+            return None
+        binary = settings.STORAGE_IMPL.get(kb_id, _tree_name(doc_id))
+        return json.loads(binary) if binary else None
+    except Exception:
+        logging.exception(f"Fail to load RAPTOR tree of {kb_id}/{doc_id}")
+        return None
+
+
+def save_raptor_tree(kb_id: str, doc_id: str, tree: dict):
+    settings.STORAGE_IMPL.put(kb_id, _tree_name(doc_id), json.dumps(tree, ensure_ascii=False).encode("utf-8"))
+
+
+def raptor_tree_summaries(tree: dict | None) -> set[str]:
+    if not tree:
+        return set()
+    return {c["summary"] for clusters in tree.get("layers", []) for c in clusters}
@@ -14,6 +14,8 @@
 #  limitations under the License.
 import socket
 import concurrent
+import concurrent.futures
+import multiprocessing
 # from beartype import BeartypeConf
 # from beartype.claw import beartype_all  # <-- you didn't sign up for this
 # beartype_all(conf=BeartypeConf(violation_type=UserWarning))    # <-- emit warnings from all code
@@ -32,7 +34,7 @@ from rag.utils.base64_image import image2id
 from common.log_utils import init_root_logger
 from common.config_utils import show_configs
 from graphrag.general.index import run_graphrag_for_kb
-from graphrag.utils import get_llm_cache, set_llm_cache, get_tags_from_cache, set_tags_to_cache
+from graphrag.utils import get_llm_cache_batch, set_llm_cache_batch, get_tags_from_cache, set_tags_to_cache
 from rag.prompts.generator import keyword_extraction, question_proposal, content_tagging, run_toc_from_text
 import logging
 import os
@@ -61,8 +63,11 @@ from rag.app import laws, paper, presentation, manual, qa, table, book, resume,
     email, tag
 from rag.nlp import search, rag_tokenizer, add_positions
 from rag.raptor import RecursiveAbstractiveProcessing4TreeOrganizedRetrieval as Raptor
+from rag.raptor import RAPTOR_INCREMENTAL, load_raptor_tree, save_raptor_tree, raptor_tree_summaries
 from common.token_utils import num_tokens_from_string, truncate
 from rag.utils.redis_conn import REDIS_CONN, RedisDistributedLock
+from rag.utils.embedding_buffer import EmbeddingBuffer
+from rag.utils.embedding_scheduler import EmbeddingScheduler
 from graphrag.utils import chat_limiter
 from common.signal_utils import start_tracemalloc_and_snapshot, stop_tracemalloc
 from common.exceptions import TaskCanceledException
@@ -108,15 +113,23 @@ DONE_TASKS = 0
 FAILED_TASKS = 0
 
 CURRENT_TASKS = {}
+TASK_PROGRESS = {}
 
 MAX_CONCURRENT_TASKS = int(os.environ.get('MAX_CONCURRENT_TASKS', "5"))
 MAX_CONCURRENT_CHUNK_BUILDERS = int(os.environ.get('MAX_CONCURRENT_CHUNK_BUILDERS', "1"))
+# Chunkers run in this many warm worker processes instead of threads when greater than 0.
+CHUNK_PROCESS_POOL_SIZE = int(os.environ.get('CHUNK_PROCESS_POOL_SIZE', "0"))
+CHUNK_PROCESS_POOL = None
 MAX_CONCURRENT_MINIO = int(os.environ.get('MAX_CONCURRENT_MINIO', '10'))
+MAX_CONCURRENT_DOC_BULK = int(os.environ.get('MAX_CONCURRENT_DOC_BULK', '4'))
+STREAMING_INDEX = int(os.environ.get('STREAMING_INDEX', "0"))
+STREAMING_INDEX_BUFFER = int(os.environ.get('STREAMING_INDEX_BUFFER', "2"))
 task_limiter = trio.Semaphore(MAX_CONCURRENT_TASKS)
-chunk_limiter = trio.CapacityLimiter(MAX_CONCURRENT_CHUNK_BUILDERS)
+chunk_limiter = trio.CapacityLimiter(CHUNK_PROCESS_POOL_SIZE or MAX_CONCURRENT_CHUNK_BUILDERS)
 embed_limiter = trio.CapacityLimiter(MAX_CONCURRENT_CHUNK_BUILDERS)
 minio_limiter = trio.CapacityLimiter(MAX_CONCURRENT_MINIO)
 kg_limiter = trio.CapacityLimiter(2)
+PROGRESS_FLUSH_INTERVAL = float(os.environ.get('PROGRESS_FLUSH_INTERVAL', "1"))
 WORKER_HEARTBEAT_TIMEOUT = int(os.environ.get('WORKER_HEARTBEAT_TIMEOUT', '120'))
 stop_event = threading.Event()
 
@@ -163,6 +176,85 @@ def set_progress(task_id, from_page=0, to_page=-1, prog=None, msg="Processing...
         logging.exception(f"set_progress({task_id}), progress: {prog}, progress_msg: {msg}, got exception")
 
 
+class ProgressAggregator:
+    """
+    Progress callback of one task which buffers messages and progress in memory and writes them to
+    the DB at most every PROGRESS_FLUSH_INTERVAL seconds, or right away on error, completion and
+    cancellation. Cancellation is looked up in Redis at most once per interval as well.
+    It may be called from worker threads.
+    """
+
+    def __init__(self, task_id, from_page=0, to_page=-1):
+        self.task_id = task_id
+        self.from_page = from_page
+        self.to_page = to_page
+        self.lock = threading.Lock()
+        self.msgs = []
+        self.prog = None
+        self.last_flush = 0
+        self.canceled = False
+        self.last_cancel_check = 0
+
+    def is_canceled(self):
+        now = timer()
+        if not self.canceled and now - self.last_cancel_check >= PROGRESS_FLUSH_INTERVAL:
+            self.last_cancel_check = now
+            self.canceled = has_canceled(self.task_id)
+        return self.canceled
+
+    def __call__(self, prog=None, msg="Processing..."):
+        if prog is not None and prog < 0:
+            msg = "[ERROR]" + msg
+        cancel = self.is_canceled()
+        if cancel:
+            msg += " [Canceled]"
+            prog = -1
+
+        if self.to_page > 0:
+            if msg:
+                if self.from_page < self.to_page:
+                    msg = f"Page({self.from_page + 1}~{self.to_page + 1}): " + msg
+        if msg:
+            msg = datetime.now().strftime("%H:%M:%S") + " " + msg
+
+        with self.lock:
+            if msg:
+                self.msgs.append(msg)
+            if prog is not None and self.prog != -1:
+                self.prog = prog if self.prog is None or prog < 0 else max(prog, self.prog)
+            urgent = cancel or (prog is not None and (prog < 0 or prog >= 1))
+            if not urgent and timer() - self.last_flush < PROGRESS_FLUSH_INTERVAL:
+                return
+            self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        self.last_flush = timer()
+        if not self.msgs and self.prog is None:
+            return
+        d = {"progress_msg": "\n".join(self.msgs)}
+        if self.prog is not None:
+            d["progress"] = self.prog
+        self.msgs = []
+        try:
+            TaskService.update_progress(self.task_id, d)
+            close_connection()
+            logging.info(f"set_progress({self.task_id}), progress: {d.get('progress')}, progress_msg: {d['progress_msg']}")
+        except DoesNotExist:
+            logging.warning(f"set_progress({self.task_id}) got exception DoesNotExist")
+        except Exception:
+            logging.exception(f"set_progress({self.task_id}), progress: {d.get('progress')}, progress_msg: {d['progress_msg']}, got exception")
+
+
+def flush_task_progress(task_id):
+    aggregator = TASK_PROGRESS.pop(task_id, None)
+    if aggregator:
+        aggregator.flush()
+
+
 async def collect():
     global CONSUMER_NAME, DONE_TASKS, FAILED_TASKS
     global UNACKED_ITERATOR
@@ -219,12 +311,76 @@ async def collect():
     return redis_msg, task
 
 
+def init_chunk_worker(consumer_name):
+    init_root_logger(f"{consumer_name}_chunker_{os.getpid()}")
+    settings.init_settings()
+    # Load the OCR/layout/TSR ONNX models once, every later parser in this process reuses them.
+    from deepdoc.parser import PdfParser
+    PdfParser()
+    logging.info(f"Chunk worker {os.getpid()} of {consumer_name} is ready")
+
+
+def chunk_in_worker(parser_id, task_id, from_page, to_page, name, binary, kwargs):
+    progress_callback = ProgressAggregator(task_id, from_page, to_page)
+    try:
+        return FACTORY[parser_id].chunk(name, binary=binary, from_page=from_page, to_page=to_page,
+                                        callback=progress_callback, **kwargs)
+    finally:
+        progress_callback.flush()
+
+
+def start_chunk_process_pool():
+    global CHUNK_PROCESS_POOL
+    if CHUNK_PROCESS_POOL_SIZE <= 0 or CHUNK_PROCESS_POOL:
+        return
+    # spawn rather than fork: the parent already runs trio and worker threads
+    CHUNK_PROCESS_POOL = concurrent.futures.ProcessPoolExecutor(max_workers=CHUNK_PROCESS_POOL_SIZE,
+                                                                mp_context=multiprocessing.get_context("spawn"),
+                                                                initializer=init_chunk_worker,
+                                                                initargs=(CONSUMER_NAME,))
+    # start the workers now so models are loaded before the first task arrives
+    for _ in range(CHUNK_PROCESS_POOL_SIZE):
+        CHUNK_PROCESS_POOL.submit(os.getpid)
+    logging.info(f"Started {CHUNK_PROCESS_POOL_SIZE} chunk worker processes")
+
+
 async def get_storage_binary(bucket, name):
     return await trio.to_thread.run_sync(lambda: settings.STORAGE_IMPL.get(bucket, name))
 
 
+async def run_llm_with_cache(llmnm, docs, history, genconf, generate):
+    """
+    Return the cached or generated LLM result of every doc's content. The cache is read with a
+    single MGET, only the misses go to `generate(doc)`, and new results are written back in one
+    pipeline, even if some of the generations failed.
+    """
+    txts = [d["content_with_weight"] for d in docs]
+    if not txts:
+        return []
+    results = await trio.to_thread.run_sync(lambda: get_llm_cache_batch(llmnm, txts, history, genconf))
+    generated = {}
+
+    async def gen(i):
+        async with chat_limiter:
+            res = await trio.to_thread.run_sync(lambda: generate(docs[i]))
+        if res:
+            results[i] = res
+            generated[txts[i]] = res
+
+    try:
+        async with trio.open_nursery() as nursery:
+            for i, res in enumerate(results):
+                if not res:
+                    nursery.start_soon(gen, i)
+    finally:
+        if generated:
+            await trio.to_thread.run_sync(lambda: set_llm_cache_batch(llmnm, generated, history, genconf))
+    return results
+
+
 @timeout(60*80, 1)
-async def build_chunks(task, progress_callback):
+async def chunk_document(task, progress_callback):
+    """Fetch the task's document and split it with its parser, without the per-chunk enrichment of `build_chunks`."""
     if task["size"] > settings.DOC_MAXIMUM_SIZE:
         set_progress(task["id"], prog=-1, msg="File size exceeds( <= %dMb )" %
                                               (int(settings.DOC_MAXIMUM_SIZE / 1024 / 1024)))
@@ -251,9 +407,15 @@ async def build_chunks(task, progress_callback):
 
     try:
         async with chunk_limiter:
-            cks = await trio.to_thread.run_sync(lambda: chunker.chunk(task["name"], binary=binary, from_page=task["from_page"],
-                                to_page=task["to_page"], lang=task["language"], callback=progress_callback,
-                                kb_id=task["kb_id"], parser_config=task["parser_config"], tenant_id=task["tenant_id"]))
+            if CHUNK_PROCESS_POOL:
+                kwargs = dict(lang=task["language"], kb_id=task["kb_id"], parser_config=task["parser_config"], tenant_id=task["tenant_id"])
+                future = CHUNK_PROCESS_POOL.submit(chunk_in_worker, task["parser_id"].lower(), task["id"], task["from_page"],
+                                                   task["to_page"], task["name"], binary, kwargs)
+                cks = await trio.to_thread.run_sync(future.result)
+            else:
+                cks = await trio.to_thread.run_sync(lambda: chunker.chunk(task["name"], binary=binary, from_page=task["from_page"],
+                                    to_page=task["to_page"], lang=task["language"], callback=progress_callback,
+                                    kb_id=task["kb_id"], parser_config=task["parser_config"], tenant_id=task["tenant_id"]))
         logging.info("Chunking({}) {}/{} done".format(timer() - st, task["location"], task["name"]))
     except TaskCanceledException:
         raise
@@ -261,7 +423,11 @@ async def build_chunks(task, progress_callback):
         progress_callback(-1, "Internal server error while chunking: %s" % str(e).replace("'", ""))
         logging.exception("Chunking {}/{} got exception".format(task["location"], task["name"]))
         raise
+    return cks
+
 
+async def enrich_chunks(task, cks, progress_callback):
+    """Turn chunker output into doc store documents: store images, then add keywords, questions and tags as configured."""
     docs = []
     doc = {
         "doc_id": task["doc_id"],
@@ -302,39 +468,26 @@ async def build_chunks(task, progress_callback):
         st = timer()
         progress_callback(msg="Start to generate keywords for every chunk ...")
         chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
-
-        async def doc_keyword_extraction(chat_mdl, d, topn):
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], "keywords", {"topn": topn})
-            if not cached:
-                async with chat_limiter:
-                    cached = await trio.to_thread.run_sync(lambda: keyword_extraction(chat_mdl, d["content_with_weight"], topn))
-                set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, "keywords", {"topn": topn})
+        topn = task["parser_config"]["auto_keywords"]
+        results = await run_llm_with_cache(chat_mdl.llm_name, docs, "keywords", {"topn": topn},
+                                           lambda d: keyword_extraction(chat_mdl, d["content_with_weight"], topn))
+        for d, cached in zip(docs, results):
             if cached:
                 d["important_kwd"] = cached.split(",")
                 d["important_tks"] = rag_tokenizer.tokenize(" ".join(d["important_kwd"]))
-            return
-        async with trio.open_nursery() as nursery:
-            for d in docs:
-                nursery.start_soon(doc_keyword_extraction, chat_mdl, d, task["parser_config"]["auto_keywords"])
         progress_callback(msg="Keywords generation {} chunks completed in {:.2f}s".format(len(docs), timer() - st))
 
     if task["parser_config"].get("auto_questions", 0):
         st = timer()
         progress_callback(msg="Start to generate questions for every chunk ...")
         chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
-
-        async def doc_question_proposal(chat_mdl, d, topn):
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], "question", {"topn": topn})
-            if not cached:
-                async with chat_limiter:
-                    cached = await trio.to_thread.run_sync(lambda: question_proposal(chat_mdl, d["content_with_weight"], topn))
-                set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, "question", {"topn": topn})
+        topn = task["parser_config"]["auto_questions"]
+        results = await run_llm_with_cache(chat_mdl.llm_name, docs, "question", {"topn": topn},
+                                           lambda d: question_proposal(chat_mdl, d["content_with_weight"], topn))
+        for d, cached in zip(docs, results):
             if cached:
                 d["question_kwd"] = cached.split("\n")
                 d["question_tks"] = rag_tokenizer.tokenize("\n".join(d["question_kwd"]))
-        async with trio.open_nursery() as nursery:
-            for d in docs:
-                nursery.start_soon(doc_question_proposal, chat_mdl, d, task["parser_config"]["auto_questions"])
         progress_callback(msg="Question generation {} chunks completed in {:.2f}s".format(len(docs), timer() - st))
 
     if task["kb_parser_config"].get("tag_kb_ids", []):
@@ -365,27 +518,29 @@ async def build_chunks(task, progress_callback):
             else:
                 docs_to_tag.append(d)
 
-        async def doc_content_tagging(chat_mdl, d, topn_tags):
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], all_tags, {"topn": topn_tags})
-            if not cached:
-                picked_examples = random.choices(examples, k=2) if len(examples)>2 else examples
-                if not picked_examples:
-                    picked_examples.append({"content": "This is an example", TAG_FLD: {'example': 1}})
-                async with chat_limiter:
-                    cached = await trio.to_thread.run_sync(lambda: content_tagging(chat_mdl, d["content_with_weight"], all_tags, picked_examples, topn=topn_tags))
-                if cached:
-                    cached = json.dumps(cached)
+        def doc_content_tagging(d):
+            picked_examples = random.choices(examples, k=2) if len(examples)>2 else examples
+            if not picked_examples:
+                picked_examples.append({"content": "This is an example", TAG_FLD: {'example': 1}})
+            cached = content_tagging(chat_mdl, d["content_with_weight"], all_tags, picked_examples, topn=topn_tags)
+            return json.dumps(cached) if cached else None
+
+        results = await run_llm_with_cache(chat_mdl.llm_name, docs_to_tag, all_tags, {"topn": topn_tags}, doc_content_tagging)
+        for d, cached in zip(docs_to_tag, results):
             if cached:
-                set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, all_tags, {"topn": topn_tags})
                 d[TAG_FLD] = json.loads(cached)
-        async with trio.open_nursery() as nursery:
-            for d in docs_to_tag:
-                nursery.start_soon(doc_content_tagging, chat_mdl, d, topn_tags)
         progress_callback(msg="Tagging {} chunks completed in {:.2f}s".format(len(docs), timer() - st))
 
     return docs
 
 
+async def build_chunks(task, progress_callback):
+    cks = await chunk_document(task, progress_callback)
+    if not cks:
+        return []
+    return await enrich_chunks(task, cks, progress_callback)
+
+
 def build_TOC(task, docs, progress_callback):
     progress_callback(msg="Start to generate table of content ...")
     chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
@@ -425,7 +580,7 @@ def init_kb(row, vector_size: int):
     return settings.docStoreConn.createIdx(idxnm, row.get("kb_id", ""), vector_size)
 
 
-async def embedding(docs, mdl, parser_config=None, callback=None):
+async def embedding(docs, mdl, parser_config=None, callback=None, title_vec=None):
     if parser_config is None:
         parser_config = {}
     tts, cnts = [], []
@@ -440,9 +595,9 @@ async def embedding(docs, mdl, parser_config=None, callback=None):
         cnts.append(c)
 
     tk_count = 0
-    if len(tts) == len(cnts):
+    if title_vec is None and len(tts) == len(cnts):
         vts, c = await trio.to_thread.run_sync(lambda: mdl.encode(tts[0: 1]))
-        tts = np.tile(vts[0], (len(cnts), 1))
+        title_vec = vts[0]
         tk_count += c
 
     @timeout(60)
@@ -450,32 +605,16 @@ async def embedding(docs, mdl, parser_config=None, callback=None):
         nonlocal mdl
         return mdl.encode([truncate(c, mdl.max_length-10) for c in txts])
 
-    cnts_ = np.array([])
-    for i in range(0, len(cnts), settings.EMBEDDING_BATCH_SIZE):
-        async with embed_limiter:
-            vts, c = await trio.to_thread.run_sync(lambda: batch_encode(cnts[i: i + settings.EMBEDDING_BATCH_SIZE]))
-        if len(cnts_) == 0:
-            cnts_ = vts
-        else:
-            cnts_ = np.concatenate((cnts_, vts), axis=0)
-        tk_count += c
-        callback(prog=0.7 + 0.2 * (i + 1) / len(cnts), msg="")
-    cnts = cnts_
+    vects, c = await EmbeddingScheduler.get(mdl).encode(cnts, batch_encode, callback)
+    tk_count += c
     filename_embd_weight = parser_config.get("filename_embd_weight", 0.1) # due to the db support none value
     if not filename_embd_weight:
         filename_embd_weight = 0.1
     title_w = float(filename_embd_weight)
-    if tts.ndim == 2 and cnts.ndim == 2 and tts.shape == cnts.shape:
-        vects = title_w * tts + (1 - title_w) * cnts
-    else:
-        vects = cnts
-
-    assert len(vects) == len(docs)
-    vector_size = 0
-    for i, d in enumerate(docs):
-        v = vects[i].tolist()
-        vector_size = len(v)
-        d["q_%d_vec" % len(v)] = v
+    if title_vec is not None and np.shape(title_vec) == (vects.dim,):
+        vects.blend(title_vec, title_w)
+
+    vector_size = vects.assign(docs)
     return tk_count, vector_size
 
 
@@ -530,26 +669,20 @@ async def run_dataflow(task: dict):
             def batch_encode(txts):
                 nonlocal embedding_model
                 return embedding_model.encode([truncate(c, embedding_model.max_length - 10) for c in txts])
-            vects = np.array([])
             texts = [o.get("questions", o.get("summary", o["text"])) for o in chunks]
+            vects = EmbeddingBuffer(len(texts))
             delta = 0.20/(len(texts)//settings.EMBEDDING_BATCH_SIZE+1)
             prog = 0.8
             for i in range(0, len(texts), settings.EMBEDDING_BATCH_SIZE):
                 async with embed_limiter:
                     vts, c = await trio.to_thread.run_sync(lambda: batch_encode(texts[i : i + settings.EMBEDDING_BATCH_SIZE]))
-                if len(vects) == 0:
-                    vects = vts
-                else:
-                    vects = np.concatenate((vects, vts), axis=0)
+                vects.put(i, vts)
                 embedding_token_consumption += c
                 prog += delta
                 if i % (len(texts)//settings.EMBEDDING_BATCH_SIZE/100+1) == 1:
                     set_progress(task_id, prog=prog, msg=f"{i+1} / {len(texts)//settings.EMBEDDING_BATCH_SIZE}")
 
-            assert len(vects) == len(chunks)
-            for i, ck in enumerate(chunks):
-                v = vects[i].tolist()
-                ck["q_%d_vec" % len(v)] = v
+            vects.assign(chunks)
         except Exception as e:
             set_progress(task_id, prog=-1, msg=f"[ERROR]: {e}")
             PipelineOperationLogService.create(document_id=doc_id, pipeline_id=dataflow_id, task_type=PipelineTaskType.PARSE, dsl=str(pipeline))
@@ -650,8 +783,11 @@ async def run_raptor_for_kb(row, kb_parser_config, chat_mdl, embd_mdl, vector_si
     vctr_nm = "q_%d_vec"%vector_size
 
     res = []
+    trees = []
     tk_count = 0
     max_errors = int(os.environ.get("RAPTOR_MAX_ERRORS", 3))
+    # Rebuild only the parts of the previous tree touched by changed chunks.
+    incremental = raptor_config.get("incremental", RAPTOR_INCREMENTAL)
 
     async def generate(chunks, did):
         nonlocal tk_count, res
@@ -664,8 +800,18 @@ async def run_raptor_for_kb(row, kb_parser_config, chat_mdl, embd_mdl, vector_si
             raptor_config["threshold"],
             max_errors=max_errors,
         )
-        original_length = len(chunks)
-        chunks = await raptor(chunks, kb_parser_config["raptor"]["random_seed"], callback, row["id"])
+        random_seed = kb_parser_config["raptor"]["random_seed"]
+        if incremental:
+            tree = await trio.to_thread.run_sync(load_raptor_tree, row["kb_id"], did)
+            summaries, new_tree = await raptor.incremental(chunks, tree, random_seed, callback, row["id"])
+            stale = raptor_tree_summaries(tree) - {content for content, _ in summaries}
+            # kept until the new summaries are indexed, see save_raptor_trees
+            trees.append((did, new_tree, stale))
+            callback(msg=f"RAPTOR tree of {did}: {len(summaries)} summaries, {len(stale)} outdated.")
+        else:
+            original_length = len(chunks)
+            chunks = await raptor(chunks, random_seed, callback, row["id"])
+            summaries = chunks[original_length:]
         doc = {
             "doc_id": did,
             "kb_id": [str(row["kb_id"])],
@@ -676,7 +822,7 @@ async def run_raptor_for_kb(row, kb_parser_config, chat_mdl, embd_mdl, vector_si
         if row["pagerank"]:
             doc[PAGERANK_FLD] = int(row["pagerank"])
 
-        for content, vctr in chunks[original_length:]:
+        for content, vctr in summaries:
             d = copy.deepcopy(doc)
             d["id"] = xxhash.xxh64((content + str(fake_doc_id)).encode("utf-8")).hexdigest()
             d["create_time"] = str(datetime.now()).replace("T", " ")[:19]
@@ -688,26 +834,38 @@ async def run_raptor_for_kb(row, kb_parser_config, chat_mdl, embd_mdl, vector_si
             res.append(d)
             tk_count += num_tokens_from_string(content)
 
+    def load_chunks(ids):
+        doc_chunks = settings.retriever.chunk_lists(ids, row["tenant_id"], [str(row["kb_id"])],
+                                                    fields=["content_with_weight", vctr_nm, "raptor_kwd"],
+                                                    sort_by_position=True)
+        # In the file scope the summaries of an earlier run belong to the document too.
+        return {doc_id: [d for d in chunks if not d.get("raptor_kwd")] for doc_id, chunks in doc_chunks.items()}
+
+    # Documents are read in parallel, a few at a time in the file scope.
     if raptor_config.get("scope", "file") == "file":
-        for x, doc_id in enumerate(doc_ids):
-            chunks = []
-            for d in settings.retriever.chunk_list(doc_id, row["tenant_id"], [str(row["kb_id"])],
-                                                 fields=["content_with_weight", vctr_nm],
-                                                 sort_by_position=True):
-                chunks.append((d["content_with_weight"], np.array(d[vctr_nm])))
-            await generate(chunks, doc_id)
-            callback(prog=(x+1.)/len(doc_ids))
+        for st in range(0, len(doc_ids), search.CHUNK_LIST_WORKERS):
+            batch = doc_ids[st:st + search.CHUNK_LIST_WORKERS]
+            doc_chunks = await trio.to_thread.run_sync(load_chunks, batch)
+            for x, doc_id in enumerate(batch, start=st):
+                chunks = [(d["content_with_weight"], np.array(d[vctr_nm])) for d in doc_chunks[doc_id]]
+                await generate(chunks, doc_id)
+                callback(prog=(x+1.)/len(doc_ids))
     else:
-        chunks = []
-        for doc_id in doc_ids:
-            for d in settings.retriever.chunk_list(doc_id, row["tenant_id"], [str(row["kb_id"])],
-                                                 fields=["content_with_weight", vctr_nm],
-                                                 sort_by_position=True):
-                chunks.append((d["content_with_weight"], np.array(d[vctr_nm])))
+        doc_chunks = await trio.to_thread.run_sync(load_chunks, doc_ids)
+        chunks = [(d["content_with_weight"], np.array(d[vctr_nm])) for doc_id in doc_ids for d in doc_chunks[doc_id]]
 
         await generate(chunks, fake_doc_id)
 
-    return res, tk_count
+    return res, tk_count, trees
+
+
+async def save_raptor_trees(row, trees):
+    """Once the summaries of an incremental RAPTOR run are indexed, drop the outdated ones and persist the new trees."""
+    for did, tree, stale in trees:
+        if stale:
+            stale_ids = [xxhash.xxh64((content + str(GRAPH_RAPTOR_FAKE_DOC_ID)).encode("utf-8")).hexdigest() for content in stale]
+            await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({"id": stale_ids}, search.index_name(row["tenant_id"]), row["kb_id"]))
+        await trio.to_thread.run_sync(save_raptor_tree, row["kb_id"], did, tree)
 
 
 async def delete_image(kb_id, chunk_id):
@@ -719,32 +877,174 @@ async def delete_image(kb_id, chunk_id):
         raise
 
 
-async def insert_es(task_id, task_tenant_id, task_dataset_id, chunks, progress_callback):
-    for b in range(0, len(chunks), settings.DOC_BULK_SIZE):
-        doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(chunks[b:b + settings.DOC_BULK_SIZE], search.index_name(task_tenant_id), task_dataset_id))
-        task_canceled = has_canceled(task_id)
-        if task_canceled:
-            progress_callback(-1, msg="Task has been canceled.")
-            return False
-        if b % 128 == 0:
-            progress_callback(prog=0.8 + 0.1 * (b + 1) / len(chunks), msg="")
+async def rollback_chunks(task_tenant_id, task_dataset_id, chunk_ids):
+    await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({"id": chunk_ids}, search.index_name(task_tenant_id), task_dataset_id))
+    async with trio.open_nursery() as nursery:
+        for chunk_id in chunk_ids:
+            nursery.start_soon(delete_image, task_dataset_id, chunk_id)
+
+
+async def save_chunk_ids(task_id, task_tenant_id, task_dataset_id, chunk_ids, progress_callback):
+    """Append `chunk_ids` to the task's chunk_ids. On failure they are rolled back and False is returned."""
+    try:
+        await trio.to_thread.run_sync(lambda: TaskService.append_chunk_ids(task_id, " ".join(chunk_ids)))
+    except DoesNotExist:
+        logging.warning(f"do_handle_task update_chunk_ids failed since task {task_id} is unknown.")
+        await rollback_chunks(task_tenant_id, task_dataset_id, chunk_ids)
+        progress_callback(-1, msg=f"Chunk updates failed since task {task_id} is unknown.")
+        return False
+    return True
+
+
+async def insert_es(task_id, task_tenant_id, task_dataset_id, chunks, progress_callback, indexed_ids=None):
+    """
+    Index chunks with up to MAX_CONCURRENT_DOC_BULK bulk requests in flight.
+
+    `indexed_ids` holds the ids this task has already indexed. Each bulk's ids are appended to it
+    and to the task's chunk_ids before the bulk is sent, so whatever reached the doc store is
+    removed when the document is parsed again. A failed bulk is rolled back right away, and the
+    task's chunk_ids are rewritten once without it.
+    """
+    if indexed_ids is None:
+        indexed_ids = []
+    bulk_limiter = trio.CapacityLimiter(MAX_CONCURRENT_DOC_BULK)
+    index_name = search.index_name(task_tenant_id)
+    error_message = None
+    canceled = False
+    done = 0
+
+    async def insert_bulk(b):
+        nonlocal error_message, canceled, done
+        bulk = chunks[b:b + settings.DOC_BULK_SIZE]
+        bulk_ids = [chunk["id"] for chunk in bulk]
+        async with bulk_limiter:
+            if error_message or canceled:
+                return
+            if not await save_chunk_ids(task_id, task_tenant_id, task_dataset_id, bulk_ids, progress_callback):
+                canceled = True
+                return
+            indexed_ids.extend(bulk_ids)
+            doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(bulk, index_name, task_dataset_id))
         if doc_store_result:
-            error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
-            progress_callback(-1, msg=error_message)
-            raise Exception(error_message)
-        chunk_ids = [chunk["id"] for chunk in chunks[:b + settings.DOC_BULK_SIZE]]
-        chunk_ids_str = " ".join(chunk_ids)
+            error_message = error_message or f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
+            for chunk_id in bulk_ids:
+                indexed_ids.remove(chunk_id)
+            await rollback_chunks(task_tenant_id, task_dataset_id, bulk_ids)
+            return
+        if has_canceled(task_id):
+            if not canceled:
+                progress_callback(-1, msg="Task has been canceled.")
+            canceled = True
+            return
+        prev_done = done
+        done += len(bulk)
+        if prev_done // 128 != done // 128:
+            progress_callback(prog=0.8 + 0.1 * done / len(chunks), msg="")
+
+    async with trio.open_nursery() as nursery:
+        for b in range(0, len(chunks), settings.DOC_BULK_SIZE):
+            nursery.start_soon(insert_bulk, b)
+
+    if error_message:
+        # chunk_ids must not list the rolled back bulks
         try:
-            TaskService.update_chunk_ids(task_id, chunk_ids_str)
+            await trio.to_thread.run_sync(lambda: TaskService.update_chunk_ids(task_id, " ".join(indexed_ids)))
         except DoesNotExist:
             logging.warning(f"do_handle_task update_chunk_ids failed since task {task_id} is unknown.")
-            doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({"id": chunk_ids}, search.index_name(task_tenant_id), task_dataset_id))
-            async with trio.open_nursery() as nursery:
-                for chunk_id in chunk_ids:
-                    nursery.start_soon(delete_image, task_dataset_id, chunk_id)
-            progress_callback(-1, msg=f"Chunk updates failed since task {task_id} is unknown.")
-            return False
-    return True
+        progress_callback(-1, msg=error_message)
+        raise Exception(error_message)
+    return not canceled
+
+
+def drain_batches(items, batch_size):
+    """Yield `items` in batches of `batch_size`, removing each batch from the list so it can be freed once processed."""
+    items.reverse()
+    while items:
+        yield [items.pop() for _ in range(min(batch_size, len(items)))]
+
+
+async def stream_embedding_and_insert(task, cks, mdl, progress_callback, keep_chunks=False, indexed_ids=None):
+    """
+    Pipe the chunker output through enrichment, embedding and into the doc store batch by batch,
+    so indexing starts as soon as the first batch is ready and at most STREAMING_INDEX_BUFFER
+    batches are alive between two stages. `cks` is emptied on the way.
+
+    Returns the token count, the vector size, whether it succeeded, and the indexed chunks with
+    their vectors if `keep_chunks` is on, for the TOC which is built from all of them.
+    """
+    if indexed_ids is None:
+        indexed_ids = []
+    task_id, task_tenant_id, task_dataset_id = task["id"], task["tenant_id"], task["kb_id"]
+    parser_config = task["parser_config"]
+    total = len(cks)
+    batch_size = max(settings.EMBEDDING_BATCH_SIZE, settings.DOC_BULK_SIZE)
+    tk_count, vector_size = 0, 0
+    embedded = inserted = embedding_size = 0
+    succeeded = True
+    chunks = []
+
+    def stage_callback(prog=None, msg=""):
+        # per-batch progress is meaningless here, only propagate failures
+        if prog is not None and prog < 0:
+            progress_callback(prog, msg=msg)
+
+    def report(embedding_done=0):
+        progress_callback(prog=0.7 + 0.1 * (embedded + embedding_done + inserted) / total, msg="")
+
+    def embedding_callback(prog=None, msg=""):
+        # the scheduler reports 0.7 + 0.2 * done / len(batch), see EmbeddingScheduler.encode
+        if prog is not None:
+            report(round((prog - 0.7) / 0.2 * embedding_size))
+
+    async def produce(send_channel, cancel_scope):
+        nonlocal succeeded
+        async with send_channel:
+            for raw in drain_batches(cks, batch_size):
+                batch = await enrich_chunks(task, raw, stage_callback)
+                if batch is None:
+                    succeeded = False
+                    cancel_scope.cancel()
+                    return
+                if batch:
+                    await send_channel.send(batch)
+
+    async def embed(receive_channel, send_channel):
+        nonlocal tk_count, vector_size, embedded, embedding_size
+        title_vec = None
+        async with receive_channel, send_channel:
+            async for batch in receive_channel:
+                embedding_size = len(batch)
+                if title_vec is None:
+                    vts, c = await trio.to_thread.run_sync(lambda: mdl.encode([batch[0].get("docnm_kwd", "Title")]))
+                    title_vec = vts[0]
+                    tk_count += c
+                c, vector_size = await embedding(batch, mdl, parser_config, embedding_callback, title_vec=title_vec)
+                tk_count += c
+                embedded += len(batch)
+                report()
+                await send_channel.send(batch)
+
+    async def insert(receive_channel, cancel_scope):
+        nonlocal succeeded, inserted
+        async with receive_channel:
+            async for batch in receive_channel:
+                if not await insert_es(task_id, task_tenant_id, task_dataset_id, batch, stage_callback, indexed_ids):
+                    succeeded = False
+                    cancel_scope.cancel()
+                    return
+                if keep_chunks:
+                    chunks.extend(batch)
+                inserted += len(batch)
+                report()
+
+    async with trio.open_nursery() as nursery:
+        send_embed, receive_embed = trio.open_memory_channel(STREAMING_INDEX_BUFFER)
+        send_insert, receive_insert = trio.open_memory_channel(STREAMING_INDEX_BUFFER)
+        nursery.start_soon(produce, send_embed, nursery.cancel_scope)
+        nursery.start_soon(embed, receive_embed, send_insert)
+        nursery.start_soon(insert, receive_insert, nursery.cancel_scope)
+
+    return tk_count, vector_size, succeeded, chunks
 
 
 @timeout(60*60*3, 1)
@@ -768,10 +1068,13 @@ async def do_handle_task(task):
     task_parser_config = task["parser_config"]
     task_start_ts = timer()
     toc_thread = None
+    raptor_trees = []
+    indexed = False
+    indexed_ids = []
     executor = concurrent.futures.ThreadPoolExecutor()
 
     # prepare the progress callback function
-    progress_callback = partial(set_progress, task_id, task_from_page, task_to_page)
+    progress_callback = TASK_PROGRESS[task_id] = ProgressAggregator(task_id, task_from_page, task_to_page)
 
     # FIXME: workaround, Infinity doesn't support table parsing method, this check is to notify user
     lower_case_doc_engine = settings.DOC_ENGINE.lower()
@@ -831,7 +1134,7 @@ async def do_handle_task(task):
         chat_model = LLMBundle(task_tenant_id, LLMType.CHAT, llm_name=task_llm_id, lang=task_language)
         # run RAPTOR
         async with kg_limiter:
-            chunks, token_count = await run_raptor_for_kb(
+            chunks, token_count, raptor_trees = await run_raptor_for_kb(
                 row=task,
                 kb_parser_config=kb_parser_config,
                 chat_mdl=chat_model,
@@ -899,35 +1202,60 @@ async def do_handle_task(task):
     else:
         # Standard chunking methods
         start_ts = timer()
-        chunks = await build_chunks(task, progress_callback)
+        if STREAMING_INDEX:
+            # enrichment runs batch by batch in stream_embedding_and_insert
+            chunks = await chunk_document(task, progress_callback)
+        else:
+            chunks = await build_chunks(task, progress_callback)
         logging.info("Build document {}: {:.2f}s".format(task_document_name, timer() - start_ts))
         if not chunks:
             progress_callback(1., msg=f"No chunk built from {task_document_name}")
             return
         progress_callback(msg="Generate {} chunks".format(len(chunks)))
+        with_toc = task["parser_id"].lower() == "naive" and task["parser_config"].get("toc_extraction", False)
         start_ts = timer()
-        try:
-            token_count, vector_size = await embedding(chunks, embedding_model, task_parser_config, progress_callback)
-        except Exception as e:
-            error_message = "Generate embedding error:{}".format(str(e))
-            progress_callback(-1, error_message)
-            logging.exception(error_message)
-            token_count = 0
-            raise
-        progress_message = "Embedding chunks ({:.2f}s)".format(timer() - start_ts)
-        logging.info(progress_message)
-        progress_callback(msg=progress_message)
-        if task["parser_id"].lower() == "naive" and task["parser_config"].get("toc_extraction", False):
+        if STREAMING_INDEX:
+            try:
+                # TOC chunk is derived from the embedded chunks, so keep them in that case.
+                token_count, vector_size, e, chunks = await stream_embedding_and_insert(task, chunks, embedding_model, progress_callback,
+                                                                                        keep_chunks=with_toc, indexed_ids=indexed_ids)
+            except Exception as e:
+                error_message = "Embedding and indexing error:{}".format(str(e))
+                progress_callback(-1, error_message)
+                logging.exception(error_message)
+                raise
+            if not e:
+                return
+            progress_message = "Embedding and indexing chunks ({:.2f}s)".format(timer() - start_ts)
+            logging.info(progress_message)
+            progress_callback(msg=progress_message)
+            indexed = True
+        else:
+            try:
+                token_count, vector_size = await embedding(chunks, embedding_model, task_parser_config, progress_callback)
+            except Exception as e:
+                error_message = "Generate embedding error:{}".format(str(e))
+                progress_callback(-1, error_message)
+                logging.exception(error_message)
+                token_count = 0
+                raise
+            progress_message = "Embedding chunks ({:.2f}s)".format(timer() - start_ts)
+            logging.info(progress_message)
+            progress_callback(msg=progress_message)
+        if with_toc:
             toc_thread = executor.submit(build_TOC,task, chunks, progress_callback)
 
-    chunk_count = len(set([chunk["id"] for chunk in chunks]))
-    start_ts = timer()
-    e = await insert_es(task_id, task_tenant_id, task_dataset_id, chunks, progress_callback)
-    if not e:
-        return
+    if not indexed:
+        start_ts = timer()
+        e = await insert_es(task_id, task_tenant_id, task_dataset_id, chunks, progress_callback, indexed_ids)
+        if not e:
+            return
+    chunk_count = len(set(indexed_ids))
+    if raptor_trees:
+        await save_raptor_trees(task, raptor_trees)
 
     logging.info("Indexing doc({}), page({}-{}), chunks({}), elapsed: {:.2f}".format(task_document_name, task_from_page,
-                                                                                     task_to_page, len(chunks),
+                                                                                     task_to_page, chunk_count,
                                                                                      timer() - start_ts))
 
     DocumentService.increment_chunk_num(task_doc_id, task_dataset_id, token_count, chunk_count, 0)
@@ -937,7 +1265,7 @@ async def do_handle_task(task):
     if toc_thread:
         d = toc_thread.result()
         if d:
-            e = await insert_es(task_id, task_tenant_id, task_dataset_id, [d], progress_callback)
+            e = await insert_es(task_id, task_tenant_id, task_dataset_id, [d], progress_callback, indexed_ids)
             if not e:
                 return
             DocumentService.increment_chunk_num(task_doc_id, task_dataset_id, 0, 1, 0)
@@ -946,7 +1274,7 @@ async def do_handle_task(task):
     progress_callback(prog=1.0, msg="Task done ({:.2f}s)".format(task_time_cost))
     logging.info(
         "Chunk doc({}), page({}-{}), chunks({}), token({}), elapsed:{:.2f}".format(task_document_name, task_from_page,
-                                                                                   task_to_page, len(chunks),
+                                                                                   task_to_page, chunk_count,
                                                                                    token_count, task_time_cost))
 
 
@@ -965,12 +1293,14 @@ async def handle_task():
         logging.info(f"handle_task begin for task {json.dumps(task)}")
         CURRENT_TASKS[task["id"]] = copy.deepcopy(task)
         await do_handle_task(task)
+        flush_task_progress(task["id"])
         DONE_TASKS += 1
         CURRENT_TASKS.pop(task["id"], None)
         logging.info(f"handle_task done for task {json.dumps(task)}")
     except Exception as e:
         FAILED_TASKS += 1
         CURRENT_TASKS.pop(task["id"], None)
+        flush_task_progress(task["id"])
         try:
             err_msg = str(e)
             while isinstance(e, exceptiongroup.ExceptionGroup):
@@ -1086,6 +1416,7 @@ async def main():
 
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
+    start_chunk_process_pool()
 
     async with trio.open_nursery() as nursery:
         nursery.start_soon(report_status)
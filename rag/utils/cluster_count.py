@@ -0,0 +1,93 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Picks the number of GaussianMixture components that minimizes the BIC, as RAPTOR does for
+every layer.
+
+The exhaustive sweep fits every n in [1, max_clusters), and a fit costs about n times a
+single component one. The coarse-to-fine search fits a grid spread over the range, then a
+finer grid between the neighbours of the best n so far, until every n next to the best one
+has been fitted. BIC over n is close to unimodal on reduced embeddings, so both mostly agree,
+see cluster_count_benchmark.py. Fits of a round run in parallel threads, most of their time
+is spent in numpy.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from sklearn.mixture import GaussianMixture
+
+# "coarse" for the coarse-to-fine search, "sweep" to fit every n.
+RAPTOR_CLUSTER_SEARCH = os.environ.get("RAPTOR_CLUSTER_SEARCH", "coarse")
+RAPTOR_CLUSTER_GRID = int(os.environ.get("RAPTOR_CLUSTER_GRID", "8"))
+RAPTOR_CLUSTER_WORKERS = int(os.environ.get("RAPTOR_CLUSTER_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+
+def bic(embeddings: np.ndarray, n: int, random_state: int) -> float:
+    gm = GaussianMixture(n_components=n, random_state=random_state)
+    gm.fit(embeddings)
+    return gm.bic(embeddings)
+
+
+def _grid(lo: int, hi: int, size: int) -> list[int]:
+    """At most `size` integers spread evenly over [lo, hi]."""
+    return sorted({int(round(v)) for v in np.linspace(lo, hi, max(2, size))})
+
+
+def optimal_clusters(embeddings: np.ndarray, max_clusters: int, random_state: int, search: str = None,
+                     grid: int = None, workers: int = None, check_canceled=None) -> tuple[int, dict]:
+    """
+    The n in [1, max_clusters) with the lowest BIC, and the BIC of every n fitted.
+    `check_canceled` is called before every round of fits and may raise to stop.
+    """
+    search = search or RAPTOR_CLUSTER_SEARCH
+    grid = grid or RAPTOR_CLUSTER_GRID
+    workers = workers or RAPTOR_CLUSTER_WORKERS
+    if max_clusters <= 2:
+        return 1, {}
+
+    bics = {}
+
+    def fit(candidates):
+        candidates = [n for n in candidates if n not in bics]
+        if not candidates:
+            return
+        if check_canceled:
+            check_canceled()
+        if workers > 1 and len(candidates) > 1:
+            with ThreadPoolExecutor(max_workers=min(workers, len(candidates))) as pool:
+                scores = list(pool.map(lambda n: bic(embeddings, n, random_state), candidates))
+        else:
+            scores = [bic(embeddings, n, random_state) for n in candidates]
+        bics.update(zip(candidates, scores))
+
+    def best():
+        return min(bics, key=lambda n: (bics[n], n))
+
+    if search == "sweep" or max_clusters - 1 <= grid:
+        for st in range(1, max_clusters, workers):
+            fit(range(st, min(st + workers, max_clusters)))
+        return best(), bics
+
+    fit(_grid(1, max_clusters - 1, grid))
+    while True:
+        n = best()
+        lower = max([m for m in bics if m < n], default=n)
+        upper = min([m for m in bics if m > n], default=n)
+        todo = [m for m in _grid(lower, upper, grid) if m not in bics]
+        if not todo:
+            return n, bics
+        fit(todo)
@@ -0,0 +1,82 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Compares the coarse-to-fine cluster count search of cluster_count with the exhaustive BIC sweep.
+
+    python rag/utils/cluster_count_benchmark.py [--chunks 500 2000] [--max-cluster 64]
+
+The corpus is fixed: Gaussian blobs of uneven sizes and spreads in 12 dimensions, the shape of
+the UMAP output RAPTOR clusters. Besides time, it reports the n picked by both, how much higher
+the BIC of the coarse pick is, and the adjusted Rand index between the resulting labelings,
+which is what decides which chunks get summarized together.
+"""
+import argparse
+import time
+
+import numpy as np
+from sklearn.metrics import adjusted_rand_score
+from sklearn.mixture import GaussianMixture
+
+from rag.utils.cluster_count import optimal_clusters
+
+
+def build_corpus(n_chunks, n_topics, dim=12, seed=0):
+    rng = np.random.default_rng(seed)
+    sizes = rng.dirichlet(np.ones(n_topics)) * n_chunks
+    sizes = np.maximum(1, sizes.round().astype(int))
+    centers = rng.normal(scale=4.0, size=(n_topics, dim))
+    points = [c + rng.normal(scale=rng.uniform(0.5, 1.5), size=(s, dim)) for c, s in zip(centers, sizes)]
+    return np.vstack(points)[:n_chunks]
+
+
+def labels(embeddings, n, random_state):
+    if n == 1:
+        return np.zeros(len(embeddings), dtype=int)
+    gm = GaussianMixture(n_components=n, random_state=random_state)
+    return gm.fit(embeddings).predict(embeddings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RAPTOR cluster count search benchmark")
+    parser.add_argument("--chunks", type=int, nargs="+", default=[500, 2000])
+    parser.add_argument("--topics", type=int, nargs="+", default=[5, 20, 40])
+    parser.add_argument("--max-cluster", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"{'chunks':>6} {'topics':>6} {'sweep s':>8} {'coarse s':>9} {'speedup':>8} {'fits':>9} "
+          f"{'n sweep':>7} {'n coarse':>8} {'BIC gap':>8} {'ARI':>5}")
+    for n_chunks in args.chunks:
+        for n_topics in args.topics:
+            emb = build_corpus(n_chunks, n_topics)
+            max_clusters = min(args.max_cluster, len(emb))
+
+            st = time.perf_counter()
+            n_sweep, bics_sweep = optimal_clusters(emb, max_clusters, 0, search="sweep", workers=1)
+            sweep_t = time.perf_counter() - st
+
+            st = time.perf_counter()
+            n_coarse, bics_coarse = optimal_clusters(emb, max_clusters, 0, search="coarse", workers=args.workers)
+            coarse_t = time.perf_counter() - st
+
+            gap = (bics_sweep[n_coarse] - bics_sweep[n_sweep]) / abs(bics_sweep[n_sweep])
+            ari = adjusted_rand_score(labels(emb, n_sweep, 0), labels(emb, n_coarse, 0))
+            print(f"{n_chunks:>6} {n_topics:>6} {sweep_t:>8.2f} {coarse_t:>9.2f} {sweep_t / coarse_t:>7.1f}x "
+                  f"{len(bics_coarse):>4}/{len(bics_sweep):<4} {n_sweep:>7} {n_coarse:>8} {gap:>8.2%} {ari:>5.2f}")
+
+
+if __name__ == "__main__":
+    main()
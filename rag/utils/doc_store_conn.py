@@ -16,6 +16,7 @@
 
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
+from typing import Iterator
 import numpy as np
 
 DEFAULT_MATCH_VECTOR_TOPN = 10
@@ -208,6 +209,28 @@ class DocStoreConnection(ABC):
         """
         raise NotImplementedError("Not implemented")
 
+    def iter_chunks(
+            self, selectFields: list[str],
+            condition: dict,
+            orderBy: OrderByExpr,
+            indexNames: str | list[str],
+            knowledgebaseIds: list[str],
+            pageSize: int = 1024
+    ) -> Iterator[dict[str, dict]]:
+        """
+        Iterate over all the chunks matching the filtering condition, one page of `get_fields()`
+        at a time. This pages with offset and limit; connections with a cursor override it.
+        """
+        offset = 0
+        while True:
+            res = self.search(selectFields, [], dict(condition), [], orderBy, offset, pageSize, indexNames, knowledgebaseIds)
+            page = self.get_fields(res, selectFields)
+            if page:
+                yield page
+            if len(self.get_chunk_ids(res)) < pageSize:
+                return
+            offset += pageSize
+
     @abstractmethod
     def get(self, chunkId: str, indexName: str, knowledgebaseIds: list[str]) -> dict | None:
         """
@@ -0,0 +1,79 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import numpy as np
+
+
+class EmbeddingBuffer:
+    """
+    Accumulates embedding batches into a single (n, dim) matrix allocated once.
+
+    The dimension is taken from the first batch written, so callers don't need to
+    know the model's vector size in advance. Batches may be written out of order
+    by giving their start offset.
+    """
+
+    def __init__(self, n: int, dtype=np.float32):
+        self.n = n
+        self.dtype = dtype
+        self._data = None
+        self._filled = 0
+
+    @property
+    def dim(self) -> int:
+        return 0 if self._data is None else self._data.shape[1]
+
+    @property
+    def filled(self) -> int:
+        return self._filled
+
+    def put(self, start: int, vects):
+        vects = np.asarray(vects, dtype=self.dtype)
+        if vects.ndim == 1:
+            vects = vects.reshape(1, -1)
+        if self._data is None:
+            self._data = np.empty((self.n, vects.shape[1]), dtype=self.dtype)
+        end = start + len(vects)
+        assert end <= self.n, f"Embedding buffer overflow: {end} > {self.n}"
+        self._data[start:end] = vects
+        self._filled += len(vects)
+
+    def append(self, vects):
+        self.put(self._filled, vects)
+
+    def blend(self, vect, weight: float):
+        """In place: rows = weight * vect + (1 - weight) * rows."""
+        vect = np.asarray(vect, dtype=self.dtype)
+        self._data *= (1 - weight)
+        self._data += weight * vect
+
+    def matrix(self) -> np.ndarray:
+        assert self._filled == self.n, f"Embedding buffer incomplete: {self._filled}/{self.n}"
+        if self._data is None:
+            return np.empty((0, 0), dtype=self.dtype)
+        return self._data
+
+    def assign(self, docs: list[dict]) -> int:
+        """
+        Set `q_<dim>_vec` of each doc to its row of the matrix. Rows are views,
+        so no per-vector copy or Python list is made.
+        """
+        mat = self.matrix()
+        assert len(mat) == len(docs)
+        vctr_nm = "q_%d_vec" % self.dim
+        for i, d in enumerate(docs):
+            d[vctr_nm] = mat[i]
+        return self.dim
@@ -0,0 +1,174 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import logging
+import os
+import threading
+
+import numpy as np
+import xxhash
+from cachetools import LRUCache
+
+from common.decorator import singleton
+from rag.utils.redis_conn import REDIS_CONN
+
+EMBEDDING_CACHE_ENABLED = int(os.environ.get("EMBEDDING_CACHE_ENABLED", "1"))
+# Bytes of vectors kept in each process, 16 MB hold 4096 float32 vectors of 1024 dimensions.
+EMBEDDING_CACHE_MEMORY = int(os.environ.get("EMBEDDING_CACHE_MEMORY_MB", "16")) * 1024 * 1024
+EMBEDDING_CACHE_TTL = int(os.environ.get("EMBEDDING_CACHE_TTL", str(24 * 3600)))
+EMBEDDING_CACHE_DTYPE = os.environ.get("EMBEDDING_CACHE_DTYPE", "float32")
+
+
+def model_key(llm_factory, llm_name, base_url=None) -> str:
+    """Whose vectors are cached: the same model name may be served by other factories or endpoints."""
+    return f"{llm_factory or ''}/{llm_name or ''}@{base_url or ''}"
+
+
+def cache_model_of(mdl) -> str:
+    """model_key of an LLMBundle, the model name of anything else."""
+    return getattr(mdl, "cache_model", None) or getattr(mdl, "llm_name", None) or mdl.__class__.__name__
+
+
+@singleton
+class EmbeddingCache:
+    """
+    Two-tier cache of embedding vectors keyed by (model, kind, text):
+    a bounded in-process LRU in front of Redis, where vectors are kept as raw
+    float32/float16 bytes. `kind` separates document and query embeddings since
+    some models encode them differently. `model_name` should be a model_key.
+
+    The vectors returned by get and get_many are shared with the LRU and read-only.
+    """
+
+    def __init__(self):
+        self.dtype = np.dtype(EMBEDDING_CACHE_DTYPE)
+        self.lru = LRUCache(maxsize=EMBEDDING_CACHE_MEMORY, getsizeof=lambda v: v.nbytes)
+        self.lock = threading.Lock()
+
+    def _remember(self, k, v):
+        try:
+            self.lru[k] = v
+        except ValueError:
+            # larger than the whole cache
+            pass
+
+    def key(self, model_name, text, kind="doc"):
+        hasher = xxhash.xxh64()
+        hasher.update(f"{model_name}\x00{kind}\x00{self.dtype.name}\x00".encode("utf-8"))
+        hasher.update(str(text).encode("utf-8", "surrogatepass"))
+        return "embd:" + hasher.hexdigest()
+
+    def get_many(self, model_name, texts: list, kind="doc") -> list:
+        keys = [self.key(model_name, t, kind) for t in texts]
+        res = [None] * len(keys)
+        missed = []
+        with self.lock:
+            for i, k in enumerate(keys):
+                v = self.lru.get(k)
+                if v is None:
+                    missed.append(i)
+                else:
+                    res[i] = v
+        if not missed:
+            return res
+
+        bins = REDIS_CONN.mget([keys[i] for i in missed], binary=True)
+        with self.lock:
+            for i, b in zip(missed, bins):
+                if not b:
+                    continue
+                v = np.frombuffer(b, dtype=self.dtype)
+                v.flags.writeable = False
+                self._remember(keys[i], v)
+                res[i] = v
+        return res
+
+    def set_many(self, model_name, texts: list, vects, kind="doc"):
+        mapping = {}
+        with self.lock:
+            for t, v in zip(texts, vects):
+                k = self.key(model_name, t, kind)
+                v = np.array(v, dtype=self.dtype)
+                v.flags.writeable = False
+                self._remember(k, v)
+                mapping[k] = v.tobytes()
+        REDIS_CONN.mset(mapping, EMBEDDING_CACHE_TTL, binary=True)
+
+    def get(self, model_name, text, kind="doc"):
+        return self.get_many(model_name, [text], kind)[0]
+
+    def set(self, model_name, text, vect, kind="doc"):
+        self.set_many(model_name, [text], [vect], kind)
+
+
+EMBED_CACHE = EmbeddingCache()
+
+
+def encode_with_cache(model_name, texts: list, encode_fn, kind="doc"):
+    """
+    Embed `texts` with `encode_fn(texts) -> (vectors, token_count)`, sending only
+    cache misses to the model. Token count only covers the texts actually embedded.
+    The returned vectors are the caller's to modify.
+    """
+    if not EMBEDDING_CACHE_ENABLED or not texts:
+        return encode_fn(texts)
+
+    cached = EMBED_CACHE.get_many(model_name, texts, kind)
+    missed = [i for i, v in enumerate(cached) if v is None]
+    if not missed:
+        return np.vstack(cached).astype(np.float32), 0
+
+    vts, used_tokens = encode_fn([texts[i] for i in missed])
+    try:
+        vts = np.asarray(vts)
+        shape = vts.shape
+    except ValueError:
+        # ragged vectors
+        shape = (len(vts),)
+    if len(shape) != 2 or shape[0] != len(missed):
+        logging.warning(f"encode_with_cache: unexpected embedding shape {shape} from {model_name}, not cached")
+        if len(missed) == len(texts) or len(vts) != len(missed):
+            return vts, used_tokens
+        # one vector per text but not a matrix, merged as is
+        res = np.empty(len(texts), dtype=object)
+        for i, v in enumerate(cached):
+            res[i] = None if v is None else v.copy()
+        for i, v in zip(missed, vts):
+            res[i] = v
+        return res, used_tokens
+    EMBED_CACHE.set_many(model_name, [texts[i] for i in missed], vts, kind)
+    if len(missed) == len(texts):
+        return vts, used_tokens
+
+    res = np.empty((len(texts), vts.shape[1]), dtype=np.float32)
+    res[missed] = vts
+    for i, v in enumerate(cached):
+        if v is not None:
+            res[i] = v
+    return res, used_tokens
+
+
+def encode_query_with_cache(model_name, text, encode_fn):
+    """Same as encode_with_cache for a single query embedded with `encode_fn(text)`."""
+    if not EMBEDDING_CACHE_ENABLED:
+        return encode_fn(text)
+    v = EMBED_CACHE.get(model_name, text, kind="query")
+    if v is not None:
+        return v.astype(np.float32), 0
+    emd, used_tokens = encode_fn(text)
+    if np.ndim(emd) == 1:
+        EMBED_CACHE.set(model_name, text, emd, kind="query")
+    return emd, used_tokens
@@ -0,0 +1,175 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import logging
+import os
+import random
+import re
+import threading
+from timeit import default_timer as timer
+
+import trio
+
+from common import settings
+from common.token_utils import num_tokens_from_string
+from rag.utils.embedding_buffer import EmbeddingBuffer
+
+# One batch in flight and no growth past EMBEDDING_BATCH_SIZE by default, as local and self-hosted
+# models may run out of memory or throttle otherwise. Raise them for remote providers.
+EMBEDDING_MAX_INFLIGHT = int(os.environ.get("EMBEDDING_MAX_INFLIGHT", "1"))
+EMBEDDING_MAX_BATCH_SIZE = int(os.environ.get("EMBEDDING_MAX_BATCH_SIZE", "0"))
+EMBEDDING_MAX_BATCH_TOKENS = int(os.environ.get("EMBEDDING_MAX_BATCH_TOKENS", "0"))
+EMBEDDING_TARGET_LATENCY = float(os.environ.get("EMBEDDING_TARGET_LATENCY", "3"))
+EMBEDDING_MAX_RETRIES = int(os.environ.get("EMBEDDING_MAX_RETRIES", "5"))
+
+_RATE_LIMIT_PATT = re.compile(r"(rate limit|429|tpm limit|rpm limit|too many requests|requests per minute|throttl)")
+_TOO_LARGE_PATT = re.compile(r"(413|payload too large|too many (tokens|inputs)|maximum (context|input|batch)|(token|batch).{0,40}(limit|exceed)|exceed.{0,40}(token|batch))")
+
+
+def _status_code(e):
+    code = getattr(e, "status_code", None)
+    if code is None:
+        code = getattr(getattr(e, "response", None), "status_code", None)
+    return code
+
+
+def is_rate_limited(e) -> bool:
+    return _status_code(e) == 429 or bool(_RATE_LIMIT_PATT.search(str(e).lower()))
+
+
+def is_batch_too_large(e) -> bool:
+    return _status_code(e) == 413 or bool(_TOO_LARGE_PATT.search(str(e).lower()))
+
+
+class EmbeddingScheduler:
+    """
+    Keeps up to `max_inflight` embedding batches of one model in flight and adapts the batch size:
+    it grows up to EMBEDDING_MAX_BATCH_SIZE while batches come back faster than
+    EMBEDDING_TARGET_LATENCY and back to the configured size when they are slower, halves when the
+    provider answers 429, and splits batches the provider rejects as too large.
+    One scheduler is shared by all tasks using the same model in this process.
+    """
+
+    _schedulers = {}
+    _lock = threading.Lock()
+
+    def __init__(self, model_name: str, batch_size: int = 0, max_inflight: int = EMBEDDING_MAX_INFLIGHT):
+        self.model_name = model_name
+        self.base_batch_size = self.batch_size = max(1, batch_size or settings.EMBEDDING_BATCH_SIZE)
+        self.max_batch_size = max(EMBEDDING_MAX_BATCH_SIZE, self.batch_size)
+        self.max_batch_tokens = EMBEDDING_MAX_BATCH_TOKENS
+        self.limiter = trio.CapacityLimiter(max(1, max_inflight))
+        self.latency = None
+
+    @classmethod
+    def get(cls, mdl) -> "EmbeddingScheduler":
+        model_name = getattr(mdl, "llm_name", None) or mdl.__class__.__name__
+        with cls._lock:
+            if model_name not in cls._schedulers:
+                cls._schedulers[model_name] = cls(model_name)
+            return cls._schedulers[model_name]
+
+    def _batch_end(self, texts, start):
+        end = min(len(texts), start + self.batch_size)
+        if not self.max_batch_tokens:
+            return end
+        tokens = 0
+        for i in range(start, end):
+            tokens += num_tokens_from_string(texts[i])
+            if tokens > self.max_batch_tokens and i > start:
+                return i
+        return end
+
+    def _on_success(self, size, elapsed):
+        self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+        if size < self.batch_size:
+            # a short tail batch tells nothing about the current size
+            return
+        if self.latency > EMBEDDING_TARGET_LATENCY:
+            # being slow is no reason to go below the configured size, only 429s and 413s are
+            self.batch_size = max(min(self.batch_size, self.base_batch_size), self.batch_size // 2)
+        elif self.latency < EMBEDDING_TARGET_LATENCY / 2 or self.batch_size < self.base_batch_size:
+            self.batch_size = min(self.max_batch_size, self.batch_size + max(1, self.batch_size // 4))
+
+    def _on_rate_limited(self):
+        self.batch_size = max(1, self.batch_size // 2)
+
+    def _on_too_large(self, texts):
+        tokens = sum(num_tokens_from_string(t) for t in texts)
+        if not self.max_batch_tokens or tokens < self.max_batch_tokens:
+            self.max_batch_tokens = max(1, int(tokens * 0.8))
+        self.batch_size = max(1, min(self.batch_size, len(texts) // 2))
+
+    async def _encode_batch(self, encode_fn, texts, start, buffer, on_done):
+        attempt = 0
+        while True:
+            try:
+                async with self.limiter:
+                    st = timer()
+                    vts, c = await trio.to_thread.run_sync(lambda: encode_fn(texts))
+                self._on_success(len(texts), timer() - st)
+                buffer.put(start, vts)
+                on_done(len(texts), c)
+                return
+            except Exception as e:
+                if is_batch_too_large(e) and len(texts) > 1:
+                    self._on_too_large(texts)
+                    logging.warning(f"EmbeddingScheduler({self.model_name}) batch of {len(texts)} too large, splitting: {e}")
+                    half = len(texts) // 2
+                    await self._encode_batch(encode_fn, texts[:half], start, buffer, on_done)
+                    await self._encode_batch(encode_fn, texts[half:], start + half, buffer, on_done)
+                    return
+                if is_rate_limited(e) and attempt < EMBEDDING_MAX_RETRIES:
+                    self._on_rate_limited()
+                    attempt += 1
+                    delay = min(60, 2 ** attempt) * random.uniform(0.5, 1.5)
+                    logging.warning(f"EmbeddingScheduler({self.model_name}) rate limited, retry in {delay:.1f}s ({attempt}/{EMBEDDING_MAX_RETRIES})")
+                    await trio.sleep(delay)
+                    continue
+                raise
+
+    async def encode(self, texts: list, encode_fn, callback=None) -> tuple[EmbeddingBuffer, int]:
+        """
+        Embed `texts` with `encode_fn(batch) -> (vectors, token_count)`, which runs in a worker thread.
+        Returns the filled buffer, in the order of `texts`, and the consumed token count.
+        """
+        buffer = EmbeddingBuffer(len(texts))
+        tk_count = 0
+        done = 0
+        st = timer()
+
+        def on_done(n, c):
+            nonlocal tk_count, done
+            tk_count += c
+            done += n
+            if callback:
+                callback(prog=0.7 + 0.2 * done / len(texts), msg="")
+
+        async with trio.open_nursery() as nursery:
+            start = 0
+            while start < len(texts):
+                # wait for a free slot so the next batch is sized from the latest feedback
+                async with self.limiter:
+                    end = self._batch_end(texts, start)
+                nursery.start_soon(self._encode_batch, encode_fn, texts[start:end], start, buffer, on_done)
+                start = end
+                await trio.lowlevel.checkpoint()
+
+        elapsed = timer() - st
+        if callback and texts:
+            callback(msg="Embedded {} texts in {:.2f}s ({:.1f} texts/s, batch size {})".format(
+                len(texts), elapsed, len(texts) / max(elapsed, 1e-6), self.batch_size))
+        return buffer, tk_count
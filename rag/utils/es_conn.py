@@ -21,12 +21,14 @@ import time
 import os
 
 import copy
+import numpy as np
 from elasticsearch import Elasticsearch, NotFoundError
 from elasticsearch_dsl import UpdateByQuery, Q, Search, Index
 from elastic_transport import ConnectionTimeout
 from common.decorator import singleton
 from common.file_utils import get_project_base_directory
 from common.misc_utils import convert_bytes
+from rag.utils.retrieval_cache import invalidates_retrieval_cache
 from rag.utils.doc_store_conn import DocStoreConnection, MatchExpr, OrderByExpr, MatchTextExpr, MatchDenseExpr, \
     FusionExpr
 from rag.nlp import is_english, rag_tokenizer
@@ -35,6 +37,8 @@ from common import settings
 from common.constants import PAGERANK_FLD, TAG_FLD
 
 ATTEMPT_TIME = 2
+# How long a point in time stays open between two pages of iter_chunks().
+CURSOR_KEEP_ALIVE = "5m"
 
 logger = logging.getLogger('ragflow.es_conn')
 
@@ -109,6 +113,7 @@ class ESConnection(DocStoreConnection):
         except Exception:
             logger.exception("ESConnection.createIndex error %s" % (indexName))
 
+    @invalidates_retrieval_cache
     def deleteIdx(self, indexName: str, knowledgebaseId: str):
         if len(knowledgebaseId) > 0:
             # The index need to be alive after any kb deletion since all kb under this tenant are in one index.
@@ -139,6 +144,43 @@ class ESConnection(DocStoreConnection):
     CRUD operations
     """
 
+    @staticmethod
+    def _filter_query(condition: dict):
+        bqry = Q("bool", must=[])
+        for k, v in condition.items():
+            if k == "available_int":
+                if v == 0:
+                    bqry.filter.append(Q("range", available_int={"lt": 1}))
+                else:
+                    bqry.filter.append(
+                        Q("bool", must_not=Q("range", available_int={"lt": 1})))
+                continue
+            if not v:
+                continue
+            if isinstance(v, list):
+                bqry.filter.append(Q("terms", **{k: v}))
+            elif isinstance(v, str) or isinstance(v, int):
+                bqry.filter.append(Q("term", **{k: v}))
+            else:
+                raise Exception(
+                    f"Condition `{str(k)}={str(v)}` value type is {str(type(v))}, expected to be int, str or list.")
+        return bqry
+
+    @staticmethod
+    def _sort_orders(orderBy: OrderByExpr) -> list[dict]:
+        orders = list()
+        for field, order in orderBy.fields:
+            order = "asc" if order == 0 else "desc"
+            if field in ["page_num_int", "top_int"]:
+                order_info = {"order": order, "unmapped_type": "float",
+                              "mode": "avg", "numeric_type": "double"}
+            elif field.endswith("_int") or field.endswith("_flt"):
+                order_info = {"order": order, "unmapped_type": "float"}
+            else:
+                order_info = {"order": order, "unmapped_type": "text"}
+            orders.append({field: order_info})
+        return orders
+
     def search(
             self, selectFields: list[str],
             highlightFields: list[str],
@@ -160,25 +202,8 @@ class ESConnection(DocStoreConnection):
         assert isinstance(indexNames, list) and len(indexNames) > 0
         assert "_id" not in condition
 
-        bqry = Q("bool", must=[])
         condition["kb_id"] = knowledgebaseIds
-        for k, v in condition.items():
-            if k == "available_int":
-                if v == 0:
-                    bqry.filter.append(Q("range", available_int={"lt": 1}))
-                else:
-                    bqry.filter.append(
-                        Q("bool", must_not=Q("range", available_int={"lt": 1})))
-                continue
-            if not v:
-                continue
-            if isinstance(v, list):
-                bqry.filter.append(Q("terms", **{k: v}))
-            elif isinstance(v, str) or isinstance(v, int):
-                bqry.filter.append(Q("term", **{k: v}))
-            else:
-                raise Exception(
-                    f"Condition `{str(k)}={str(v)}` value type is {str(type(v))}, expected to be int, str or list.")
+        bqry = self._filter_query(condition)
 
         s = Search()
         vector_similarity_weight = 0.5
@@ -225,18 +250,7 @@ class ESConnection(DocStoreConnection):
             s = s.highlight(field)
 
         if orderBy:
-            orders = list()
-            for field, order in orderBy.fields:
-                order = "asc" if order == 0 else "desc"
-                if field in ["page_num_int", "top_int"]:
-                    order_info = {"order": order, "unmapped_type": "float",
-                                  "mode": "avg", "numeric_type": "double"}
-                elif field.endswith("_int") or field.endswith("_flt"):
-                    order_info = {"order": order, "unmapped_type": "float"}
-                else:
-                    order_info = {"order": order, "unmapped_type": "text"}
-                orders.append({field: order_info})
-            s = s.sort(*orders)
+            s = s.sort(*self._sort_orders(orderBy))
 
         for fld in aggFields:
             s.aggs.bucket(f'aggs_{fld}', 'terms', field=fld, size=1000000)
@@ -270,6 +284,65 @@ class ESConnection(DocStoreConnection):
         logger.error(f"ESConnection.search timeout for {ATTEMPT_TIME} times!")
         raise Exception("ESConnection.search timeout.")
 
+    def iter_chunks(
+            self, selectFields: list[str],
+            condition: dict,
+            orderBy: OrderByExpr,
+            indexNames: str | list[str],
+            knowledgebaseIds: list[str],
+            pageSize: int = 1024
+    ):
+        """
+        Pages through a point in time with search_after: every page costs the same whatever its
+        depth, and all pages see the index as it was when the iteration started.
+        """
+        if isinstance(indexNames, str):
+            indexNames = indexNames.split(",")
+        condition = dict(condition)
+        condition["kb_id"] = knowledgebaseIds
+        q = {
+            "query": self._filter_query(condition).to_dict(),
+            # _shard_doc breaks ties, so no chunk is skipped or repeated between pages
+            "sort": self._sort_orders(orderBy) + [{"_shard_doc": "asc"}],
+            "size": pageSize,
+            "_source": selectFields,
+            "track_total_hits": False,
+        }
+
+        def retried(request, **kwargs):
+            # like search(): reconnect and retry on timeouts, raise anything else
+            for _ in range(ATTEMPT_TIME):
+                try:
+                    res = getattr(self.es, request)(**kwargs)
+                except ConnectionTimeout:
+                    logger.exception("ES request timeout")
+                    self._connect()
+                    continue
+                if str(res.get("timed_out", "")).lower() == "true":
+                    raise Exception("Es Timeout.")
+                return res
+            logger.error(f"ESConnection.iter_chunks timeout for {ATTEMPT_TIME} times!")
+            raise Exception("ESConnection.iter_chunks timeout.")
+
+        pit_id = retried("open_point_in_time", index=indexNames, keep_alive=CURSOR_KEEP_ALIVE)["id"]
+        try:
+            while True:
+                q["pit"] = {"id": pit_id, "keep_alive": CURSOR_KEEP_ALIVE}
+                res = retried("search", body=q, timeout="600s")
+                pit_id = res.get("pit_id", pit_id)
+                hits = res["hits"]["hits"]
+                page = self.get_fields(res, selectFields)
+                if page:
+                    yield page
+                if len(hits) < pageSize:
+                    return
+                q["search_after"] = hits[-1]["sort"]
+        finally:
+            try:
+                self.es.close_point_in_time(id=pit_id)
+            except Exception:
+                logger.warning(f"ESConnection.iter_chunks {str(indexNames)} fail to close point in time")
+
     def get(self, chunkId: str, indexName: str, knowledgebaseIds: list[str]) -> dict | None:
         for i in range(ATTEMPT_TIME):
             try:
@@ -288,13 +361,14 @@ class ESConnection(DocStoreConnection):
         logger.error(f"ESConnection.get timeout for {ATTEMPT_TIME} times!")
         raise Exception("ESConnection.get timeout.")
 
+    @invalidates_retrieval_cache
     def insert(self, documents: list[dict], indexName: str, knowledgebaseId: str = None) -> list[str]:
         # Refers to https://www.elastic.co/guide/en/elasticsearch/reference/current/docs-bulk.html
         operations = []
         for d in documents:
             assert "_id" not in d
             assert "id" in d
-            d_copy = copy.deepcopy(d)
+            d_copy = {k: v.tolist() if isinstance(v, np.ndarray) else copy.deepcopy(v) for k, v in d.items()}
             d_copy["kb_id"] = knowledgebaseId
             meta_id = d_copy.pop("id", "")
             operations.append(
@@ -326,6 +400,7 @@ class ESConnection(DocStoreConnection):
 
         return res
 
+    @invalidates_retrieval_cache
     def update(self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str) -> bool:
         doc = copy.deepcopy(newValue)
         doc.pop("id", None)
@@ -418,6 +493,7 @@ class ESConnection(DocStoreConnection):
                 break
         return False
 
+    @invalidates_retrieval_cache
     def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
         qry = None
         assert "_id" not in condition
@@ -26,11 +26,13 @@ from infinity.index import IndexInfo, IndexType
 from infinity.connection_pool import ConnectionPool
 from infinity.errors import ErrorCode
 from common.decorator import singleton
+import numpy as np
 import pandas as pd
 from common.file_utils import get_project_base_directory
 from rag.nlp import is_english
 from common.constants import PAGERANK_FLD, TAG_FLD
 from common import settings
+from rag.utils.retrieval_cache import invalidates_retrieval_cache
 from rag.utils.doc_store_conn import (
     DocStoreConnection,
     MatchExpr,
@@ -253,6 +255,7 @@ class InfinityConnection(DocStoreConnection):
         self.connPool.release_conn(inf_conn)
         logger.info(f"INFINITY created table {table_name}, vector size {vectorSize}")
 
+    @invalidates_retrieval_cache
     def deleteIdx(self, indexName: str, knowledgebaseId: str):
         table_name = f"{indexName}_{knowledgebaseId}"
         inf_conn = self.connPool.get_conn()
@@ -473,6 +476,7 @@ class InfinityConnection(DocStoreConnection):
         res_fields = self.get_fields(res, res.columns.tolist())
         return res_fields.get(chunkId, None)
 
+    @invalidates_retrieval_cache
     def insert(self, documents: list[dict], indexName: str, knowledgebaseId: str = None) -> list[str]:
         inf_conn = self.connPool.get_conn()
         db_instance = inf_conn.get_database(self.dbName)
@@ -526,6 +530,8 @@ class InfinityConnection(DocStoreConnection):
                 elif k in ["page_num_int", "top_int"]:
                     assert isinstance(v, list)
                     d[k] = "_".join(f"{num:08x}" for num in v)
+                elif isinstance(v, np.ndarray):
+                    d[k] = v.tolist()
                 else:
                     d[k] = v
 
@@ -545,6 +551,7 @@ class InfinityConnection(DocStoreConnection):
         logger.debug(f"INFINITY inserted into {table_name} {str_ids}.")
         return []
 
+    @invalidates_retrieval_cache
     def update(self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str) -> bool:
         # if 'position_int' in newValue:
         #     logger.info(f"update position_int: {newValue['position_int']}")
@@ -620,6 +627,7 @@ class InfinityConnection(DocStoreConnection):
         self.connPool.release_conn(inf_conn)
         return True
 
+    @invalidates_retrieval_cache
     def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
         inf_conn = self.connPool.get_conn()
         db_instance = inf_conn.get_database(self.dbName)
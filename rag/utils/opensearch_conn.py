@@ -21,11 +21,13 @@ import time
 import os
 
 import copy
+import numpy as np
 from opensearchpy import OpenSearch, NotFoundError
 from opensearchpy import UpdateByQuery, Q, Search, Index
 from opensearchpy import ConnectionTimeout
 from common.decorator import singleton
 from common.file_utils import get_project_base_directory
+from rag.utils.retrieval_cache import invalidates_retrieval_cache
 from rag.utils.doc_store_conn import DocStoreConnection, MatchExpr, OrderByExpr, MatchTextExpr, MatchDenseExpr, \
     FusionExpr
 from rag.nlp import is_english, rag_tokenizer
@@ -33,6 +35,8 @@ from common.constants import PAGERANK_FLD, TAG_FLD
 from common import settings
 
 ATTEMPT_TIME = 2
+# How long a scroll stays open between two pages of iter_chunks().
+CURSOR_KEEP_ALIVE = "5m"
 
 logger = logging.getLogger('ragflow.opensearch_conn')
 
@@ -101,6 +105,7 @@ class OSConnection(DocStoreConnection):
         except Exception:
             logger.exception("OSConnection.createIndex error %s" % (indexName))
 
+    @invalidates_retrieval_cache
     def deleteIdx(self, indexName: str, knowledgebaseId: str):
         if len(knowledgebaseId) > 0:
             # The index need to be alive after any kb deletion since all kb under this tenant are in one index.
@@ -128,6 +133,43 @@ class OSConnection(DocStoreConnection):
     CRUD operations
     """
 
+    @staticmethod
+    def _filter_query(condition: dict):
+        bqry = Q("bool", must=[])
+        for k, v in condition.items():
+            if k == "available_int":
+                if v == 0:
+                    bqry.filter.append(Q("range", available_int={"lt": 1}))
+                else:
+                    bqry.filter.append(
+                        Q("bool", must_not=Q("range", available_int={"lt": 1})))
+                continue
+            if not v:
+                continue
+            if isinstance(v, list):
+                bqry.filter.append(Q("terms", **{k: v}))
+            elif isinstance(v, str) or isinstance(v, int):
+                bqry.filter.append(Q("term", **{k: v}))
+            else:
+                raise Exception(
+                    f"Condition `{str(k)}={str(v)}` value type is {str(type(v))}, expected to be int, str or list.")
+        return bqry
+
+    @staticmethod
+    def _sort_orders(orderBy: OrderByExpr) -> list[dict]:
+        orders = list()
+        for field, order in orderBy.fields:
+            order = "asc" if order == 0 else "desc"
+            if field in ["page_num_int", "top_int"]:
+                order_info = {"order": order, "unmapped_type": "float",
+                              "mode": "avg", "numeric_type": "double"}
+            elif field.endswith("_int") or field.endswith("_flt"):
+                order_info = {"order": order, "unmapped_type": "float"}
+            else:
+                order_info = {"order": order, "unmapped_type": "text"}
+            orders.append({field: order_info})
+        return orders
+
     def search(
             self, selectFields: list[str],
             highlightFields: list[str],
@@ -150,25 +192,8 @@ class OSConnection(DocStoreConnection):
         assert isinstance(indexNames, list) and len(indexNames) > 0
         assert "_id" not in condition
 
-        bqry = Q("bool", must=[])
         condition["kb_id"] = knowledgebaseIds
-        for k, v in condition.items():
-            if k == "available_int":
-                if v == 0:
-                    bqry.filter.append(Q("range", available_int={"lt": 1}))
-                else:
-                    bqry.filter.append(
-                        Q("bool", must_not=Q("range", available_int={"lt": 1})))
-                continue
-            if not v:
-                continue
-            if isinstance(v, list):
-                bqry.filter.append(Q("terms", **{k: v}))
-            elif isinstance(v, str) or isinstance(v, int):
-                bqry.filter.append(Q("term", **{k: v}))
-            else:
-                raise Exception(
-                    f"Condition `{str(k)}={str(v)}` value type is {str(type(v))}, expected to be int, str or list.")
+        bqry = self._filter_query(condition)
 
         s = Search()
         vector_similarity_weight = 0.5
@@ -220,18 +245,7 @@ class OSConnection(DocStoreConnection):
             s = s.highlight(field,force_source=True,no_match_size=30,require_field_match=False)
 
         if orderBy:
-            orders = list()
-            for field, order in orderBy.fields:
-                order = "asc" if order == 0 else "desc"
-                if field in ["page_num_int", "top_int"]:
-                    order_info = {"order": order, "unmapped_type": "float",
-                                  "mode": "avg", "numeric_type": "double"}
-                elif field.endswith("_int") or field.endswith("_flt"):
-                    order_info = {"order": order, "unmapped_type": "float"}
-                else:
-                    order_info = {"order": order, "unmapped_type": "text"}
-                orders.append({field: order_info})
-            s = s.sort(*orders)
+            s = s.sort(*self._sort_orders(orderBy))
 
         for fld in aggFields:
             s.aggs.bucket(f'aggs_{fld}', 'terms', field=fld, size=1000000)
@@ -265,6 +279,63 @@ class OSConnection(DocStoreConnection):
         logger.error(f"OSConnection.search timeout for {ATTEMPT_TIME} times!")
         raise Exception("OSConnection.search timeout.")
 
+    def iter_chunks(
+            self, selectFields: list[str],
+            condition: dict,
+            orderBy: OrderByExpr,
+            indexNames: str | list[str],
+            knowledgebaseIds: list[str],
+            pageSize: int = 1024
+    ):
+        """
+        Pages through a scroll: every page costs the same whatever its depth, and all pages see
+        the index as it was when the iteration started.
+        """
+        if isinstance(indexNames, str):
+            indexNames = indexNames.split(",")
+        condition = dict(condition)
+        condition["kb_id"] = knowledgebaseIds
+        q = {
+            "query": self._filter_query(condition).to_dict(),
+            "sort": self._sort_orders(orderBy) + ["_doc"],
+            "size": pageSize,
+            "_source": selectFields,
+        }
+
+        def retried(request, **kwargs):
+            # like search(): retry on timeouts, raise anything else
+            for _ in range(ATTEMPT_TIME):
+                try:
+                    res = getattr(self.os, request)(**kwargs)
+                except Exception as e:
+                    logger.exception(f"OSConnection.iter_chunks {str(indexNames)} {request}")
+                    if str(e).find("Timeout") > 0:
+                        continue
+                    raise e
+                if str(res.get("timed_out", "")).lower() == "true":
+                    raise Exception("OpenSearch Timeout.")
+                return res
+            logger.error(f"OSConnection.iter_chunks timeout for {ATTEMPT_TIME} times!")
+            raise Exception("OSConnection.iter_chunks timeout.")
+
+        res = retried("search", index=indexNames, body=q, scroll=CURSOR_KEEP_ALIVE, timeout=600)
+        scroll_id = res.get("_scroll_id")
+        try:
+            while True:
+                if not res["hits"]["hits"]:
+                    return
+                page = self.get_fields(res, selectFields)
+                if page:
+                    yield page
+                res = retried("scroll", scroll_id=scroll_id, scroll=CURSOR_KEEP_ALIVE)
+                scroll_id = res.get("_scroll_id", scroll_id)
+        finally:
+            if scroll_id:
+                try:
+                    self.os.clear_scroll(scroll_id=scroll_id)
+                except Exception:
+                    logger.warning(f"OSConnection.iter_chunks {str(indexNames)} fail to clear scroll")
+
     def get(self, chunkId: str, indexName: str, knowledgebaseIds: list[str]) -> dict | None:
         for i in range(ATTEMPT_TIME):
             try:
@@ -285,13 +356,14 @@ class OSConnection(DocStoreConnection):
         logger.error(f"OSConnection.get timeout for {ATTEMPT_TIME} times!")
         raise Exception("OSConnection.get timeout.")
 
+    @invalidates_retrieval_cache
     def insert(self, documents: list[dict], indexName: str, knowledgebaseId: str = None) -> list[str]:
         # Refers to https://opensearch.org/docs/latest/api-reference/document-apis/bulk/
         operations = []
         for d in documents:
             assert "_id" not in d
             assert "id" in d
-            d_copy = copy.deepcopy(d)
+            d_copy = {k: v.tolist() if isinstance(v, np.ndarray) else copy.deepcopy(v) for k, v in d.items()}
             meta_id = d_copy.pop("id", "")
             operations.append(
                 {"index": {"_index": indexName, "_id": meta_id}})
@@ -321,6 +393,7 @@ class OSConnection(DocStoreConnection):
                     continue
         return res
 
+    @invalidates_retrieval_cache
     def update(self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str) -> bool:
         doc = copy.deepcopy(newValue)
         doc.pop("id", None)
@@ -404,6 +477,7 @@ class OSConnection(DocStoreConnection):
                 break
         return False
 
+    @invalidates_retrieval_cache
     def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
         qry = None
         assert "_id" not in condition
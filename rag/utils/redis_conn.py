@@ -70,6 +70,7 @@ class RedisDB:
 
     def __init__(self):
         self.REDIS = None
+        self.REDIS_BIN = None
         self.config = REDIS
         self.__open__()
 
@@ -91,6 +92,8 @@ class RedisDB:
                 conn_params["password"] = password
 
             self.REDIS = redis.StrictRedis(**conn_params)
+            # raw bytes values (e.g. vectors) can't go through the decoding client
+            self.REDIS_BIN = redis.StrictRedis(**{**conn_params, "decode_responses": False})
 
             self.register_scripts()
         except Exception as e:
@@ -159,6 +162,36 @@ class RedisDB:
             self.__open__()
         return False
 
+    def mget(self, keys: list[str], binary=False) -> list:
+        """Fetch many keys in one round trip; missing keys, or all on failure, come back as None."""
+        client = self.REDIS_BIN if binary else self.REDIS
+        if not client or not keys:
+            return [None] * len(keys)
+        try:
+            return client.mget(keys)
+        except Exception as e:
+            logging.warning("RedisDB.mget " + str(len(keys)) + " keys got exception: " + str(e))
+            self.__open__()
+        return [None] * len(keys)
+
+    def mset(self, mapping: dict, exp=3600, binary=False, nx=False) -> bool:
+        """Set many keys with the same expiry in one pipelined round trip, only the missing ones if `nx`."""
+        if not mapping:
+            return True
+        client = self.REDIS_BIN if binary else self.REDIS
+        if not client:
+            return False
+        try:
+            pipeline = client.pipeline(transaction=False)
+            for k, v in mapping.items():
+                pipeline.set(k, v, exp, nx=nx)
+            pipeline.execute()
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.mset " + str(len(mapping)) + " keys got exception: " + str(e))
+            self.__open__()
+        return False
+
     def sadd(self, key: str, member: str):
         try:
             self.REDIS.sadd(key, member)
@@ -0,0 +1,242 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import base64
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import xxhash
+from cachetools import LRUCache
+
+from common.decorator import singleton
+from common.metrics import Counter
+
+RETRIEVAL_CACHE_ENABLED = int(os.environ.get("RETRIEVAL_CACHE_ENABLED", "1"))
+RETRIEVAL_CACHE_SIZE = int(os.environ.get("RETRIEVAL_CACHE_SIZE", "1024"))
+RETRIEVAL_CACHE_TTL = int(os.environ.get("RETRIEVAL_CACHE_TTL", "600"))
+# Writes become searchable about a second after they return (index refresh), so results
+# are not cached until this many seconds after the last change of any involved KB.
+RETRIEVAL_CACHE_SETTLE = float(os.environ.get("RETRIEVAL_CACHE_SETTLE", "3"))
+# Must stay well above RETRIEVAL_CACHE_TTL, see RetrievalCache.
+KB_VERSION_TTL = 7 * 24 * 3600
+
+LOOKUPS = Counter("ragflow_retrieval_cache_lookups", "Retrieval cache lookups by result.", ["result"])
+
+
+def _redis():
+    # Imported late: the doc store connections import this module while settings, which
+    # redis_conn depends on, may still be loading.
+    from rag.utils.redis_conn import REDIS_CONN
+    return REDIS_CONN
+
+
+def _version_key(kb_id):
+    return f"kbver:{kb_id}"
+
+
+def _index_version_key(index_name):
+    return f"idxver:{index_name}"
+
+
+def _to_json(o):
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, np.generic):
+        return o.item()
+    raise TypeError(f"{type(o)} is not JSON serializable")
+
+
+def _dumps(ranks: dict) -> str:
+    """
+    JSON of a retrieval result, with the chunk vectors packed into one base64 float32 matrix
+    instead of number lists, which would make up most of it.
+    """
+    chunks = ranks.get("chunks", [])
+    if chunks and all("vector" in ck for ck in chunks):
+        vectors = np.asarray([ck["vector"] for ck in chunks], dtype=np.float32)
+        ranks = {**ranks, "chunks": [{k: v for k, v in ck.items() if k != "vector"} for ck in chunks]}
+        ranks["vectors"] = base64.b64encode(vectors.tobytes()).decode("ascii")
+    return json.dumps(ranks, ensure_ascii=False, default=_to_json)
+
+
+def _loads(dumped: str) -> dict:
+    ranks = json.loads(dumped)
+    packed = ranks.pop("vectors", None)
+    if packed is not None:
+        vectors = np.frombuffer(base64.b64decode(packed), dtype=np.float32).reshape(len(ranks["chunks"]), -1)
+        for ck, v in zip(ranks["chunks"], vectors.tolist()):
+            ck["vector"] = v
+    return ranks
+
+
+def _model_name(mdl):
+    if mdl is None:
+        return ""
+    return getattr(mdl, "cache_model", None) or getattr(mdl, "llm_name", None) or mdl.__class__.__name__
+
+
+@singleton
+class RetrievalCache:
+    """
+    Caches Dealer.retrieval results in a bounded in-process LRU in front of Redis.
+
+    Every KB has a version stamp in Redis, set to the current time in ms whenever its chunks
+    are inserted, updated or deleted. The stamps of the searched KBs are part of the cache key,
+    so a change makes all earlier entries unreachable at once, in every process. Changes not
+    bound to one KB, like dropping a whole index, stamp the index instead. A missing stamp
+    can't be told apart from a Redis failure: it is created and nothing is cached.
+    """
+
+    def __init__(self):
+        self.lru = LRUCache(maxsize=RETRIEVAL_CACHE_SIZE)
+        self.lock = threading.Lock()
+        self.counters = {"local_hit": 0, "redis_hit": 0, "miss": 0, "bypass": 0}
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+        LOOKUPS.inc(result=name)
+
+    def stats(self) -> dict:
+        with self.lock:
+            res = dict(self.counters)
+        lookups = res["local_hit"] + res["redis_hit"] + res["miss"]
+        res["hit_ratio"] = (res["local_hit"] + res["redis_hit"]) / lookups if lookups else 0.
+        return res
+
+    def _versions(self, keys):
+        """Version stamps under `keys`, or None when the result must not be cached."""
+        keys = sorted(set(keys))
+        versions = _redis().mget(keys)
+        missing = {k: str(int(time.time() * 1000)) for k, v in zip(keys, versions) if v is None}
+        if missing:
+            _redis().mset(missing, KB_VERSION_TTL, nx=True)
+            return None
+        return dict(zip(keys, versions))
+
+    def lookup(self, kb_ids: list[str], params: dict, index_names: list[str] | None = None) -> tuple[dict | None, str | None]:
+        """
+        Returns the cached result for `params` if any, and the key to store the computed
+        result under, which is None if it must not be cached. `index_names` are the doc store
+        indices searched.
+        """
+        if not RETRIEVAL_CACHE_ENABLED or not kb_ids:
+            return None, None
+        versions = self._versions([_version_key(kb_id) for kb_id in kb_ids] + [_index_version_key(i) for i in index_names or []])
+        if versions is None:
+            self._count("bypass")
+            return None, None
+
+        hasher = xxhash.xxh64()
+        hasher.update(json.dumps([versions, params], sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+        key = "retrieval:" + hasher.hexdigest()
+
+        with self.lock:
+            cached = self.lru.get(key)
+        if cached is not None:
+            self._count("local_hit")
+            return _loads(cached), None
+        cached = _redis().get(key)
+        if cached:
+            with self.lock:
+                self.lru[key] = cached
+            self._count("redis_hit")
+            return _loads(cached), None
+        self._count("miss")
+
+        newest = max(int(v) for v in versions.values())
+        if time.time() * 1000 - newest < RETRIEVAL_CACHE_SETTLE * 1000:
+            return None, None
+        return None, key
+
+    def store(self, key: str | None, ranks: dict):
+        if not key:
+            return
+        try:
+            dumped = _dumps(ranks)
+        except (TypeError, ValueError) as e:
+            logging.warning(f"RetrievalCache: result not cached: {e}")
+            return
+        with self.lock:
+            self.lru[key] = dumped
+        _redis().set(key, dumped, RETRIEVAL_CACHE_TTL)
+
+    def invalidate(self, kb_ids: list[str]):
+        kb_ids = [kb_id for kb_id in kb_ids if kb_id]
+        if not kb_ids:
+            return
+        stamp = str(int(time.time() * 1000))
+        if not _redis().mset({_version_key(kb_id): stamp for kb_id in kb_ids}, KB_VERSION_TTL):
+            logging.warning(f"RetrievalCache: fail to bump the version of KB {kb_ids}")
+
+    def invalidate_index(self, index_name: str):
+        if not index_name:
+            return
+        if not _redis().set(_index_version_key(index_name), str(int(time.time() * 1000)), KB_VERSION_TTL):
+            logging.warning(f"RetrievalCache: fail to bump the version of index {index_name}")
+
+    @staticmethod
+    def params(question, embd_mdl, tenant_ids, kb_ids, page, page_size, similarity_threshold,
+               vector_similarity_weight, top, doc_ids, aggs, rerank_mdl, highlight, rank_feature) -> dict:
+        return {
+            "question": " ".join(question.split()),
+            "embd_mdl": _model_name(embd_mdl),
+            "tenant_ids": sorted(tenant_ids.split(",") if isinstance(tenant_ids, str) else tenant_ids),
+            "kb_ids": sorted(kb_ids),
+            "page": page,
+            "page_size": page_size,
+            "similarity_threshold": similarity_threshold,
+            "vector_similarity_weight": vector_similarity_weight,
+            "top": top,
+            "doc_ids": sorted(doc_ids) if doc_ids is not None else None,
+            "aggs": aggs,
+            "rerank_mdl": _model_name(rerank_mdl),
+            "highlight": highlight,
+            "rank_feature": rank_feature,
+        }
+
+
+RETRIEVAL_CACHE = RetrievalCache()
+
+
+def invalidates_retrieval_cache(func):
+    """
+    For doc store methods taking an `indexName` and a `knowledgebaseId`: bump the KB's version
+    once they return or fail, or the index's without a KB.
+    """
+    sig = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            try:
+                arguments = sig.bind_partial(*args, **kwargs).arguments
+                if arguments.get("knowledgebaseId"):
+                    RETRIEVAL_CACHE.invalidate([arguments["knowledgebaseId"]])
+                else:
+                    RETRIEVAL_CACHE.invalidate_index(arguments.get("indexName"))
+            except Exception:
+                logging.exception("RetrievalCache: fail to invalidate")
+
+    return wrapper
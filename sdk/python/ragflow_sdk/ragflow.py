@@ -227,6 +227,44 @@ class RAGFlow:
             return chunks
         raise Exception(res.get("message"))
 
+    def retrieve_batch(
+        self,
+        dataset_ids,
+        questions: list[str],
+        document_ids=None,
+        page=1,
+        page_size=30,
+        similarity_threshold=0.2,
+        vector_similarity_weight=0.3,
+        top_k=1024,
+        rerank_id: str | None = None,
+        metadata_condition: dict | None = None,
+        batch_size: int = 256,
+    ) -> list[list[Chunk]]:
+        if document_ids is None:
+            document_ids = []
+        results = []
+        for i in range(0, len(questions), batch_size):
+            data_json = {
+                "page": page,
+                "page_size": page_size,
+                "similarity_threshold": similarity_threshold,
+                "vector_similarity_weight": vector_similarity_weight,
+                "top_k": top_k,
+                "rerank_id": rerank_id,
+                "questions": questions[i : i + batch_size],
+                "dataset_ids": dataset_ids,
+                "document_ids": document_ids,
+                "metadata_condition": metadata_condition,
+            }
+            res = self.post("/retrieval/batch", json=data_json)
+            res = res.json()
+            if res.get("code") != 0:
+                raise Exception(res.get("message"))
+            for ranks in res["data"]["results"]:
+                results.append([Chunk(self, chunk_data) for chunk_data in ranks["chunks"]])
+        return results
+
     def list_agents(self, page: int = 1, page_size: int = 30, orderby: str = "update_time", desc: bool = True, id: str | None = None, title: str | None = None) -> list[Agent]:
         res = self.get(
             "/agents",
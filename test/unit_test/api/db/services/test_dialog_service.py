@@ -0,0 +1,60 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from api.db.services.dialog_service import run_concurrently
+from common.metrics import RequestRecord
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=4)
+    yield executor
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+class TestRunConcurrently:
+
+    def test_results_in_order(self, executor):
+        res = run_concurrently({"a": (lambda: 1, 5), "b": (lambda: 2, 5)}, RequestRecord("chat"), executor)
+        assert list(res.items()) == [("a", 1), ("b", 2)]
+
+    def test_deadline_missed(self, executor):
+        release = threading.Event()
+        res = run_concurrently({"slow": (release.wait, 0.1), "fast": (lambda: "ok", 5)}, RequestRecord("chat"), executor)
+        release.set()
+        assert res == {"slow": None, "fast": "ok"}
+
+    def test_task_timeout_error_is_raised(self, executor):
+        def fails():
+            raise TimeoutError("metadata filter timed out")
+
+        with pytest.raises(TimeoutError, match="metadata filter"):
+            run_concurrently({"meta": (fails, 5), "other": (lambda: time.sleep(0.05), 5)}, RequestRecord("chat"), executor)
+
+    def test_first_failure_in_order(self, executor):
+        def fails(e):
+            def fn():
+                raise e
+            return fn
+
+        with pytest.raises(ValueError):
+            run_concurrently({"a": (fails(ValueError()), 5), "b": (fails(KeyError()), 5)}, RequestRecord("chat"), executor)
@@ -0,0 +1,131 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from common.metrics import Counter, Histogram, Registry, RequestRecord, current_record, request_record, run_with_record, stage
+
+
+class TestCounter:
+
+    def test_inc_per_labels(self):
+        registry = Registry()
+        c = Counter("lookups", "Lookups.", ["result"], registry=registry)
+        c.inc(result="hit")
+        c.inc(2, result="hit")
+        c.inc(result="miss")
+        assert c.get(result="hit") == 3
+        assert c.get(result="miss") == 1
+        assert c.get(result="bypass") == 0
+
+    def test_render(self):
+        registry = Registry()
+        c = Counter("lookups", "Lookups.", ["result"], registry=registry)
+        c.inc(result="hit")
+        text = registry.render()
+        assert "# HELP lookups Lookups.\n" in text
+        assert "# TYPE lookups counter\n" in text
+        assert 'lookups_total{result="hit"} 1\n' in text
+
+    def test_duplicate_name(self):
+        registry = Registry()
+        Counter("lookups", "Lookups.", registry=registry)
+        with pytest.raises(ValueError):
+            Counter("lookups", "Lookups.", registry=registry)
+
+    def test_label_escaping(self):
+        registry = Registry()
+        c = Counter("lookups", "Lookups.", ["result"], registry=registry)
+        c.inc(result='a"b\\c\nd')
+        assert 'lookups_total{result="a\\"b\\\\c\\nd"} 1' in registry.render()
+
+
+class TestHistogram:
+
+    def test_buckets_are_cumulative(self):
+        registry = Registry()
+        h = Histogram("latency_seconds", "Latency.", ["stage"], buckets=[0.1, 1], registry=registry)
+        for v in [0.05, 0.5, 0.5, 5]:
+            h.observe(v, stage="search")
+        text = registry.render()
+        assert 'latency_seconds_bucket{stage="search",le="0.1"} 1\n' in text
+        assert 'latency_seconds_bucket{stage="search",le="1"} 3\n' in text
+        assert 'latency_seconds_bucket{stage="search",le="+Inf"} 4\n' in text
+        assert 'latency_seconds_sum{stage="search"} 6.05\n' in text
+        assert 'latency_seconds_count{stage="search"} 4\n' in text
+
+    def test_get(self):
+        h = Histogram("latency_seconds", "Latency.", ["stage"], registry=None)
+        h.observe(1, stage="rerank")
+        h.observe(2, stage="rerank")
+        assert h.get(stage="rerank") == (3, 2)
+        assert h.get(stage="search") == (0, 0)
+
+    def test_concurrent_observe(self):
+        h = Histogram("latency_seconds", "Latency.", registry=None)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda _: h.observe(0.01), range(1000)))
+        assert h.get()[1] == 1000
+
+
+class TestRequestRecord:
+
+    def test_stage_outside_record(self):
+        assert current_record() is None
+        with stage("search"):
+            pass
+
+    def test_stages_add_up(self):
+        with request_record("chat", tenant="t1") as record:
+            with stage("search"):
+                pass
+            with stage("search"):
+                pass
+        assert current_record() is None
+        assert set(record.stages) == {"search"}
+        assert record.to_dict()["tenant"] == "t1"
+
+    def test_run_with_record_in_worker(self):
+        record = RequestRecord("chat")
+
+        def work():
+            with stage("embedding"):
+                return current_record()
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            assert pool.submit(run_with_record, record, work).result() is record
+        assert "embedding" in record.stages
+        assert current_record() is None
+
+    def test_observe(self):
+        h = Histogram("chat_stage_seconds", "Chat stages.", ["stage", "tenant"], registry=None)
+        record = RequestRecord("chat", tenant="t1")
+        record.add("retrieval", 0.2)
+        record.add("retrieval", 0.3)
+        record.observe(h)
+        assert h.get(stage="retrieval", tenant="t1") == (0.5, 1)
+
+    def test_observe_ignores_unlabelled_fields(self):
+        h = Histogram("chat_stage_seconds", "Chat stages.", ["stage", "model"], registry=None)
+        for dialog in ("d1", "d2"):
+            record = RequestRecord("chat", tenant="t1", dialog=dialog, model="m")
+            record.add("retrieval", 0.5)
+            record.observe(h)
+        assert h.get(stage="retrieval", model="m") == (1.0, 2)
+        assert len(h.samples()) == len(h.buckets) + 2
+        assert "dialog" not in "".join(h.samples())
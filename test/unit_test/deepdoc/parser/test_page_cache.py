@@ -0,0 +1,240 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import os
+import time
+from io import BytesIO
+
+import numpy as np
+import pytest
+from pypdf import PdfWriter
+
+from common import settings
+from deepdoc.parser import page_cache
+from deepdoc.parser.page_cache import PageCache, model_version, prune_disk, remove_cached_pages
+
+PDF = b"%PDF-1.4 not really a pdf"
+
+
+class FakeStorage:
+
+    def __init__(self, fail=False):
+        self.objs = {}
+        self.fail = fail
+
+    def obj_exist(self, bucket, key):
+        if self.fail:
+            raise ConnectionError("storage down")
+        return (bucket, key) in self.objs
+
+    def get(self, bucket, key):
+        return self.objs[(bucket, key)]
+
+    def put(self, bucket, key, binary):
+        if self.fail:
+            raise ConnectionError("storage down")
+        self.objs[(bucket, key)] = binary
+
+    def rm(self, bucket, key):
+        del self.objs[(bucket, key)]
+
+
+def pdf(pages):
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=100, height=100)
+    out = BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(page_cache, "PDF_PAGE_CACHE_DIR", str(tmp_path / "page_cache"))
+    return tmp_path / "page_cache"
+
+
+class TestPageCache:
+
+    def test_disabled(self, cache_dir):
+        cache = PageCache(PDF, 3, backend="")
+        assert not cache.enabled
+        cache.put("ocr", "v1", 0, {"boxes": []})
+        assert cache.get("ocr", "v1", 0) is None
+        assert not cache_dir.exists()
+
+    def test_disk_round_trip(self, cache_dir):
+        cache = PageCache(PDF, 3, backend="disk")
+        value = {"boxes": [{"x0": np.float32(1.5), "text": "文本"}], "mean_height": np.float64(12.)}
+        assert cache.get("ocr", "v1", 4) is None
+        cache.put("ocr", "v1", 4, value)
+        assert cache.get("ocr", "v1", 4) == {"boxes": [{"x0": 1.5, "text": "文本"}], "mean_height": 12.}
+        assert cache.get_many("ocr", "v1", [3, 4]) == [None, cache.get("ocr", "v1", 4)]
+        # no temporary files left behind
+        assert [p.name for p in cache_dir.rglob("*.tmp")] == []
+
+    def test_key(self, tmp_path):
+        fnm = tmp_path / "doc.pdf"
+        fnm.write_bytes(PDF)
+        cache = PageCache(PDF, 3, backend="disk")
+        # the same content read from a file or given as bytes
+        assert PageCache(str(fnm), 3, backend="disk").key("ocr", 0) == cache.key("ocr", 0)
+        keys = {
+            cache.key("ocr", 0),
+            cache.key("ocr", 1),
+            cache.key("layout", 0),
+            PageCache(PDF + b" ", 3, backend="disk").key("ocr", 0),
+        }
+        assert len(keys) == 4
+        assert PageCache(PDF, 2, backend="disk").key("ocr", 0) == cache.key("ocr", 0)
+
+    def test_other_versions_miss(self, cache_dir):
+        cache = PageCache(PDF, 3, backend="disk")
+        cache.put("layout", "v1", 0, [{"type": "text"}])
+        assert cache.get("layout", "v1", 0) == [{"type": "text"}]
+        assert cache.get("layout", "v2", 0) is None
+        assert PageCache(PDF, 2, backend="disk").get("layout", "v1", 0) is None
+        assert PageCache(PDF, 3, backend="disk").get("layout", "v1", 0) == [{"type": "text"}]
+        # a newer model replaces the results of the older one
+        cache.put("layout", "v2", 0, [{"type": "title"}])
+        assert cache.get("layout", "v2", 0) == [{"type": "title"}]
+        assert cache.get("layout", "v1", 0) is None
+        assert len(list(cache_dir.rglob("*.json"))) == 1
+
+    def test_expired(self, cache_dir, monkeypatch):
+        cache = PageCache(PDF, 3, backend="disk")
+        cache.put("ocr", "v1", 0, {"boxes": []})
+        monkeypatch.setattr(page_cache, "PDF_PAGE_CACHE_TTL", 60)
+        assert cache.get("ocr", "v1", 0) == {"boxes": []}
+        now = time.time()
+        monkeypatch.setattr(page_cache.time, "time", lambda: now + 61)
+        assert cache.get("ocr", "v1", 0) is None
+
+    def test_storage(self, monkeypatch):
+        storage = FakeStorage()
+        monkeypatch.setattr(settings, "STORAGE_IMPL", storage)
+        cache = PageCache(PDF, 3, backend="storage")
+        cache.put("tsr", "v1", 2, {"tables": [[1., 2., 3., 4.]], "recos": [[]]})
+        assert list(storage.objs) == [(page_cache.PDF_PAGE_CACHE_BUCKET, cache.key("tsr", 2))]
+        assert cache.get("tsr", "v1", 2) == {"tables": [[1., 2., 3., 4.]], "recos": [[]]}
+
+    def test_storage_missing(self, monkeypatch):
+        monkeypatch.setattr(settings, "STORAGE_IMPL", None)
+        assert not PageCache(PDF, 3, backend="storage").enabled
+
+    def test_errors_are_misses(self, monkeypatch):
+        monkeypatch.setattr(settings, "STORAGE_IMPL", FakeStorage(fail=True))
+        cache = PageCache(PDF, 3, backend="storage")
+        cache.put("ocr", "v1", 0, {"boxes": []})
+        assert cache.get("ocr", "v1", 0) is None
+
+    def test_remove_from_disk(self, cache_dir):
+        cache, other = PageCache(PDF, 3, backend="disk"), PageCache(PDF + b" ", 3, backend="disk")
+        cache.put("ocr", "v1", 0, {"boxes": []})
+        other.put("ocr", "v1", 0, {"boxes": []})
+        cache.remove(0)
+        assert cache.get("ocr", "v1", 0) is None
+        assert other.get("ocr", "v1", 0) == {"boxes": []}
+
+    def test_remove_cached_pages(self, monkeypatch):
+        storage = FakeStorage()
+        monkeypatch.setattr(settings, "STORAGE_IMPL", storage)
+        monkeypatch.setattr(page_cache, "PDF_PAGE_CACHE", "storage")
+        binary = pdf(3)
+        cache = PageCache(binary, 3)
+        for p in range(3):
+            cache.put("ocr", "v1", p, {"boxes": []})
+            cache.put("layout", "v1", p, [])
+        cache.put("tsr", "v1", 1, {"tables": [], "recos": []})
+        PageCache(PDF, 3).put("ocr", "v1", 0, {"boxes": []})
+        remove_cached_pages(binary)
+        assert list(storage.objs) == [(page_cache.PDF_PAGE_CACHE_BUCKET, PageCache(PDF, 3).key("ocr", 0))]
+
+    def test_prune_disk(self, cache_dir, monkeypatch):
+        now = time.time()
+        docs = [PageCache(PDF + bytes([i]), 3, backend="disk") for i in range(4)]
+        for i, cache in enumerate(docs):
+            cache.put("ocr", "v1", 0, {"text": "x" * 1000})
+            # documents used 1, 2, 3 and 4 days ago
+            for f in (cache_dir / cache.doc).iterdir():
+                os.utime(f, (now - (i + 1) * 86400, now - (i + 1) * 86400))
+        monkeypatch.setattr(page_cache, "PDF_PAGE_CACHE_TTL", 3.5 * 86400)
+        monkeypatch.setattr(page_cache, "PDF_PAGE_CACHE_DISK", 10 ** 9)
+        prune_disk(now=now)
+        assert sorted(p.name for p in cache_dir.iterdir()) == sorted(cache.doc for cache in docs[:3])
+        # reading documents makes them the most recently used ones
+        assert docs[1].get("ocr", "v1", 0) == docs[2].get("ocr", "v1", 0) == {"text": "x" * 1000}
+        monkeypatch.setattr(page_cache, "PDF_PAGE_CACHE_DISK", 2500)
+        prune_disk()
+        assert sorted(p.name for p in cache_dir.iterdir()) == sorted(cache.doc for cache in docs[1:3])
+
+    def test_model_version(self, tmp_path):
+        model = tmp_path / "det.onnx"
+        model.write_bytes(b"weights")
+        v1 = model_version(str(model), "drop_score=0.5")
+        assert model_version(str(model), "drop_score=0.5") == v1
+        assert model_version(str(model), "drop_score=0.6") != v1
+        model.write_bytes(b"other weights")
+        model_version.cache_clear()
+        assert model_version(str(model), "drop_score=0.5") != v1
+        # missing files only contribute their path
+        assert model_version(str(tmp_path / "missing.onnx")) != model_version(str(tmp_path / "other.onnx"))
+
+
+class FakeLayouter:
+
+    def __init__(self):
+        self.predicted = []
+        self.layouts = None
+
+    def predict(self, images):
+        self.predicted.extend(images)
+        return [[{"type": "text", "page": img}] for img in images]
+
+    def __call__(self, images, boxes, scale_factor, drop=True, layouts=None):
+        self.layouts = layouts
+        return [], [[] for _ in images]
+
+
+class TestPdfParserLayoutCache:
+
+    @staticmethod
+    def parse_layouts(cache, page_from, pages):
+        from deepdoc.parser.pdf_parser import RAGFlowPdfParser
+
+        parser = object.__new__(RAGFlowPdfParser)
+        parser.page_cache = cache
+        parser.page_cache_models = {"layout": ("layout.onnx",)}
+        parser.layouter = FakeLayouter()
+        parser.page_from = page_from
+        parser.page_images = [f"page{page_from + i}" for i in range(pages)]
+        parser.boxes = [[] for _ in range(pages)]
+        parser.page_cum_height = [0] * pages
+        parser._layouts_rec(3)
+        return parser.layouter
+
+    def test_pages_predicted_once(self, cache_dir):
+        cache = PageCache(PDF, 3, backend="disk")
+        layouter = self.parse_layouts(cache, 0, 3)
+        assert layouter.predicted == ["page0", "page1", "page2"]
+        layouter = self.parse_layouts(cache, 1, 3)
+        assert layouter.predicted == ["page3"]
+        assert [lts[0]["page"] for lts in layouter.layouts] == ["page1", "page2", "page3"]
+
+    def test_disabled_cache_leaves_prediction_to_the_layouter(self):
+        layouter = self.parse_layouts(PageCache(PDF, 3, backend=""), 0, 2)
+        assert layouter.predicted == []
+        assert layouter.layouts is None
@@ -0,0 +1,107 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import threading
+
+import numpy as np
+import pdfplumber
+import pytest
+
+from deepdoc.parser.pdf_pages import LazyPageImages, page_size
+from deepdoc.parser.pdf_pages_benchmark import build_scan
+
+PAGES = 6
+
+
+@pytest.fixture(scope="module")
+def pdf(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("pdf") / "scan.pdf")
+    build_scan(path, PAGES, dpi=72)
+    return path
+
+
+@pytest.fixture(scope="module")
+def eager(pdf):
+    """What RAGFlowPdfParser.__images__ rendered up front before LazyPageImages."""
+    with pdfplumber.open(pdf) as doc:
+        return [np.asarray(p.to_image(resolution=72 * 2, antialias=True).annotated) for p in doc.pages]
+
+
+def lazy(pdf, page_from=0, page_to=PAGES, window=2):
+    return LazyPageImages(pdf, page_from, page_to, 2, threading.Lock(), window=window)
+
+
+class TestLazyPageImages:
+
+    def test_same_pixels_as_eager_rendering(self, pdf, eager):
+        pages = lazy(pdf)
+        assert len(pages) == PAGES
+        assert pages.total_page == PAGES
+        # a second pass renders the pages dropped from the window again
+        for _ in range(2):
+            for img, expected in zip(pages, eager):
+                assert np.array_equal(np.asarray(img), expected)
+        pages.close()
+
+    def test_window(self, pdf):
+        pages = lazy(pdf, window=2)
+        for i in range(PAGES):
+            pages[i]
+            assert len(pages.cache) <= 2
+        assert list(pages.cache) == [PAGES - 2, PAGES - 1]
+        pages[PAGES - 2]
+        assert list(pages.cache) == [PAGES - 1, PAGES - 2]
+        pages.close()
+
+        pages = lazy(pdf, window=0)
+        pages[:]
+        assert len(pages.cache) == PAGES
+        pages.close()
+
+    def test_page_range_and_indexing(self, pdf, eager):
+        pages = lazy(pdf, 2, 5)
+        assert len(pages) == 3
+        assert np.array_equal(np.asarray(pages[0]), eager[2])
+        assert np.array_equal(np.asarray(pages[-1]), eager[4])
+        assert [np.asarray(img).shape for img in pages[1:]] == [eager[3].shape, eager[4].shape]
+        with pytest.raises(IndexError):
+            pages[3]
+        pages.close()
+
+    def test_sizes_without_rendering_again(self, pdf, eager, monkeypatch):
+        pages = lazy(pdf, window=1)
+        sizes = [img.size for img in pages]
+        assert sizes == [(e.shape[1], e.shape[0]) for e in eager]
+
+        def fail(*args, **kwargs):
+            raise AssertionError("page rendered again")
+
+        for p in pages.pages:
+            monkeypatch.setattr(p, "to_image", fail)
+        assert [page_size(pages, i) for i in range(PAGES)] == sizes
+        assert pages.size_of(-1) == sizes[-1]
+        pages.close()
+
+    def test_page_size_of_plain_lists(self, pdf):
+        pages = lazy(pdf)
+        images = list(pages)
+        assert [page_size(images, i) for i in range(PAGES)] == [img.size for img in images]
+        pages.close()
+
+    def test_chars_of_a_scan(self, pdf):
+        pages = lazy(pdf)
+        assert pages.chars(0) == []
+        pages.close()
@@ -0,0 +1,100 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import random
+
+import numpy as np
+import pytest
+
+from deepdoc.vision import boxes as box_geometry
+from deepdoc.vision.boxes import Boxes
+from deepdoc.vision.recognizer import Recognizer
+
+
+def random_boxes(rng, n, grid=8, layoutnos=("0",)):
+    """Boxes on a coarse grid, so that equal overlaps and distances are common, some of them without width or height."""
+    res = []
+    for _ in range(n):
+        x0, top = rng.randint(0, grid), rng.randint(0, grid)
+        w, h = rng.choice([0, 1, 1, 2, 3]), rng.choice([0, 1, 1, 2, 3])
+        res.append({"x0": float(x0), "x1": float(x0 + w), "top": float(top), "bottom": float(top + h),
+                    "layoutno": rng.choice(layoutnos)})
+    return res
+
+
+SEEDS = range(30)
+
+
+class TestBoxes:
+
+    @pytest.mark.parametrize("seed", SEEDS)
+    def test_overlapped_area(self, seed):
+        rng = random.Random(seed)
+        a, b = random_boxes(rng, 12), random_boxes(rng, 15)
+        for ratio in (True, False):
+            expected = np.array([[Recognizer.overlapped_area(x, y, ratio) for y in b] for x in a], dtype=np.float64)
+            np.testing.assert_array_equal(box_geometry.overlapped_area(Boxes(a), Boxes(b), ratio), expected)
+            pairs = [Recognizer.overlapped_area(x, y, ratio) for x, y in zip(a, b)]
+            np.testing.assert_array_equal(box_geometry.overlapped_area_pairs(Boxes(a), Boxes(b[:len(a)]), ratio), pairs)
+
+    def test_overlapped_area_sum(self):
+        rng = random.Random(0)
+        bxs = random_boxes(rng, 40)
+        for box in random_boxes(rng, 20):
+            expected = sum(Recognizer.overlapped_area(b, box, False) for b in bxs
+                           if Recognizer.overlapped_area(b, box, False) != 0)
+            assert box_geometry.overlapped_area_sum(Boxes(bxs), box) == expected
+
+    @pytest.mark.parametrize("seed", SEEDS)
+    @pytest.mark.parametrize("naive", [False, True])
+    def test_find_overlapped(self, seed, naive):
+        rng = random.Random(seed)
+        targets = sorted(random_boxes(rng, rng.randint(1, 30)), key=lambda b: (b["top"], b["x0"]))
+        queries = random_boxes(rng, 25)
+        expected = [Recognizer.find_overlapped(q, targets, naive) for q in queries]
+        assert box_geometry.find_overlapped(queries, targets, naive) == expected
+
+    @pytest.mark.parametrize("seed", SEEDS)
+    @pytest.mark.parametrize("thr", [0., 0.3, 1.])
+    def test_find_overlapped_with_threshold(self, seed, thr):
+        rng = random.Random(seed)
+        targets, queries = random_boxes(rng, rng.randint(1, 30)), random_boxes(rng, 25)
+        expected = [Recognizer.find_overlapped_with_threshold(q, targets, thr) for q in queries]
+        assert box_geometry.find_overlapped_with_threshold(queries, targets, thr) == expected
+
+    @pytest.mark.parametrize("seed", SEEDS)
+    def test_find_horizontally_tightest_fit(self, seed):
+        rng = random.Random(seed)
+        layoutnos = ("0", "figure-0", "table-1")
+        targets, queries = random_boxes(rng, rng.randint(1, 30), layoutnos=layoutnos), random_boxes(rng, 25, layoutnos=layoutnos)
+        expected = [Recognizer.find_horizontally_tightest_fit(q, targets) for q in queries]
+        assert box_geometry.find_horizontally_tightest_fit(queries, targets) == expected
+
+    def test_blocks(self, monkeypatch):
+        monkeypatch.setattr(box_geometry, "BLOCK_SIZE", 16)
+        rng = random.Random(1)
+        targets, queries = random_boxes(rng, 10), random_boxes(rng, 25)
+        assert box_geometry.find_overlapped_with_threshold(queries, targets) == \
+            [Recognizer.find_overlapped_with_threshold(q, targets) for q in queries]
+        assert box_geometry.find_horizontally_tightest_fit(queries, targets) == \
+            [Recognizer.find_horizontally_tightest_fit(q, targets) for q in queries]
+
+    def test_empty(self):
+        box = {"x0": 0., "x1": 1., "top": 0., "bottom": 1.}
+        assert box_geometry.find_overlapped([box], []) == [None]
+        assert box_geometry.find_overlapped_with_threshold([box], []) == [None]
+        assert box_geometry.find_horizontally_tightest_fit([box], []) == [None]
+        assert box_geometry.find_overlapped([], [box]) == []
@@ -0,0 +1,140 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from deepdoc.vision import ocr
+from deepdoc.vision.ocr import OCR, TextDetector, TextRecognizer
+
+CHARS = "abcdefghij"
+
+
+class FakeDetModel:
+    """Every dark pixel is text, pages are independent of each other as with the real model."""
+
+    def __init__(self, batch_dim="n"):
+        self.input = SimpleNamespace(name="x", shape=[batch_dim, 3, "h", "w"])
+        self.batch_sizes = []
+
+    def get_inputs(self):
+        return [self.input]
+
+    def run(self, output_names, input_dict, run_options=None):
+        x = input_dict["x"]
+        if isinstance(self.input.shape[0], int) and len(x) != self.input.shape[0]:
+            raise ValueError(f"Got invalid dimensions for input: x, got {len(x)} expected {self.input.shape[0]}")
+        self.batch_sizes.append(len(x))
+        return [(x.mean(axis=1, keepdims=True) < 0).astype(np.float32)]
+
+
+class FakeRecModel:
+    """Reads the character from the gray level of the first pixel of each crop."""
+
+    def __init__(self):
+        self.input = SimpleNamespace(name="x", shape=["n", 3, 48, "w"])
+        self.batch_sizes = []
+
+    def get_inputs(self):
+        return [self.input]
+
+    def run(self, output_names, input_dict, run_options=None):
+        x = input_dict["x"]
+        self.batch_sizes.append(len(x))
+        gray = np.rint((x[:, 0, 0, 0] * 0.5 + 0.5) * 255).astype(int)
+        preds = np.full((len(x), 1, len(CHARS) + 2), 0.01, dtype=np.float32)
+        preds[np.arange(len(x)), 0, gray // 20 + 1] = 0.9
+        return [preds]
+
+
+@pytest.fixture
+def models(tmp_path, monkeypatch):
+    (tmp_path / "ocr.res").write_text("\n".join(CHARS), encoding="utf-8")
+    det, rec = FakeDetModel(), FakeRecModel()
+    monkeypatch.setattr(ocr, "load_model", lambda model_dir, nm, device_id=None: (det if nm == "det" else rec, None))
+    monkeypatch.setenv("OCR_DET_BATCH_NUM", "2")
+    monkeypatch.setenv("OCR_REC_BATCH_NUM", "3")
+    engine = object.__new__(OCR)
+    engine.text_detector = [TextDetector(str(tmp_path))]
+    engine.text_recognizer = [TextRecognizer(str(tmp_path))]
+    engine.drop_score = 0.5
+    return engine, det, rec
+
+
+def page(h, w, lines, seed):
+    rng = np.random.default_rng(seed)
+    img = np.full((h, w, 3), 255, dtype=np.uint8)
+    for top in range(40, h - 40, 60)[:lines]:
+        left = int(rng.integers(20, w // 3))
+        img[top:top + 20, left:left + int(rng.integers(60, w - left - 20))] = 0
+    return img
+
+
+def crop(c, w):
+    return np.full((32, w, 3), CHARS.index(c) * 20, dtype=np.uint8)
+
+
+class TestBatchedDetection:
+
+    def test_same_as_page_by_page(self, models):
+        engine, det, _ = models
+        pages = [page(480, 360, 5, 0), page(480, 360, 3, 1), page(600, 400, 4, 2),
+                 page(480, 360, 6, 3), page(480, 360, 0, 4)]
+        batched = engine.detect_batch(pages)
+        assert det.batch_sizes == [2, 2, 1]
+        det.batch_sizes.clear()
+        for img, res in zip(pages, batched):
+            expected = list(engine.detect(img))
+            assert len(res) == len(expected)
+            for (box, text), (expected_box, expected_text) in zip(res, expected):
+                assert np.array_equal(box, expected_box)
+                assert text == expected_text
+        assert sum(len(res) for res in batched) == 18
+        assert det.batch_sizes == [1] * len(pages)
+
+    @pytest.mark.parametrize("batch_dim", [1, 4])
+    def test_fixed_batch_size(self, tmp_path, monkeypatch, batch_dim):
+        det = FakeDetModel(batch_dim=batch_dim)
+        monkeypatch.setattr(ocr, "load_model", lambda model_dir, nm, device_id=None: (det, None))
+        detector = TextDetector(str(tmp_path))
+        assert detector.det_batch_num == batch_dim
+        pages = [page(480, 360, lines, seed) for seed, lines in enumerate([2, 3, 1, 4, 5])]
+        boxes, _ = detector.batch(pages)
+        # the last, short batch is padded to the exported size
+        assert det.batch_sizes == [batch_dim] * -(-len(pages) // batch_dim)
+        assert [len(b) for b in boxes] == [2, 3, 1, 4, 5]
+
+
+class TestBatchedRecognition:
+
+    def test_same_as_page_by_page(self, models):
+        engine, _, rec = models
+        crops_per_page = [[crop("a", 40), crop("b", 200), crop("c", 90)],
+                          [],
+                          [crop("d", 300), crop("e", 20)],
+                          [crop("f", 120), crop("g", 60), crop("h", 500), crop("i", 80), crop("j", 45)]]
+        texts = engine.recognize_pages(crops_per_page)
+        assert texts == [["a", "b", "c"], [], ["d", "e"], ["f", "g", "h", "i", "j"]]
+        # 10 crops across page boundaries, 3 per model call
+        assert rec.batch_sizes == [3, 3, 3, 1]
+        assert texts == [engine.recognize_batch(crops) for crops in crops_per_page]
+
+    def test_no_crops(self, models):
+        engine, _, rec = models
+        assert engine.recognize_pages([[], []]) == [[], []]
+        assert rec.batch_sizes == []
@@ -0,0 +1,130 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import string
+import sys
+
+import datrie
+import pytest
+
+from rag.nlp import mmap_dict
+from rag.nlp.mmap_dict import MmapDict
+from rag.nlp.rag_tokenizer import RagTokenizer
+
+DICT = """公开 3000 v
+征求 2000 v
+意见 5000 n
+意见稿 800 n
+境外 1200 n
+投资者 2500 n
+投资 6000 v
+人民币 4000 n
+香港 5000 ns
+数据 8000 n
+分析 7000 v
+数据分析 900 n
+Python 700 nz
+c++ 300 nz
+"""
+
+
+@pytest.fixture
+def trie(tmp_path):
+    fnm = tmp_path / "huqie.txt"
+    fnm.write_text(DICT, encoding="utf-8")
+    trie = datrie.Trie(string.printable)
+    RagTokenizer()._load_dict(str(fnm), trie)
+    return trie
+
+
+@pytest.fixture
+def mdict(trie, tmp_path):
+    fnm = str(tmp_path / "huqie.txt.mmdict")
+    MmapDict.save(dict(trie.items()), fnm)
+    d = MmapDict(fnm)
+    yield d
+    d.close()
+
+
+class TestMmapDict:
+
+    def test_round_trip(self, trie, mdict):
+        assert len(mdict) == len(trie)
+        assert list(mdict.keys()) == sorted(trie.keys())
+        assert dict(mdict.items()) == dict(trie.items())
+        for k, v in trie.items():
+            assert k in mdict
+            assert mdict[k] == v
+        assert set(mdict.tags) == {"v", "n", "ns", "nz"}
+
+    def test_missing_keys(self, trie, mdict):
+        for k in ["", "zzz", trie.keys()[0][:-1], trie.keys()[-1] + "x"]:
+            assert (k in mdict) == (k in trie)
+            if k not in trie:
+                assert mdict.get(k) is None
+                with pytest.raises(KeyError):
+                    mdict[k]
+
+    def test_prefixes(self, trie, mdict):
+        prefixes = {k[:i] for k in trie.keys() for i in range(len(k) + 1)}
+        prefixes |= {p + "~" for p in prefixes} | {"", "zzz", "\\x"}
+        for p in sorted(prefixes):
+            assert mdict.has_keys_with_prefix(p) == trie.has_keys_with_prefix(p), p
+            # memoized lookups answer the same
+            assert mdict.has_keys_with_prefix(p) == trie.has_keys_with_prefix(p), p
+
+    def test_without_memo(self, trie, mdict, tmp_path):
+        d = MmapDict(str(tmp_path / "huqie.txt.mmdict"), cache_size=0)
+        assert dict(d.items()) == dict(mdict.items())
+        assert d.has_keys_with_prefix(trie.keys()[0][:2])
+        d.close()
+
+    def test_empty(self, tmp_path):
+        fnm = str(tmp_path / "empty.mmdict")
+        MmapDict.save({}, fnm)
+        d = MmapDict(fnm)
+        assert len(d) == 0
+        assert "a" not in d
+        assert not d.has_keys_with_prefix("")
+        d.close()
+
+    def test_rejects_other_files(self, tmp_path, mdict):
+        fnm = tmp_path / "other.mmdict"
+        fnm.write_bytes(b"not a dictionary at all")
+        with pytest.raises(ValueError):
+            MmapDict(str(fnm))
+        data = bytearray((tmp_path / "huqie.txt.mmdict").read_bytes())
+        data[len(mmap_dict.MAGIC)] = mmap_dict.VERSION + 1
+        fnm.write_bytes(bytes(data))
+        with pytest.raises(ValueError):
+            MmapDict(str(fnm))
+
+    def test_tokenizes_like_the_trie(self, trie, mdict):
+        with_trie, with_mmap = RagTokenizer(cache_size=0), RagTokenizer(cache_size=0)
+        with_trie.trie_, with_mmap.trie_ = trie, mdict
+        for txt in ["公开征求意见稿", "境外投资者使用人民币投资", "香港数据分析 Python c++ 2025", "未登录词"]:
+            tks = with_trie.tokenize(txt)
+            assert with_mmap.tokenize(txt) == tks
+            assert with_mmap.fine_grained_tokenize(tks) == with_trie.fine_grained_tokenize(tks)
+
+    def test_main_converts_trie_file(self, trie, tmp_path, monkeypatch):
+        src = str(tmp_path / "huqie.txt.trie")
+        trie.save(src)
+        monkeypatch.setattr(sys, "argv", ["mmap_dict", src])
+        mmap_dict.main()
+        d = MmapDict(str(tmp_path / "huqie.txt.mmdict"))
+        assert dict(d.items()) == dict(trie.items())
+        d.close()
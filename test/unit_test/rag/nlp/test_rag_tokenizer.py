@@ -0,0 +1,124 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import string
+
+import datrie
+import pytest
+
+from rag.nlp import rag_tokenizer
+from rag.nlp.rag_tokenizer import RagTokenizer
+from rag.nlp.tokenizer_benchmark import HEADERS, SAMPLES, build_corpus
+
+DICT = """公开 3000 v
+征求 2000 v
+意见 5000 n
+意见稿 800 n
+境外 1200 n
+投资者 2500 n
+投资 6000 v
+人民币 4000 n
+外汇 3000 n
+香港 5000 ns
+学区房 300 n
+小区 2000 n
+小学 2500 n
+初中 1500 n
+数据 8000 n
+分析 7000 v
+数据分析 900 n
+项目 6000 n
+经理 3000 n
+金额 1500 n
+备注 800 n
+第一章 500 m
+总则 300 n
+开发 4000 v
+工程师 2000 n
+"""
+
+TEXTS = SAMPLES + HEADERS + [
+    "ＡＢＣ全角 Ｔｅｓｔ １２３",
+    "Don't stop-believing: e-mail me at foo@bar.com, ok?",
+    "C++ / C# / .NET 8.0 -- v1.2.3",
+    "   ",
+    "",
+    "數據分析 項目經理",
+]
+
+
+def make_tokenizer(tmp_path, cache_size=rag_tokenizer.TOKENIZER_CACHE_SIZE, fast_path=True):
+    fnm = tmp_path / "dict.txt"
+    fnm.write_text(DICT, encoding="utf-8")
+    tknzr = RagTokenizer(cache_size=cache_size)
+    tknzr.ascii_fast_path = fast_path
+    tknzr.trie_ = datrie.Trie(string.printable)
+    tknzr._load_dict(str(fnm))
+    return tknzr
+
+
+@pytest.fixture
+def tokenizers(tmp_path):
+    return make_tokenizer(tmp_path, cache_size=0, fast_path=False), make_tokenizer(tmp_path)
+
+
+class TestRagTokenizerCache:
+
+    def test_same_as_plain_path(self, tokenizers):
+        plain, cached = tokenizers
+        corpus = TEXTS + build_corpus(100)
+        for _ in range(2):
+            for txt in corpus:
+                tks = plain.tokenize(txt)
+                assert cached.tokenize(txt) == tks, txt
+                assert cached.fine_grained_tokenize(tks) == plain.fine_grained_tokenize(tks), txt
+        assert cached._tokenize_cached.cache_info().hits > 0
+
+    def test_ascii_fast_path(self, tmp_path):
+        plain = make_tokenizer(tmp_path, cache_size=0, fast_path=False)
+        fast = make_tokenizer(tmp_path, cache_size=0)
+        texts = [t for t in TEXTS + build_corpus(100) if t.isascii()]
+        assert len(texts) > 10
+        for txt in texts:
+            assert fast.tokenize(txt) == plain.tokenize(txt), txt
+
+    def test_tokenize_many(self, tokenizers):
+        plain, cached = tokenizers
+        texts = ["Table of Contents", "项目 | 金额 | 备注", "Table of Contents", "项目 | 金额 | 备注", "第一章 总则"]
+        assert cached.tokenize_many(texts) == [plain.tokenize(t) for t in texts]
+        info = cached._tokenize_cached.cache_info()
+        assert (info.hits, info.misses) == (0, 3)
+
+    def test_long_texts_not_cached(self, tokenizers, monkeypatch):
+        plain, cached = tokenizers
+        monkeypatch.setattr(rag_tokenizer, "TOKENIZER_CACHE_MAX_LEN", 20)
+        long_txt = SAMPLES[0]
+        assert cached.tokenize(long_txt) == plain.tokenize(long_txt)
+        assert cached._tokenize_cached.cache_info().currsize == 0
+        cached.tokenize("第一章 总则")
+        assert cached._tokenize_cached.cache_info().currsize == 1
+
+    def test_cache_cleared_when_dictionary_changes(self, tokenizers, tmp_path):
+        _, cached = tokenizers
+        txt = "境外投资者使用外汇资金兑换"
+        before = cached.tokenize(txt)
+        user_dict = tmp_path / "user.txt"
+        user_dict.write_text("外汇资金 9000 n\n", encoding="utf-8")
+        cached.add_user_dict(str(user_dict))
+        assert cached._tokenize_cached.cache_info().currsize == 0
+        after = cached.tokenize(txt)
+        assert after != before
+        assert "外汇资金" in after.split()
@@ -0,0 +1,157 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import json
+import random
+
+import numpy as np
+import pytest
+from sklearn.metrics.pairwise import cosine_similarity
+
+from common.constants import PAGERANK_FLD
+from common.float_utils import get_float
+from rag.nlp import rerank_kernel
+from rag.nlp.query import FulltextQueryer
+
+DIM = 16
+TAGS = [f"tag{i}" for i in range(8)]
+
+
+def legacy_vectors(vectors):
+    """Dealer.rerank before the kernels."""
+    zero_vector = [0.0] * DIM
+    ins_embd = []
+    for vector in vectors:
+        vector = zero_vector if vector is None else vector
+        if isinstance(vector, str):
+            vector = [get_float(v) for v in vector.split("\t")]
+        ins_embd.append(vector)
+    return ins_embd
+
+
+def legacy_rank_features(query_rfea, tag_feas, pageranks):
+    """Dealer._rank_feature_scores before the kernels."""
+    pageranks = np.array(pageranks, dtype=float)
+    if not query_rfea:
+        return np.array([0 for _ in range(len(tag_feas))]) + pageranks
+    q_denor = np.sqrt(np.sum([s * s for t, s in query_rfea.items() if t != PAGERANK_FLD]))
+    rank_fea = []
+    for tag_fea in tag_feas:
+        nor, denor = 0, 0
+        if not tag_fea:
+            rank_fea.append(0)
+            continue
+        for t, sc in eval(tag_fea).items():
+            if t in query_rfea:
+                nor += query_rfea[t] * sc
+            denor += sc * sc
+        if denor == 0:
+            rank_fea.append(0)
+        else:
+            rank_fea.append(nor / np.sqrt(denor) / q_denor)
+    return np.array(rank_fea) * 10. + pageranks
+
+
+@pytest.fixture
+def rnd():
+    return random.Random(0)
+
+
+def random_vectors(rnd, n, fmt):
+    rows = np.random.default_rng(rnd.randint(0, 100)).standard_normal((n, DIM)).astype(np.float32)
+    vectors = []
+    for i, row in enumerate(rows):
+        if i % 7 == 3:
+            vectors.append(None)
+        elif i % 7 == 5:
+            vectors.append([0.0] * DIM)
+        elif fmt == "str":
+            vectors.append("\t".join(f"{v:.6f}" for v in row))
+        else:
+            vectors.append(row.tolist())
+    return vectors
+
+
+class TestRerankKernel:
+
+    @pytest.mark.parametrize("fmt", ["list", "str"])
+    def test_vectors_and_cosine(self, rnd, fmt):
+        vectors = random_vectors(rnd, 50, fmt)
+        qv = np.random.default_rng(1).standard_normal(DIM).tolist()
+        mat = rerank_kernel.decode_vectors(vectors, DIM)
+        assert mat.dtype == np.float32 and mat.shape == (50, DIM)
+        np.testing.assert_allclose(mat, np.array(legacy_vectors(vectors), dtype=np.float32))
+        scores = rerank_kernel.cosine_scores(qv, mat)
+        assert scores.dtype == np.float64
+        np.testing.assert_allclose(scores, cosine_similarity([qv], legacy_vectors(vectors))[0], atol=1e-6)
+
+    def test_malformed_values(self):
+        mat = rerank_kernel.decode_vectors(["1\tfoo\t3"], 3)
+        assert mat[0].tolist() == [1., get_float("foo"), 3.]
+
+    def test_zero_query_and_no_candidates(self):
+        assert rerank_kernel.cosine_scores([0.] * DIM, np.ones((3, DIM), dtype=np.float32)).tolist() == [0., 0., 0.]
+        assert len(rerank_kernel.cosine_scores([1.] * DIM, rerank_kernel.decode_vectors([], DIM))) == 0
+        assert len(rerank_kernel.token_scores({"a": 1.}, [])) == 0
+        assert len(rerank_kernel.rank_feature_scores({"tag0": 1}, [], [])) == 0
+
+    def test_token_scores(self, rnd):
+        vocab = [f"tk{i}" for i in range(30)]
+        qtw = {t: rnd.random() for t in rnd.sample(vocab, 6)}
+        token_sets = [set(rnd.sample(vocab, rnd.randint(0, 10))) for _ in range(40)]
+        qryr = FulltextQueryer()
+        np.testing.assert_allclose(rerank_kernel.token_scores(qtw, token_sets),
+                                   [qryr.similarity(qtw, tks) for tks in token_sets])
+        assert rerank_kernel.token_scores({}, [{"a"}]).tolist() == [1.]
+
+    def test_hybrid_scores(self):
+        tksim = [.1, .5, .9]
+        np.testing.assert_allclose(rerank_kernel.hybrid_scores(np.array([.2, .4, .6]), tksim), [.17, .43, .69])
+        # without any vector similarity the token similarity is all there is
+        assert rerank_kernel.hybrid_scores(np.zeros(3), tksim).tolist() == tksim
+
+    def test_rank_feature_scores(self, rnd):
+        tag_feas = []
+        for i in range(60):
+            if i % 5 == 0:
+                tag_feas.append("")
+            elif i % 11 == 0:
+                tag_feas.append(str({TAGS[0]: 0}))
+            else:
+                tag_feas.append(str({t: rnd.randint(1, 10) for t in rnd.sample(TAGS, rnd.randint(1, 4))}))
+        pageranks = [rnd.choice([0, 0, 10]) for _ in tag_feas]
+        for query_rfea in [{t: rnd.randint(1, 5) for t in rnd.sample(TAGS, 3)},
+                           {TAGS[1]: 2, PAGERANK_FLD: 10},
+                           {"unknown": 1},
+                           None]:
+            np.testing.assert_allclose(rerank_kernel.rank_feature_scores(query_rfea, tag_feas, pageranks),
+                                       legacy_rank_features(query_rfea, tag_feas, pageranks))
+
+    def test_rank_feature_pagerank_only_query(self):
+        # the legacy scoring divided by a zero query norm and returned NaN for tagged chunks
+        scores = rerank_kernel.rank_feature_scores({PAGERANK_FLD: 10}, [str({"tag0": 3}), ""], [10, 0])
+        assert scores.tolist() == [10., 0.]
+
+    @pytest.mark.parametrize("v", [{"tag0": 3, "tag1": 4},
+                                   json.dumps({"tag0": 3, "tag1": 4}),
+                                   str({"tag0": 3, "tag1": 4}),
+                                   "{'tag0': 3, 'tag1': 4}"])
+    def test_parse_tag_features(self, v):
+        assert rerank_kernel.parse_tag_features(v) == {"tag0": 3, "tag1": 4}
+
+    @pytest.mark.parametrize("v", [None, "", "{not python", "__import__('os')"])
+    def test_parse_tag_features_invalid(self, v):
+        assert rerank_kernel.parse_tag_features(v) == {}
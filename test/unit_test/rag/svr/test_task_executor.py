@@ -0,0 +1,484 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import threading
+from datetime import datetime
+
+import exceptiongroup
+import numpy as np
+import pytest
+import trio
+
+from common import settings
+from graphrag import utils as graphrag_utils
+from graphrag.utils import get_llm_cache, set_llm_cache
+from rag.svr import task_executor
+from rag.svr.task_executor import ProgressAggregator, drain_batches, insert_es, run_llm_with_cache, stream_embedding_and_insert
+
+
+class FakeDocStore:
+    """Records every bulk, fails the bulks containing one of `failing` ids."""
+
+    def __init__(self, events, failing=()):
+        self.events = events
+        self.failing = set(failing)
+        self.indexed = {}
+        self.deleted = []
+
+    def insert(self, docs, index_name, kb_id):
+        ids = [d["id"] for d in docs]
+        self.events.append(("insert", ids))
+        if self.failing & set(ids):
+            return ["boom"]
+        self.indexed.update({d["id"]: dict(d) for d in docs})
+        return []
+
+    def delete(self, condition, index_name, kb_id):
+        self.deleted.extend(condition["id"])
+        for chunk_id in condition["id"]:
+            self.indexed.pop(chunk_id, None)
+
+
+class FakeRedis:
+    """Strings in, strings out, like the decoding client of RedisDB."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, k):
+        return self.data.get(k)
+
+    def set(self, k, v, exp=3600):
+        self.data[k] = v.decode("utf-8") if isinstance(v, bytes) else v
+        return True
+
+    def mget(self, keys, binary=False):
+        return [self.data.get(k) for k in keys]
+
+    def mset(self, mapping, exp=3600, binary=False, nx=False):
+        for k, v in mapping.items():
+            self.set(k, v, exp)
+        return True
+
+
+class FakeStorage:
+
+    def delete(self, bucket, name):
+        pass
+
+
+class FakeEmbedding:
+    llm_name = "fake-embedding"
+    max_length = 512
+
+    def encode(self, texts):
+        return np.array([[float(len(t)), 1.0] for t in texts]), len(texts)
+
+
+class Progress:
+
+    def __init__(self):
+        self.progs = []
+        self.failures = []
+
+    def __call__(self, prog=None, msg=""):
+        if prog is not None and prog < 0:
+            self.failures.append(msg)
+        elif prog is not None:
+            self.progs.append(prog)
+
+
+def unwrap(e):
+    while isinstance(e, exceptiongroup.BaseExceptionGroup):
+        e = e.exceptions[0]
+    return e
+
+
+@pytest.fixture
+def env(monkeypatch):
+    events, recorded = [], {}
+
+    class FakeTaskService:
+        @staticmethod
+        def append_chunk_ids(task_id, chunk_ids):
+            # a database call, must not run on the trio loop
+            assert threading.current_thread() is not threading.main_thread()
+            recorded.setdefault(task_id, []).extend(chunk_ids.split())
+            events.append(("record", chunk_ids.split()))
+
+        @staticmethod
+        def update_chunk_ids(task_id, chunk_ids):
+            assert threading.current_thread() is not threading.main_thread()
+            recorded[task_id] = chunk_ids.split()
+            events.append(("rewrite", chunk_ids.split()))
+
+    store = FakeDocStore(events)
+    monkeypatch.setattr(settings, "docStoreConn", store)
+    monkeypatch.setattr(settings, "STORAGE_IMPL", FakeStorage())
+    monkeypatch.setattr(settings, "DOC_BULK_SIZE", 2)
+    monkeypatch.setattr(settings, "EMBEDDING_BATCH_SIZE", 4)
+    monkeypatch.setattr(task_executor, "TaskService", FakeTaskService)
+    monkeypatch.setattr(task_executor, "has_canceled", lambda task_id: False)
+    monkeypatch.setattr(task_executor, "MAX_CONCURRENT_DOC_BULK", 1)
+    return store, events, recorded
+
+
+def raw_chunks(n):
+    return [{"content_with_weight": f"chunk {i}", "docnm_kwd": "doc.txt"} for i in range(n)]
+
+
+def fake_enrich(events):
+    async def enrich_chunks(task, cks, progress_callback):
+        events.append(("enrich", [ck["content_with_weight"] for ck in cks]))
+        return [dict(ck, id=f"id{ck['content_with_weight'].split()[1]}", doc_id=task["doc_id"]) for ck in cks]
+    return enrich_chunks
+
+
+TASK = {"id": "t1", "tenant_id": "tenant", "kb_id": "kb", "doc_id": "d1", "parser_config": {}}
+
+
+class TestDrainBatches:
+
+    def test_batches_and_releases(self):
+        items = list(range(7))
+        batches = drain_batches(items, 3)
+        assert next(batches) == [0, 1, 2]
+        assert len(items) == 4
+        assert list(batches) == [[3, 4, 5], [6]]
+        assert items == []
+
+
+class TestInsertEs:
+
+    def test_ids_recorded_before_each_bulk(self, env):
+        store, events, recorded = env
+        chunks = [{"id": f"id{i}"} for i in range(5)]
+        assert trio.run(insert_es, "t1", "tenant", "kb", chunks, Progress())
+        # bulks may be sent in any order, but each one after its ids were recorded
+        assert [kind for kind, _ in events] == ["record", "insert"] * 3
+        # only the ids of the bulk are written, not all ids so far
+        for (_, recorded_ids), (_, inserted_ids) in zip(events[::2], events[1::2]):
+            assert recorded_ids == inserted_ids
+        assert sorted(recorded["t1"]) == [f"id{i}" for i in range(5)]
+
+    def test_appends_to_indexed_ids(self, env):
+        store, events, recorded = env
+        indexed_ids = ["id0", "id1"]
+        recorded["t1"] = ["id0", "id1"]
+        assert trio.run(insert_es, "t1", "tenant", "kb", [{"id": "toc"}], Progress(), indexed_ids)
+        assert recorded["t1"] == indexed_ids == ["id0", "id1", "toc"]
+        assert events == [("record", ["toc"]), ("insert", ["toc"])]
+
+    def test_failed_bulk_rolled_back_alone(self, env):
+        store, events, recorded = env
+        store.failing = {"id2"}
+        progress = Progress()
+        chunks = [{"id": f"id{i}"} for i in range(6)]
+        indexed_ids = []
+        with pytest.raises(Exception) as e:
+            trio.run(insert_es, "t1", "tenant", "kb", chunks, progress, indexed_ids)
+        assert "Insert chunk error" in str(unwrap(e.value))
+        assert store.deleted == ["id2", "id3"]
+        assert not {"id2", "id3"} & set(store.indexed)
+        # the task's chunk_ids are rewritten once, without the rolled back bulk
+        assert [kind for kind, _ in events].count("rewrite") == 1
+        assert sorted(recorded["t1"]) == sorted(indexed_ids) == sorted(store.indexed)
+        assert progress.failures
+
+
+class TestStreamEmbeddingAndInsert:
+
+    def test_streams_enrichment_and_indexing(self, env, monkeypatch):
+        store, events, recorded = env
+        monkeypatch.setattr(task_executor, "enrich_chunks", fake_enrich(events))
+        monkeypatch.setattr(task_executor, "STREAMING_INDEX_BUFFER", 1)
+        cks, progress, indexed_ids = raw_chunks(40), Progress(), []
+        tk_count, vector_size, succeeded, chunks = trio.run(
+            stream_embedding_and_insert, TASK, cks, FakeEmbedding(), progress, False, indexed_ids)
+
+        assert succeeded and vector_size == 2
+        # the title plus every chunk
+        assert tk_count == 41
+        assert cks == [] and chunks == []
+        assert sorted(store.indexed) == sorted(f"id{i}" for i in range(40))
+        assert sorted(recorded["t1"]) == sorted(store.indexed)
+        assert sorted(indexed_ids) == sorted(store.indexed)
+        assert all("q_2_vec" in d for d in store.indexed.values())
+        # the first batch is indexed before the last one is enriched
+        kinds = [kind for kind, _ in events]
+        assert kinds.index("insert") < len(kinds) - 1 - kinds[::-1].index("enrich")
+        # progress is reported while embedding and indexing, and never goes back
+        assert progress.progs == sorted(progress.progs)
+        assert progress.progs[-1] == pytest.approx(0.9)
+        assert len(progress.progs) >= 6
+
+    def test_keeps_chunks_for_toc(self, env, monkeypatch):
+        store, events, recorded = env
+        monkeypatch.setattr(task_executor, "enrich_chunks", fake_enrich(events))
+        _, _, succeeded, chunks = trio.run(stream_embedding_and_insert, TASK, raw_chunks(5), FakeEmbedding(), Progress(), True)
+        assert succeeded
+        assert sorted(d["id"] for d in chunks) == sorted(store.indexed)
+        assert all(len(d["q_2_vec"]) == 2 for d in chunks)
+
+    def test_same_documents_as_batch_path(self, env, monkeypatch):
+        store, events, recorded = env
+        monkeypatch.setattr(task_executor, "enrich_chunks", fake_enrich(events))
+        trio.run(stream_embedding_and_insert, TASK, raw_chunks(7), FakeEmbedding(), Progress())
+        streamed = store.indexed
+
+        batch_store = FakeDocStore([])
+        monkeypatch.setattr(settings, "docStoreConn", batch_store)
+
+        async def batch_path():
+            docs = await task_executor.enrich_chunks(TASK, raw_chunks(7), Progress())
+            await task_executor.embedding(docs, FakeEmbedding(), {}, Progress())
+            await insert_es("t1", "tenant", "kb", docs, Progress())
+
+        trio.run(batch_path)
+        assert streamed.keys() == batch_store.indexed.keys()
+        for chunk_id, d in streamed.items():
+            np.testing.assert_allclose(d["q_2_vec"], batch_store.indexed[chunk_id]["q_2_vec"])
+
+    def test_failure_keeps_earlier_batches_recorded(self, env, monkeypatch):
+        store, events, recorded = env
+        monkeypatch.setattr(task_executor, "enrich_chunks", fake_enrich(events))
+        store.failing = {"id6"}
+        with pytest.raises(Exception):
+            trio.run(stream_embedding_and_insert, TASK, raw_chunks(10), FakeEmbedding(), Progress())
+        assert "id6" not in store.indexed
+        assert store.indexed
+        assert set(store.indexed) == set(recorded["t1"])
+
+
+class TestRaptorForKb:
+
+    @pytest.fixture
+    def fake_raptor(self, env, monkeypatch):
+        store, events, recorded = env
+        seen = []
+
+        class FakeRetriever:
+            def chunk_lists(self, doc_ids, tenant_id, kb_ids, fields=None, sort_by_position=False):
+                return {doc_id: [
+                    {"content_with_weight": f"{doc_id} chunk", "q_2_vec": [1., 0.]},
+                    {"content_with_weight": "old summary", "q_2_vec": [0., 1.], "raptor_kwd": "raptor"},
+                ] for doc_id in doc_ids}
+
+        class FakeRaptor:
+            def __init__(self, *args, **kwargs):
+                pass
+
+            async def incremental(self, chunks, tree, random_state, callback=None, task_id=""):
+                seen.append([s for s, _ in chunks])
+                return [("new summary", np.array([1., 1.]))], {"layers": [[{"summary": "new summary"}]]}
+
+        monkeypatch.setattr(settings, "retriever", FakeRetriever())
+        monkeypatch.setattr(task_executor, "Raptor", FakeRaptor)
+        monkeypatch.setattr(task_executor, "load_raptor_tree", lambda kb_id, doc_id: {"layers": [[{"summary": "old summary"}]]})
+        monkeypatch.setattr(task_executor, "save_raptor_tree", lambda kb_id, doc_id, tree: events.append(("save_tree", doc_id)))
+        return store, events, seen
+
+    def test_summaries_are_not_fed_back(self, fake_raptor):
+        store, events, seen = fake_raptor
+        row = {"id": "t1", "tenant_id": "tenant", "kb_id": "kb", "name": "doc.txt", "pagerank": 0}
+        kb_parser_config = {"raptor": {"prompt": "{cluster_content}", "max_token": 256, "threshold": 0.1,
+                                       "random_seed": 0, "scope": "file", "incremental": 1}}
+        res, _, trees = trio.run(task_executor.run_raptor_for_kb, row, kb_parser_config, None, None, 2, Progress(), ["d1", "d2"])
+        assert seen == [["d1 chunk"], ["d2 chunk"]]
+        assert [d["content_with_weight"] for d in res] == ["new summary", "new summary"]
+        # nothing is saved or deleted before the new summaries are indexed
+        assert events == [] and store.deleted == []
+
+        trio.run(task_executor.save_raptor_trees, row, trees)
+        assert [e for e in events if e[0] == "save_tree"] == [("save_tree", "d1"), ("save_tree", "d2")]
+        assert len(store.deleted) == 2
+
+
+class TestRunLlmWithCache:
+
+    @staticmethod
+    def docs():
+        return [{"content_with_weight": t} for t in ["alpha", "beta", "gamma", "alpha", "", "delta"]]
+
+    @staticmethod
+    def generate(calls):
+        def gen(d):
+            calls.append(d["content_with_weight"])
+            return d["content_with_weight"].upper() if d["content_with_weight"] != "delta" else ""
+        return gen
+
+    async def per_doc(self, docs, history, genconf, generate):
+        """The per-chunk loop run_llm_with_cache replaced."""
+        results = [None] * len(docs)
+
+        async def one(i, d):
+            cached = get_llm_cache("llm", d["content_with_weight"], history, genconf)
+            if not cached:
+                cached = await trio.to_thread.run_sync(lambda: generate(d))
+                set_llm_cache("llm", d["content_with_weight"], cached, history, genconf)
+            results[i] = cached or None
+
+        async with trio.open_nursery() as nursery:
+            for i, d in enumerate(docs):
+                nursery.start_soon(one, i, d)
+        return results
+
+    def test_same_as_per_doc(self, monkeypatch):
+        stores = []
+        for run in ("per_doc", "batch"):
+            redis = FakeRedis()
+            monkeypatch.setattr(graphrag_utils, "REDIS_CONN", redis)
+            set_llm_cache("llm", "beta", "cached beta", "keywords", {"topn": 3})
+            calls = []
+            if run == "per_doc":
+                results = trio.run(self.per_doc, self.docs(), "keywords", {"topn": 3}, self.generate(calls))
+            else:
+                results = trio.run(run_llm_with_cache, "llm", self.docs(), "keywords", {"topn": 3}, self.generate(calls))
+            stores.append((results, sorted(calls), {k: v for k, v in redis.data.items() if v}))
+        assert stores[0] == stores[1]
+        results, calls, _ = stores[1]
+        assert results == ["ALPHA", "cached beta", "GAMMA", "ALPHA", None, None]
+        assert calls == ["", "alpha", "alpha", "delta", "gamma"]
+
+    def test_hits_skip_generation(self, monkeypatch):
+        monkeypatch.setattr(graphrag_utils, "REDIS_CONN", FakeRedis())
+        calls = []
+        trio.run(run_llm_with_cache, "llm", self.docs(), "question", {"topn": 2}, self.generate(calls))
+        calls.clear()
+        results = trio.run(run_llm_with_cache, "llm", self.docs(), "question", {"topn": 2}, self.generate(calls))
+        assert results[:4] == ["ALPHA", "BETA", "GAMMA", "ALPHA"]
+        # empty results are not cached and asked again
+        assert sorted(calls) == ["", "delta"]
+
+    def test_key_includes_settings(self, monkeypatch):
+        monkeypatch.setattr(graphrag_utils, "REDIS_CONN", FakeRedis())
+        trio.run(run_llm_with_cache, "llm", self.docs(), "keywords", {"topn": 3}, self.generate([]))
+        calls = []
+        trio.run(run_llm_with_cache, "llm", self.docs(), "keywords", {"topn": 5}, self.generate(calls))
+        trio.run(run_llm_with_cache, "other", self.docs(), "keywords", {"topn": 3}, self.generate(calls))
+        assert len(calls) == 2 * len(self.docs())
+
+    def test_results_kept_when_a_generation_fails(self, monkeypatch):
+        redis = FakeRedis()
+        monkeypatch.setattr(graphrag_utils, "REDIS_CONN", redis)
+
+        done = []
+
+        def generate(d):
+            if d["content_with_weight"] == "gamma":
+                raise RuntimeError("LLM down")
+            done.append(d["content_with_weight"])
+            return d["content_with_weight"].upper()
+
+        with pytest.raises(Exception):
+            trio.run(run_llm_with_cache, "llm", self.docs(), "keywords", {}, generate)
+        # generations that were not cancelled by the failure are all written back
+        for txt in done:
+            if txt:
+                assert get_llm_cache("llm", txt, "keywords", {}) == txt.upper()
+        assert get_llm_cache("llm", "gamma", "keywords", {}) is None
+
+
+class TestProgressAggregator:
+
+    class Task:
+        """Applies the update rules of TaskService.update_progress."""
+
+        def __init__(self):
+            self.progress, self.msgs, self.writes = 0, [], 0
+
+        def update_progress(self, task_id, info):
+            self.writes += 1
+            if info["progress_msg"]:
+                self.msgs.extend(info["progress_msg"].split("\n"))
+            prog = info.get("progress")
+            if prog is not None and self.progress != -1 and (prog == -1 or prog > self.progress):
+                self.progress = prog
+
+    @pytest.fixture
+    def clock(self, monkeypatch):
+        now = [100.]
+
+        class FixedDatetime:
+            @staticmethod
+            def now():
+                return datetime(2025, 1, 1, 12, 0, 0)
+
+        monkeypatch.setattr(task_executor, "timer", lambda: now[0])
+        monkeypatch.setattr(task_executor, "datetime", FixedDatetime)
+        monkeypatch.setattr(task_executor, "close_connection", lambda: None)
+        monkeypatch.setattr(task_executor, "PROGRESS_FLUSH_INTERVAL", 1.)
+        return now
+
+    def run(self, monkeypatch, calls, use_aggregator, canceled_after=None, clock=None, step=.3):
+        task, lookups = self.Task(), []
+
+        def has_canceled(task_id):
+            lookups.append(task_id)
+            return canceled_after is not None and len(lookups) > canceled_after
+
+        monkeypatch.setattr(task_executor, "TaskService", task)
+        monkeypatch.setattr(task_executor, "has_canceled", has_canceled)
+        callback = ProgressAggregator("t1", 0, 9) if use_aggregator else \
+            lambda prog=None, msg="Processing...": task_executor.set_progress("t1", 0, 9, prog, msg)
+        for prog, msg in calls:
+            if clock:
+                clock[0] += step
+            callback(prog, msg)
+        if use_aggregator:
+            callback.flush()
+        return task, lookups
+
+    CALLS = [(None, "Start to parse."), (.1, "Page 1"), (.05, ""), (.3, "Page 2"), (None, "Embedding"),
+             (.8, ""), (-1, "Oops"), (.9, "Late")]
+
+    def test_same_as_set_progress(self, monkeypatch, clock):
+        old, _ = self.run(monkeypatch, self.CALLS, False)
+        new, _ = self.run(monkeypatch, self.CALLS, True, clock=clock)
+        assert (new.progress, new.msgs) == (old.progress, old.msgs)
+        assert old.progress == -1
+        assert old.msgs[0] == "12:00:00 Page(1~10): Start to parse."
+        assert new.writes < old.writes
+
+    def test_coalesces_writes(self, monkeypatch, clock):
+        calls = [(i / 100, f"chunk {i}") for i in range(50)]
+        task, lookups = self.run(monkeypatch, calls, True)
+        # the clock stands still: one write for the first call, one for the final flush
+        assert task.writes == 2
+        assert len(lookups) == 1
+        assert task.progress == .49
+        assert len(task.msgs) == 50
+
+    def test_writes_right_away_when_done_or_failed(self, monkeypatch, clock):
+        task = self.Task()
+        monkeypatch.setattr(task_executor, "TaskService", task)
+        monkeypatch.setattr(task_executor, "has_canceled", lambda task_id: False)
+        callback = ProgressAggregator("t1")
+        callback(.1, "first")
+        callback(.2, "buffered")
+        assert (task.writes, task.progress) == (1, .1)
+        callback(1., "Done!")
+        assert (task.writes, task.progress) == (2, 1.)
+        assert task.msgs[-1].endswith("Done!")
+
+    def test_cancel(self, monkeypatch, clock):
+        calls = [(.1, "a"), (.2, "b"), (.3, "c"), (.4, "d")]
+        old, _ = self.run(monkeypatch, calls, False, canceled_after=2)
+        new, lookups = self.run(monkeypatch, calls, True, canceled_after=1, clock=clock, step=.6)
+        assert new.progress == old.progress == -1
+        assert new.msgs[-1].endswith("[Canceled]")
+        # looked up at most once per interval, never again once canceled
+        assert len(lookups) == 2
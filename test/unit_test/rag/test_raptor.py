@@ -0,0 +1,154 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import numpy as np
+import pytest
+import trio
+
+from rag import raptor as raptor_module
+from rag.raptor import RecursiveAbstractiveProcessing4TreeOrganizedRetrieval as Raptor
+from rag.raptor import _node_key, raptor_tree_summaries
+
+DIM = 4
+
+
+def topic_vec(topic, noise=0.):
+    v = np.full(DIM, noise)
+    v[topic] = 1.
+    return v
+
+
+class FakeLLM:
+    llm_name = "fake-llm"
+    max_length = 8192
+
+    def __init__(self):
+        self.calls = []
+
+    def chat(self, system, history, gen_conf):
+        content = history[0]["content"]
+        self.calls.append(content)
+        return "summary of " + " | ".join(sorted(content.split("\n")))
+
+
+class FakeEmbedding:
+    """Every summary lands on the last topic, so the second layer collapses into one cluster."""
+    llm_name = "fake-embedding"
+
+    def encode(self, texts):
+        return np.array([topic_vec(DIM - 1) for _ in texts]), len(texts)
+
+
+def cluster_by_topic(embeddings, random_state, task_id=""):
+    topics = [int(np.argmax(e)) for e in embeddings]
+    order = sorted(set(topics))
+    return len(order), [order.index(t) for t in topics]
+
+
+@pytest.fixture
+def raptor(monkeypatch):
+    monkeypatch.setattr(raptor_module, "get_llm_cache", lambda *args: None)
+    monkeypatch.setattr(raptor_module, "set_llm_cache", lambda *args: None)
+    monkeypatch.setattr(raptor_module, "get_embed_cache", lambda *args: None)
+    monkeypatch.setattr(raptor_module, "set_embed_cache", lambda *args: None)
+    r = Raptor(64, FakeLLM(), FakeEmbedding(), "{cluster_content}", max_token=256)
+    monkeypatch.setattr(r, "_cluster", cluster_by_topic)
+    return r
+
+
+def nodes_of(chunks):
+    return {_node_key(s): (s, np.asarray(a)) for s, a in chunks}
+
+
+def chunks_of(spec):
+    """[(text, topic)] -> chunks with a little noise so that members are not identical."""
+    return [(text, topic_vec(topic, 0.01 * i)) for i, (text, topic) in enumerate(spec)]
+
+
+SPEC = [("a1", 0), ("a2", 0), ("b1", 1), ("b2", 1), ("c1", 2), ("c2", 2)]
+
+
+class TestRegroup:
+
+    def test_without_previous_clusters(self, raptor):
+        nodes = nodes_of(chunks_of(SPEC))
+        groups = raptor._regroup(nodes, [], 0)
+        assert sorted(sorted(nodes[k][0] for k in g) for g in groups) == [["a1", "a2"], ["b1", "b2"], ["c1", "c2"]]
+
+    def test_unchanged_clusters_are_kept(self, raptor, monkeypatch):
+        nodes = nodes_of(chunks_of(SPEC))
+        keys = list(nodes)
+        # previous clusters the topic clustering would not produce
+        prev = [{"members": [keys[0], keys[2]]}, {"members": [keys[1], keys[3]]}, {"members": [keys[4], keys[5]]}]
+        monkeypatch.setattr(raptor, "_cluster", lambda *args, **kwargs: pytest.fail("nothing to cluster"))
+        assert raptor._regroup(nodes, prev, 0) == [c["members"] for c in prev]
+
+    def test_new_node_joins_nearest_cluster(self, raptor):
+        old = chunks_of(SPEC)
+        keys = list(nodes_of(old))
+        prev = [{"members": keys[0:2]}, {"members": keys[2:4]}, {"members": keys[4:6]}]
+        nodes = nodes_of(old[:3] + [("b3", topic_vec(1))] + old[4:])
+        groups = raptor._regroup(nodes, prev, 0)
+        assert groups[0] == keys[0:2] and groups[2] == keys[4:6]
+        assert sorted(nodes[k][0] for k in groups[1]) == ["b1", "b3"]
+
+    def test_far_nodes_are_clustered_among_themselves(self, raptor, monkeypatch):
+        monkeypatch.setattr(raptor_module, "RAPTOR_ASSIGN_THRESHOLD", 0.9)
+        old = chunks_of(SPEC[:4])
+        keys = list(nodes_of(old))
+        prev = [{"members": keys[0:2]}, {"members": keys[2:4]}]
+        nodes = nodes_of(old + [("c1", topic_vec(2)), ("c2", topic_vec(2, 0.01))])
+        groups = raptor._regroup(nodes, prev, 0)
+        assert groups[:2] == [keys[0:2], keys[2:4]]
+        assert [sorted(nodes[k][0] for k in g) for g in groups[2:]] == [["c1", "c2"]]
+
+
+class TestIncremental:
+
+    def test_matches_a_full_build(self, raptor):
+        summaries, tree = trio.run(raptor.incremental, chunks_of(SPEC), None, 0)
+        assert len(raptor._llm_model.calls) == 4
+        assert [len(layer) for layer in tree["layers"]] == [3, 1]
+        assert {s for s, _ in summaries} == raptor_tree_summaries(tree)
+        assert "summary of a1 | a2" in raptor_tree_summaries(tree)
+
+    def test_reuses_unchanged_clusters(self, raptor):
+        _, tree = trio.run(raptor.incremental, chunks_of(SPEC), None, 0)
+        raptor._llm_model.calls.clear()
+
+        spec = [(t, topic) if t != "b2" else ("b2 edited", topic) for t, topic in SPEC]
+        summaries, new_tree = trio.run(raptor.incremental, chunks_of(spec), tree, 0)
+        # the changed cluster and the root, nothing else
+        assert len(raptor._llm_model.calls) == 2
+        assert new_tree["layers"][0][0] == tree["layers"][0][0]
+        assert new_tree["layers"][0][2] == tree["layers"][0][2]
+        assert "summary of b1 | b2 edited" in raptor_tree_summaries(new_tree)
+        assert raptor_tree_summaries(tree) - {s for s, _ in summaries} == {
+            "summary of b1 | b2", tree["layers"][1][0]["summary"]}
+
+    def test_unchanged_chunks_need_no_llm(self, raptor):
+        summaries, tree = trio.run(raptor.incremental, chunks_of(SPEC), None, 0)
+        raptor._llm_model.calls.clear()
+        again, same_tree = trio.run(raptor.incremental, chunks_of(SPEC), tree, 0)
+        assert raptor._llm_model.calls == []
+        assert same_tree == tree
+        assert [s for s, _ in again] == [s for s, _ in summaries]
+
+    def test_other_settings_rebuild(self, raptor):
+        _, tree = trio.run(raptor.incremental, chunks_of(SPEC), None, 0)
+        raptor._llm_model.calls.clear()
+        trio.run(raptor.incremental, chunks_of(SPEC), tree, 1)
+        assert len(raptor._llm_model.calls) == 4
@@ -0,0 +1,96 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import numpy as np
+import pytest
+from sklearn.mixture import GaussianMixture
+
+from rag.utils.cluster_count import _grid, optimal_clusters
+from rag.utils.cluster_count_benchmark import build_corpus
+
+
+def legacy_optimal_clusters(embeddings, max_clusters, random_state):
+    """RAPTOR's per-n sweep before cluster_count."""
+    n_clusters = np.arange(1, max_clusters)
+    bics = []
+    for n in n_clusters:
+        gm = GaussianMixture(n_components=n, random_state=random_state)
+        gm.fit(embeddings)
+        bics.append(gm.bic(embeddings))
+    return n_clusters[np.argmin(bics)], dict(zip(n_clusters.tolist(), bics))
+
+
+@pytest.fixture(scope="module")
+def corpora():
+    return [build_corpus(150, topics, dim=4, seed=seed) for seed, topics in enumerate([3, 7, 12])]
+
+
+@pytest.fixture(scope="module")
+def legacy(corpora):
+    return [legacy_optimal_clusters(emb, 20, 0) for emb in corpora]
+
+
+class TestOptimalClusters:
+
+    @pytest.mark.parametrize("workers", [1, 3])
+    def test_sweep_same_as_legacy(self, corpora, legacy, workers):
+        for emb, (n, bics) in zip(corpora, legacy):
+            n_sweep, bics_sweep = optimal_clusters(emb, 20, 0, search="sweep", workers=workers)
+            assert n_sweep == n
+            assert bics_sweep.keys() == bics.keys()
+            np.testing.assert_allclose([bics_sweep[k] for k in bics], list(bics.values()))
+
+    def test_coarse_picks_a_close_count(self, corpora, legacy):
+        picked = []
+        for emb, (n, bics) in zip(corpora, legacy):
+            n_coarse, bics_coarse = optimal_clusters(emb, 20, 0, search="coarse", grid=4, workers=2)
+            picked.append(n_coarse == n)
+            assert len(bics_coarse) < len(bics)
+            # a local minimum of the whole BIC curve, about as low as the global one
+            assert all(bics[n_coarse] <= bics[m] for m in (n_coarse - 1, n_coarse + 1) if m in bics)
+            assert bics[n_coarse] - bics[n] <= 0.005 * abs(bics[n])
+            np.testing.assert_allclose([bics_coarse[k] for k in bics_coarse], [bics[k] for k in bics_coarse])
+            # every count next to the pick was fitted
+            assert {n_coarse - 1, n_coarse + 1} & set(bics) <= set(bics_coarse)
+        # the 7 topic corpus has a near tie (within 0.05%) between 6 and 8 components
+        assert sum(picked) >= 2
+
+    def test_small_ranges_are_swept(self, corpora):
+        emb = corpora[0]
+        n, bics = optimal_clusters(emb, 6, 0, search="coarse", grid=8)
+        assert sorted(bics) == [1, 2, 3, 4, 5]
+        assert n == legacy_optimal_clusters(emb, 6, 0)[0]
+
+    @pytest.mark.parametrize("max_clusters", [0, 1, 2])
+    def test_too_few_clusters(self, corpora, max_clusters):
+        assert optimal_clusters(corpora[0], max_clusters, 0) == (1, {})
+
+    def test_check_canceled(self, corpora):
+        rounds = []
+
+        def check_canceled():
+            rounds.append(1)
+            if len(rounds) == 2:
+                raise RuntimeError("canceled")
+
+        with pytest.raises(RuntimeError):
+            optimal_clusters(corpora[1], 20, 0, search="coarse", grid=4, check_canceled=check_canceled)
+        assert len(rounds) == 2
+
+    def test_grid(self):
+        assert _grid(1, 19, 4) == [1, 7, 13, 19]
+        assert _grid(5, 7, 8) == [5, 6, 7]
+        assert _grid(3, 3, 4) == [3]
@@ -0,0 +1,184 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import numpy as np
+import pytest
+from cachetools import LRUCache
+
+from rag.utils import embedding_cache
+from rag.utils.embedding_cache import EMBED_CACHE, cache_model_of, encode_query_with_cache, encode_with_cache, model_key
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def mget(self, keys, binary=False):
+        return [self.data.get(k) for k in keys]
+
+    def mset(self, mapping, exp=3600, binary=False, nx=False):
+        self.data.update(mapping)
+        return True
+
+
+class FakeModel:
+    """Embeds text t as [len(t), 1, 2], counts one token per text."""
+
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts):
+        self.calls.append(list(texts))
+        return np.array([[len(t), 1, 2] for t in texts], dtype=np.float32), len(texts)
+
+    def encode_queries(self, text):
+        self.calls.append([text])
+        return np.array([len(text), 1, 2], dtype=np.float32), 1
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(embedding_cache, "REDIS_CONN", fake)
+    monkeypatch.setattr(embedding_cache, "EMBEDDING_CACHE_ENABLED", 1)
+    EMBED_CACHE.lru.clear()
+    return fake
+
+
+class TestKeys:
+
+    def test_model_key(self):
+        assert model_key("OpenAI", "text-embedding-3-small", "https://api.openai.com/v1") != model_key("Azure-OpenAI", "text-embedding-3-small", "https://x.openai.azure.com")
+        assert model_key("Ollama", "bge-m3", "http://host1:11434") != model_key("Ollama", "bge-m3", "http://host2:11434")
+        assert model_key("Ollama", "bge-m3", None) == model_key("Ollama", "bge-m3", "")
+
+    def test_cache_key(self):
+        a, b = model_key("OpenAI", "m", "u1"), model_key("OpenAI", "m", "u2")
+        assert EMBED_CACHE.key(a, "text") != EMBED_CACHE.key(b, "text")
+        assert EMBED_CACHE.key(a, "text") != EMBED_CACHE.key(a, "text", kind="query")
+        assert EMBED_CACHE.key(a, "text") == EMBED_CACHE.key(a, "text")
+
+    def test_cache_model_of(self):
+
+        class Bundle:
+            llm_name = "m"
+            cache_model = model_key("OpenAI", "m", "u")
+
+        class Plain:
+            llm_name = "m"
+
+        assert cache_model_of(Bundle()) == model_key("OpenAI", "m", "u")
+        assert cache_model_of(Plain()) == "m"
+
+
+class TestEmbeddingCache:
+
+    def test_redis_round_trip(self, redis):
+        mdl = model_key("OpenAI", "m", "u")
+        EMBED_CACHE.set_many(mdl, ["a", "b"], np.array([[1, 2], [3, 4]], dtype=np.float32))
+        EMBED_CACHE.lru.clear()
+        a, b, c = EMBED_CACHE.get_many(mdl, ["a", "b", "c"])
+        np.testing.assert_array_equal(a, [1, 2])
+        np.testing.assert_array_equal(b, [3, 4])
+        assert c is None
+        assert EMBED_CACHE.get(model_key("OpenAI", "m", "other"), "a") is None
+
+    def test_cached_vectors_are_read_only(self, redis):
+        mdl = model_key("OpenAI", "m", "u")
+        vect = np.array([1, 2], dtype=np.float32)
+        EMBED_CACHE.set(mdl, "a", vect)
+        # the cache keeps its own copy
+        vect[0] = 100
+        cached = EMBED_CACHE.get(mdl, "a")
+        np.testing.assert_array_equal(cached, [1, 2])
+        with pytest.raises(ValueError):
+            cached[0] = 100
+
+        EMBED_CACHE.lru.clear()
+        cached = EMBED_CACHE.get(mdl, "a")
+        with pytest.raises(ValueError):
+            cached[0] = 100
+
+    def test_encode_only_misses(self, redis):
+        mdl, fake = model_key("OpenAI", "m", "u"), FakeModel()
+        vts, tokens = encode_with_cache(mdl, ["a", "bb"], fake.encode)
+        assert tokens == 2
+        vts, tokens = encode_with_cache(mdl, ["bb", "ccc", "a"], fake.encode)
+        assert fake.calls == [["a", "bb"], ["ccc"]]
+        assert tokens == 1
+        np.testing.assert_array_equal(vts[:, 0], [2, 3, 1])
+
+        vts, tokens = encode_with_cache(mdl, ["a", "ccc"], fake.encode)
+        assert tokens == 0
+        assert len(fake.calls) == 2
+
+    def test_encoded_vectors_are_writable_copies(self, redis):
+        mdl, fake = model_key("OpenAI", "m", "u"), FakeModel()
+        for _ in range(2):
+            vts, _ = encode_with_cache(mdl, ["a", "bb"], fake.encode)
+            vts *= 0
+        vts, _ = encode_with_cache(mdl, ["a", "bb"], fake.encode)
+        np.testing.assert_array_equal(vts[:, 0], [1, 2])
+
+        for _ in range(2):
+            v, _ = encode_query_with_cache(mdl, "query", fake.encode_queries)
+            v[0] = 0
+        v, tokens = encode_query_with_cache(mdl, "query", fake.encode_queries)
+        assert v[0] == 5 and tokens == 0
+
+    def test_disabled(self, redis, monkeypatch):
+        monkeypatch.setattr(embedding_cache, "EMBEDDING_CACHE_ENABLED", 0)
+        mdl, fake = model_key("OpenAI", "m", "u"), FakeModel()
+        encode_with_cache(mdl, ["a"], fake.encode)
+        encode_with_cache(mdl, ["a"], fake.encode)
+        assert len(fake.calls) == 2
+        assert not redis.data
+
+    def test_memory_bound(self, redis, monkeypatch):
+        mdl = model_key("OpenAI", "m", "u")
+        monkeypatch.setattr(EMBED_CACHE, "lru", LRUCache(maxsize=4 * 1024 * 4, getsizeof=lambda v: v.nbytes))
+        EMBED_CACHE.set_many(mdl, [f"t{i}" for i in range(6)], np.ones((6, 1024), dtype=np.float32))
+        # 4 vectors of 4 KB fit, the others are still in Redis
+        assert len(EMBED_CACHE.lru) == 4
+        assert EMBED_CACHE.lru.currsize == 4 * 1024 * 4
+        assert all(v is not None for v in EMBED_CACHE.get_many(mdl, [f"t{i}" for i in range(6)]))
+        # a vector larger than the whole cache is not kept in process
+        EMBED_CACHE.set(mdl, "huge", np.ones(8192, dtype=np.float32))
+        assert EMBED_CACHE.get(mdl, "huge") is not None
+        assert EMBED_CACHE.lru.currsize <= 4 * 1024 * 4
+
+    def test_unexpected_shape_not_encoded_again(self, redis):
+        mdl, calls = model_key("OpenAI", "m", "u"), []
+        encode_with_cache(mdl, ["a"], FakeModel().encode)
+
+        def ragged(texts):
+            calls.append(list(texts))
+            return [np.ones(len(t)) for t in texts], len(texts)
+
+        vts, tokens = encode_with_cache(mdl, ["a", "bb", "ccc"], ragged)
+        assert calls == [["bb", "ccc"]]
+        assert tokens == 2
+        assert [len(v) for v in vts] == [3, 2, 3]
+        np.testing.assert_array_equal(vts[0], [1, 1, 2])
+        assert EMBED_CACHE.get(mdl, "bb") is None
+
+        def wrong_count(texts):
+            calls.append(list(texts))
+            return np.ones((1, 3)), 1
+
+        vts, _ = encode_with_cache(mdl, ["a", "dd", "eee"], wrong_count)
+        assert calls[-1] == ["dd", "eee"] and len(calls) == 2
+        assert vts.shape == (1, 3)
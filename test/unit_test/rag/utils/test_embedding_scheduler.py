@@ -0,0 +1,162 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import random
+import threading
+import time
+
+import exceptiongroup
+import numpy as np
+import pytest
+import trio
+from trio.testing import MockClock
+
+from rag.utils import embedding_scheduler
+from rag.utils.embedding_scheduler import EmbeddingScheduler, is_batch_too_large, is_rate_limited
+
+
+class FakeModel:
+    """Embeds text i as the vector [i, i], records the size of every batch it gets."""
+
+    def __init__(self, max_batch=None, rate_limited_calls=0, delay=0):
+        self.max_batch = max_batch
+        self.rate_limited_calls = rate_limited_calls
+        self.delay = delay
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def encode(self, texts):
+        with self.lock:
+            self.batches.append(len(texts))
+            if self.rate_limited_calls:
+                self.rate_limited_calls -= 1
+                raise Exception("Error code: 429 - Too Many Requests")
+        if self.max_batch and len(texts) > self.max_batch:
+            raise Exception(f"Error code: 413 - batch size {len(texts)} exceeds the limit of {self.max_batch}")
+        if self.delay:
+            time.sleep(random.uniform(0, self.delay))
+        return np.array([[float(t), float(t)] for t in texts]), len(texts)
+
+
+def run(scheduler, texts, mdl, clock=None):
+    return trio.run(scheduler.encode, texts, mdl.encode, clock=clock)
+
+
+def unwrap(e):
+    while isinstance(e, exceptiongroup.BaseExceptionGroup):
+        e = e.exceptions[0]
+    return e
+
+
+class TestErrorClassification:
+
+    def test_rate_limited(self):
+        assert is_rate_limited(Exception("Error code: 429 - Too Many Requests"))
+        assert is_rate_limited(Exception("Rate limit reached for requests"))
+        assert not is_rate_limited(Exception("Connection reset by peer"))
+
+    def test_batch_too_large(self):
+        assert is_batch_too_large(Exception("413 Payload Too Large"))
+        assert is_batch_too_large(Exception("This model's maximum context length is 8192 tokens"))
+        assert is_batch_too_large(Exception("batch size 64 exceeds the limit of 32"))
+        assert not is_batch_too_large(Exception("Error code: 429 - Too Many Requests"))
+
+
+class TestEmbeddingScheduler:
+
+    def test_defaults_keep_batch_size(self):
+        scheduler = EmbeddingScheduler("fake", batch_size=8)
+        assert scheduler.limiter.total_tokens == embedding_scheduler.EMBEDDING_MAX_INFLIGHT
+        mdl = FakeModel()
+        texts = [str(i) for i in range(100)]
+        buffer, tk_count = run(scheduler, texts, mdl)
+        if not embedding_scheduler.EMBEDDING_MAX_BATCH_SIZE:
+            assert scheduler.batch_size == 8
+            assert max(mdl.batches) == 8
+        assert tk_count == len(texts)
+
+    def test_result_order(self):
+        scheduler = EmbeddingScheduler("fake", batch_size=3, max_inflight=4)
+        mdl = FakeModel(delay=0.01)
+        texts = [str(i) for i in range(50)]
+        buffer, tk_count = run(scheduler, texts, mdl)
+        np.testing.assert_array_equal(buffer.matrix()[:, 0], np.arange(50))
+        assert sum(mdl.batches) == 50
+        assert tk_count == 50
+
+    def test_split_too_large_batches(self):
+        scheduler = EmbeddingScheduler("fake", batch_size=16, max_inflight=2)
+        mdl = FakeModel(max_batch=5)
+        texts = [str(i) for i in range(40)]
+        buffer, tk_count = run(scheduler, texts, mdl)
+        np.testing.assert_array_equal(buffer.matrix()[:, 0], np.arange(40))
+        assert tk_count == 40
+        assert scheduler.batch_size <= 8
+        assert scheduler.max_batch_tokens > 0
+
+    def test_too_large_single_text_fails(self):
+        scheduler = EmbeddingScheduler("fake", batch_size=1)
+
+        def encode(texts):
+            raise Exception("413 Payload Too Large")
+
+        with pytest.raises(Exception) as exc_info:
+            trio.run(scheduler.encode, ["0"], encode)
+        assert "413" in str(unwrap(exc_info.value))
+
+    def test_rate_limit_back_off(self):
+        scheduler = EmbeddingScheduler("fake", batch_size=8)
+        mdl = FakeModel(rate_limited_calls=2)
+        clock = MockClock(autojump_threshold=0)
+        texts = [str(i) for i in range(8)]
+        buffer, tk_count = run(scheduler, texts, mdl, clock)
+        np.testing.assert_array_equal(buffer.matrix()[:, 0], np.arange(8))
+        # the same batch is retried after sleeping, the smaller size only applies to the next ones
+        assert mdl.batches == [8, 8, 8]
+        assert scheduler.batch_size < 8
+        assert clock.current_time() >= 1
+
+    def test_rate_limit_gives_up(self):
+        scheduler = EmbeddingScheduler("fake", batch_size=8)
+        mdl = FakeModel(rate_limited_calls=embedding_scheduler.EMBEDDING_MAX_RETRIES + 1)
+        with pytest.raises(Exception) as exc_info:
+            run(scheduler, ["0"], mdl, MockClock(autojump_threshold=0))
+        assert "429" in str(unwrap(exc_info.value))
+        assert len(mdl.batches) == embedding_scheduler.EMBEDDING_MAX_RETRIES + 1
+
+    def test_grows_only_up_to_max(self):
+        scheduler = EmbeddingScheduler("fake", batch_size=4)
+        scheduler.max_batch_size = 10
+        for _ in range(20):
+            scheduler._on_success(scheduler.batch_size, 0.01)
+        assert scheduler.batch_size == 10
+
+    def test_slow_batches_shrink_to_configured_size(self):
+        scheduler = EmbeddingScheduler("fake", batch_size=4)
+        scheduler.max_batch_size = 32
+        scheduler.batch_size = 32
+        for _ in range(20):
+            scheduler._on_success(scheduler.batch_size, embedding_scheduler.EMBEDDING_TARGET_LATENCY * 2)
+        assert scheduler.batch_size == 4
+
+    def test_recovers_after_rate_limit(self):
+        scheduler = EmbeddingScheduler("fake", batch_size=8)
+        scheduler._on_rate_limited()
+        scheduler._on_rate_limited()
+        assert scheduler.batch_size == 2
+        for _ in range(20):
+            scheduler._on_success(scheduler.batch_size, embedding_scheduler.EMBEDDING_TARGET_LATENCY * 0.9)
+        assert scheduler.batch_size == 8
@@ -0,0 +1,102 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import pytest
+from elastic_transport import ConnectionTimeout
+
+from rag.utils import es_conn
+from rag.utils.doc_store_conn import OrderByExpr
+
+# the class behind the singleton factory
+ESConnection = next(c.cell_contents for c in es_conn.ESConnection.__closure__ if isinstance(c.cell_contents, type))
+
+
+class FakeES:
+
+    def __init__(self, chunks, fail=()):
+        self.chunks = chunks
+        # numbers of the requests, counted from 0, that time out
+        self.fail = set(fail)
+        self.requests = 0
+        self.closed = []
+
+    def _request(self):
+        n, self.requests = self.requests, self.requests + 1
+        if n in self.fail:
+            raise ConnectionTimeout("timed out")
+
+    def open_point_in_time(self, index, keep_alive):
+        self._request()
+        return {"id": "pit0"}
+
+    def search(self, body, timeout):
+        self._request()
+        start = body.get("search_after", [-1])[0] + 1
+        hits = [{"_id": f"c{i}", "_score": None, "_source": {"content_with_weight": f"chunk {i}"}, "sort": [i]}
+                for i in range(start, min(start + body["size"], self.chunks))]
+        return {"pit_id": f"pit{start}", "timed_out": False, "hits": {"hits": hits}}
+
+    def close_point_in_time(self, id):
+        self.closed.append(id)
+
+
+def connection(es, monkeypatch):
+    conn = object.__new__(ESConnection)
+    conn.es = es
+    conn.reconnects = 0
+
+    def reconnect():
+        conn.reconnects += 1
+        return True
+
+    monkeypatch.setattr(conn, "_connect", reconnect, raising=False)
+    return conn
+
+
+def iter_chunks(conn, page_size=2):
+    return conn.iter_chunks(["content_with_weight"], {"doc_id": "d1"}, OrderByExpr(), "ragflow_t1", ["kb1"], page_size)
+
+
+class TestIterChunks:
+
+    def test_pages(self, monkeypatch):
+        es = FakeES(5)
+        pages = list(iter_chunks(connection(es, monkeypatch)))
+        assert [list(page) for page in pages] == [["c0", "c1"], ["c2", "c3"], ["c4"]]
+        assert es.closed == ["pit4"]
+
+    @pytest.mark.parametrize("fail", [(0,), (2,), (3,)])
+    def test_timeouts_are_retried(self, monkeypatch, fail):
+        es = FakeES(5, fail)
+        conn = connection(es, monkeypatch)
+        pages = list(iter_chunks(conn))
+        assert [list(page) for page in pages] == [["c0", "c1"], ["c2", "c3"], ["c4"]]
+        assert conn.reconnects == 1
+
+    def test_repeated_timeouts_raise_and_close(self, monkeypatch):
+        es = FakeES(5, (2, 3))
+        chunks = iter_chunks(connection(es, monkeypatch))
+        assert list(next(chunks)) == ["c0", "c1"]
+        with pytest.raises(Exception, match="timeout"):
+            next(chunks)
+        assert es.closed == ["pit0"]
+
+    def test_closed_when_the_caller_stops(self, monkeypatch):
+        es = FakeES(5)
+        chunks = iter_chunks(connection(es, monkeypatch))
+        next(chunks)
+        chunks.close()
+        assert es.closed == ["pit0"]
@@ -0,0 +1,173 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import time
+
+import numpy as np
+import pytest
+
+from rag.utils import redis_conn, retrieval_cache
+from rag.utils.retrieval_cache import RETRIEVAL_CACHE
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, k):
+        return self.data.get(k)
+
+    def set(self, k, v, exp=3600):
+        self.data[k] = v
+        return True
+
+    def mget(self, keys, binary=False):
+        return [self.data.get(k) for k in keys]
+
+    def mset(self, mapping, exp=3600, binary=False, nx=False):
+        for k, v in mapping.items():
+            if not nx or k not in self.data:
+                self.data[k] = v
+        return True
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(redis_conn, "REDIS_CONN", fake)
+    monkeypatch.setattr(retrieval_cache, "RETRIEVAL_CACHE_ENABLED", 1)
+    RETRIEVAL_CACHE.lru.clear()
+    return fake
+
+
+def settled(redis, *kb_ids, age=1):
+    stamp = str(int((time.time() - 2 * retrieval_cache.RETRIEVAL_CACHE_SETTLE - age) * 1000))
+    for kb_id in kb_ids:
+        redis.data[f"kbver:{kb_id}"] = stamp
+
+
+def params(question="what is ragflow"):
+    return RETRIEVAL_CACHE.params(question, None, "t1", ["kb1"], 1, 10, 0.2, 0.3, 1024, None, True, None, False, None)
+
+
+def ranks():
+    return {
+        "total": 2,
+        "chunks": [
+            {"chunk_id": "c1", "similarity": np.float32(0.9), "vector": [0.1, 0.2, 0.3]},
+            {"chunk_id": "c2", "similarity": np.float64(0.5), "vector": np.array([0.4, 0.5, 0.6])},
+        ],
+        "doc_aggs": [{"doc_name": "d", "doc_id": "d1", "count": np.int64(2)}],
+    }
+
+
+class TestRetrievalCache:
+
+    def test_missing_version_bypasses(self, redis):
+        assert RETRIEVAL_CACHE.lookup(["kb1"], params()) == (None, None)
+        # the stamp is created, the next lookup may cache once it settled
+        assert "kbver:kb1" in redis.data
+
+    def test_settle_window(self, redis):
+        redis.data["kbver:kb1"] = str(int(time.time() * 1000))
+        cached, key = RETRIEVAL_CACHE.lookup(["kb1"], params())
+        assert cached is None and key is None
+        settled(redis, "kb1")
+        cached, key = RETRIEVAL_CACHE.lookup(["kb1"], params())
+        assert cached is None and key
+
+    def test_store_and_hit(self, redis):
+        settled(redis, "kb1")
+        _, key = RETRIEVAL_CACHE.lookup(["kb1"], params())
+        res = ranks()
+        RETRIEVAL_CACHE.store(key, res)
+        # the caller's result is left untouched
+        assert res["chunks"][0]["vector"] == [0.1, 0.2, 0.3]
+
+        cached, key2 = RETRIEVAL_CACHE.lookup(["kb1"], params("what  is ragflow "))
+        assert key2 is None
+        assert [ck["chunk_id"] for ck in cached["chunks"]] == ["c1", "c2"]
+        assert cached["chunks"][0]["similarity"] == pytest.approx(0.9)
+        assert cached["doc_aggs"][0]["count"] == 2
+        np.testing.assert_allclose([ck["vector"] for ck in cached["chunks"]], [[0.1, 0.2, 0.3], [0.4, 0.5, 0.6]], rtol=1e-6)
+
+    def test_vectors_are_not_stored_as_lists(self, redis):
+        settled(redis, "kb1")
+        _, key = RETRIEVAL_CACHE.lookup(["kb1"], params())
+        RETRIEVAL_CACHE.store(key, ranks())
+        assert '"vector"' not in redis.data[key]
+
+    def test_redis_hit(self, redis):
+        settled(redis, "kb1")
+        _, key = RETRIEVAL_CACHE.lookup(["kb1"], params())
+        RETRIEVAL_CACHE.store(key, ranks())
+        RETRIEVAL_CACHE.lru.clear()
+        before = RETRIEVAL_CACHE.stats()["redis_hit"]
+        cached, _ = RETRIEVAL_CACHE.lookup(["kb1"], params())
+        assert cached["total"] == 2
+        assert RETRIEVAL_CACHE.stats()["redis_hit"] == before + 1
+
+    def test_invalidate(self, redis):
+        settled(redis, "kb1", "kb2")
+        _, key = RETRIEVAL_CACHE.lookup(["kb1", "kb2"], params())
+        RETRIEVAL_CACHE.store(key, ranks())
+        RETRIEVAL_CACHE.invalidate(["kb2"])
+        cached, key2 = RETRIEVAL_CACHE.lookup(["kb1", "kb2"], params())
+        assert cached is None
+        # a fresh change is not cached until it settled
+        assert key2 is None
+        # a stamp of its own, the first one may fall in the same millisecond
+        settled(redis, "kb2", age=0)
+        cached, key2 = RETRIEVAL_CACHE.lookup(["kb1", "kb2"], params())
+        assert cached is None and key2 != key
+
+    def test_invalidates_retrieval_cache(self, redis):
+
+        class Store:
+            @retrieval_cache.invalidates_retrieval_cache
+            def delete(self, condition, indexName, knowledgebaseId):
+                raise RuntimeError("doc store down")
+
+        settled(redis, "kb1")
+        old = redis.data["kbver:kb1"]
+        with pytest.raises(RuntimeError):
+            Store().delete({}, "idx", knowledgebaseId="kb1")
+        assert redis.data["kbver:kb1"] != old
+
+    def test_index_version(self, redis):
+        settled(redis, "kb1")
+        assert RETRIEVAL_CACHE.lookup(["kb1"], params(), ["ragflow_t1"]) == (None, None)
+        redis.data["idxver:ragflow_t1"] = redis.data["kbver:kb1"]
+        _, key = RETRIEVAL_CACHE.lookup(["kb1"], params(), ["ragflow_t1"])
+        RETRIEVAL_CACHE.store(key, ranks())
+        assert RETRIEVAL_CACHE.lookup(["kb1"], params(), ["ragflow_t1"])[0]["total"] == 2
+        RETRIEVAL_CACHE.invalidate_index("ragflow_t1")
+        assert RETRIEVAL_CACHE.lookup(["kb1"], params(), ["ragflow_t1"]) == (None, None)
+
+    def test_index_wide_changes_invalidate(self, redis):
+
+        class Store:
+            @retrieval_cache.invalidates_retrieval_cache
+            def deleteIdx(self, indexName, knowledgebaseId):
+                pass
+
+        settled(redis, "kb1")
+        redis.data["idxver:ragflow_t1"] = old = redis.data["kbver:kb1"]
+        Store().deleteIdx("ragflow_t1", "")
+        assert redis.data["idxver:ragflow_t1"] != old
+        assert redis.data["kbver:kb1"] == old
+        Store().deleteIdx("ragflow_t1", "kb1")
+        assert redis.data["kbver:kb1"] != old